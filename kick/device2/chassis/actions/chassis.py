@@ -11,6 +11,10 @@ import os.path
 
 from kick.device2.general.actions.power_bar import power_cycle_all_ports
 from kick.device2.general.actions.basic import BasicDevice, BasicLine
+from kick.device2.general.actions.instrumentation import instrumented
+from kick.device2.general.actions.phase_timer import timed_phases
+from kick.device2.general.actions.readiness import wait_until, is_dme_available, is_prompt_responsive, \
+    DME_READY_TIMEOUT, REBOOT_READY_TIMEOUT
 from .patterns import ChassisPatterns
 from .statemachine import ChassisStateMachine
 
@@ -19,6 +23,8 @@ try:
 except ImportError:
     from kick.metrics.metrics import publish_kick_metric
 
+from kick.servers.mirror import rewrite_artifact_url
+
 KICK_EXTERNAL = False
 
 try:
@@ -156,12 +162,13 @@ class ChassisLine(BasicLine):
         ])
         d1.process(self.spawn_id, timeout=60)
 
-        # sleep 120 seconds to avoid errors like:
+        # wait for DME to avoid errors like:
         # FPR4120-1-A# scope system
         # Software Error: Exception during execution:
         # [Error: Timed out communicating with DME]
         # after chasis is upgraded, device is rebooted
-        time.sleep(120)
+        wait_until(lambda: is_dme_available(self, state='mio_state'), DME_READY_TIMEOUT,
+                   name='DME availability', raise_on_timeout=False)
         self.execute_lines('\n')
         self.init_terminal()
 
@@ -292,6 +299,8 @@ class ChassisLine(BasicLine):
         :param file_server_password: sftp server password
 
         """
+        csp_url, file_server_password = rewrite_artifact_url(csp_url, file_server_password)
+
         self.go_to('mio_state')
         image_name = os.path.basename(csp_url)
         app_version = re.search(r'\d+\.\d+\.\d+\.\d+', image_name).group(0)
@@ -967,6 +976,7 @@ class ChassisLine(BasicLine):
 
         return profile_list
 
+    @instrumented('wait_till')
     def wait_till(self, stop_func, stop_func_args, wait_upto=300,
                   sleep_step=10):
         """Wait till stop_func returns True.
@@ -1817,7 +1827,10 @@ class ChassisLine(BasicLine):
 
             logger.info('==== Reconnect after reboot...')
             # Wait for reboot to finish and reconnect
-            time.sleep(480)
+            wait_until(lambda: is_prompt_responsive(self, [self.sm.patterns.prompt.prelogin_prompt,
+                                                           self.sm.get_state('mio_state').pattern]),
+                       REBOOT_READY_TIMEOUT, interval=30, name='console after reboot',
+                       raise_on_timeout=False)
             self.monitor_installation(version=version, timeout=2400)
 
             # set disconnect timeout to maximum
@@ -2136,6 +2149,7 @@ class ChassisLine(BasicLine):
             then continue normally with the scp download
 
         """
+        fxos_url, file_server_password = rewrite_artifact_url(fxos_url, file_server_password)
 
         bundle_package_name = fxos_url.split("/")[-1].strip()
         version = self.get_bundle_package_version(bundle_package_name)
@@ -3364,6 +3378,7 @@ class ChassisLine(BasicLine):
 
         self.configure_logical_device_clustered(chassis_data)
 
+    @timed_phases('chassis')
     def baseline_fxos_and_apps(self, fxos_url, csp_urls, scp_password,
                                chassis_data, http_url,
                                wait_for_app_to_start=1800):
@@ -3392,28 +3407,34 @@ class ChassisLine(BasicLine):
         self.set_default_auth_timeouts()
 
         # cleanup
+        self.begin_phase('cleanup')
         self.cleanup_chassis(chassis_data)
 
         # power cycle
         power_cycle_before_baseline = self.power_cycle_before_baseline(
             chassis_data)
         if power_cycle_before_baseline:
+            self.begin_phase('power_cycle')
             self.set_power_bar(chassis_data['custom']['chassis_power'])
             self.power_cycle(wait_until_device_is_on=True,
                              timeout=900)
 
         # configure chassis network settings
+        self.begin_phase('bootstrap')
         self.configure_chassis_network(
             chassis_data['custom']['chassis_network'])
 
         # install os
         if chassis_data['custom']['chassis_software'].get('install_fxos', True):
+            self.begin_phase('fxos_install', image=fxos_url)
             self.install_fxos(fxos_url, scp_password, http_url)
 
         for csp_url in csp_urls:
             # download application
+            self.begin_phase('download', image=csp_url)
             self.download_csp(csp_url, scp_password)
 
+        self.begin_phase('configure')
         self.configure_chassis_interfaces(
             chassis_data['custom']['chassis_network'])
 
@@ -3424,6 +3445,7 @@ class ChassisLine(BasicLine):
         # accept license agreement for apps that will be installed on slots
         self.accept_license_agreement(chassis_data)
 
+        self.begin_phase('install')
         if self.is_clustered(chassis_data):
             self.baseline_clustered(chassis_data)
         else:
@@ -3431,6 +3453,7 @@ class ChassisLine(BasicLine):
 
         self.wait_for_baseline_app_creation(chassis_data, wait_for_app_to_start)
 
+        self.begin_phase('verify')
         self.do_extra_checks_after_baseline(chassis_data)
 
         logger.info('Baseline finished successfully.')
@@ -519,7 +519,7 @@ class Elektra5585Line(BasicLine):
                 self.power_cycle(pdu_ip, pdu_port, wait_until_device_is_on=False, power_bar_user=pdu_user,
                                  power_bar_pwd=pdu_pwd)
             try:
-                self.spawn_id.expect('Use (.*?BREAK.*?|.*?ESC.*?) to interrupt boot', timeout=120)
+                self.wait_for_prompt('Use (.*?BREAK.*?|.*?ESC.*?) to interrupt boot', timeout=120)
             except TimeoutError:
                 RuntimeError(">>>>>> Failed to stop rebooting")
             logger.info('Drop the device to rommon.')
@@ -33,6 +33,7 @@ from unicon.eal.utils import ExpectMatch
 from pathlib import PurePosixPath
 from ...general.actions.basic import BasicDevice, BasicLine
 from kick.device2.general.actions.power_bar import power_cycle_all_ports
+from ...general.actions.phase_timer import timed_phases
 
 try:
     import kick.graphite.graphite as graphite
@@ -665,6 +666,7 @@ class Ftd5500xLine(BasicLine):
                                'ftd package image: {}'.format(response,
                                                               ftd_package_file))
 
+    @timed_phases('ftd5500x')
     def rommon_to_new_image(self, rommon_tftp_server, pkg_image,
                             uut_ip, uut_netmask, uut_gateway, rommon_image, dns_server,
                             hostname='firepower', search_domains='cisco.com',
@@ -733,6 +735,7 @@ class Ftd5500xLine(BasicLine):
         self.manager = manager
         self.manager_key = manager_key
         self.manager_nat_id = manager_nat_id
+        self.begin_phase('reboot')
         if not (self.sm.current_state in ['rommon_state', 'boot_state']):
             if not power_cycle_flag:
                 if self.sm.current_state is 'disable_state':
@@ -747,10 +750,11 @@ class Ftd5500xLine(BasicLine):
                     self.go_to('sudo_state')
                     self.spawn_id.sendline('reboot')
                     try:
-                        self.spawn_id.expect('Rebooting...', timeout=300)
+                        self.wait_for_prompt('Rebooting...', timeout=300)
                     except TimeoutError:
                         raise RuntimeError(">>>>>> Failed to reboot the device. Probably hanged during reboot?")
             else:
+                self.begin_phase('power_cycle')
                 logger.info('Power cycle the device ...')
                 self.power_cycle(pdu_ip, pdu_port, wait_until_device_is_on=False, power_bar_user=pdu_user,
                                  power_bar_pwd=pdu_pwd)
@@ -767,6 +771,7 @@ class Ftd5500xLine(BasicLine):
             d1.process(self.spawn_id, timeout=30)
             self.rommon_go_to()
 
+        self.begin_phase('rommon_download', image=rommon_image)
         self.rommon_config(is_device_kenton)
 
         logger.info('tftpdnld - tftp server: {}, '
@@ -779,14 +784,18 @@ class Ftd5500xLine(BasicLine):
             self.rommon_boot(timeout=timeout)
 
         self.go_to('any')
+        self.begin_phase('bootstrap')
         logger.info('firepower boot configure ...')
         self.firepower_boot_configure()
+        self.begin_phase('install', image=pkg_image)
         logger.info('FTD image install - image: {} ...'.format(pkg_image))
         self.firepower_install()
         self.go_to('any')
         if self.manager is not None and self.mode != 'local':
+            self.begin_phase('register')
             logger.info('Configure manager')
             self.configure_manager()
+        self.begin_phase('verify')
         logger.info('Validate version installed')
         self.validate_version()
         logger.info('Installation completed successfully.')
@@ -1,6 +1,12 @@
 """Methods to check whether device is available via its console."""
 
+import atexit
+import concurrent.futures
+import errno
+import functools
 import logging
+import socket
+import threading
 import time
 
 try:
@@ -22,9 +28,22 @@ DEFAULT_TIMEOUT = 60
 DEFAULT_USERNAME = 'myusername'
 DEFAULT_PASSWORD = 'mypassword'
 DEFAULT_ENPASSWORD = 'myenpassword'
-
-VALID_PROMPTS = ['ciscoasa>', '\r\nciscoasa:~\$', '.*login:', 'rommon.*>', '.*-boot>', '\r\n[\x07]?>', '.*# $',
-                 '\r\n.*@.*\$ $']
+# seconds the roty to tty table of a terminal server is cached
+LINE_MAP_TTL = 300
+# seconds an unused terminal server session is kept for the next clear_line()
+TS_SESSION_IDLE_TIMEOUT = 120
+# seconds is_available() waits for a valid prompt
+DEFAULT_PROMPT_TIMEOUT = 900
+# number of consoles probed at the same time by probe_consoles()
+DEFAULT_PROBE_WORKERS = 20
+# seconds a probe of probe_consoles() waits for each step of the login and for a valid prompt
+DEFAULT_PROBE_TIMEOUT = 60
+# seconds of the tcp connect pre-check
+TCP_CHECK_TIMEOUT = 3
+
+# prompts of a booted device; the prompt given to is_available() is added per call
+VALID_PROMPTS = ('ciscoasa>', '\r\nciscoasa:~\$', '.*login:', 'rommon.*>', '.*-boot>', '\r\n[\x07]?>', '.*# $',
+                 '\r\n.*@.*\$ $')
 
 def wait_until_available(host, port, timeout=300, user=DEFAULT_USERNAME,
                          pwd=DEFAULT_PASSWORD, prompt='login:', access='telnet'):
@@ -46,9 +65,9 @@ def wait_until_available(host, port, timeout=300, user=DEFAULT_USERNAME,
                 % (host, port, timeout))
 
     if user == DEFAULT_USERNAME:
-        user = get_username(user)
+        user = get_username(user, host)
     if pwd == DEFAULT_PASSWORD:
-        pwd = get_password(pwd)
+        pwd = get_password(pwd, host)
 
     first_time = True
     start_time = time.time()
@@ -65,7 +84,7 @@ def wait_until_available(host, port, timeout=300, user=DEFAULT_USERNAME,
 
 
 def is_available(host, port, user=DEFAULT_USERNAME, pwd=DEFAULT_PASSWORD,
-                 prompt='firepower login:', access='telnet'):
+                 prompt='firepower login:', access='telnet', timeout=DEFAULT_PROMPT_TIMEOUT):
     """Checks whether device is available.
 
     :param host: Ip of the device/console
@@ -74,16 +93,16 @@ def is_available(host, port, user=DEFAULT_USERNAME, pwd=DEFAULT_PASSWORD,
     :param pwd: password
     :param prompt: expected prompt
     :param access: type of access: telnet or ssh
+    :param timeout: how long to wait for a valid prompt, in seconds
     :return: True if device is available, False if it's not
 
     """
 
     if user == DEFAULT_USERNAME:
-        user = get_username(user)
+        user = get_username(user, host)
     if pwd == DEFAULT_PASSWORD:
-        pwd = get_password(pwd)
+        pwd = get_password(pwd, host)
 
-    VALID_PROMPTS.append(prompt)
     if access == 'telnet':
         spawn_id = Spawn('telnet {} {}\n'.format(host, port))
         try:
@@ -107,7 +126,7 @@ def is_available(host, port, user=DEFAULT_USERNAME, pwd=DEFAULT_PASSWORD,
             LOGGER.debug("'Password OK' message did not appear ... continue")
         spawn_id.sendline('')
         try:
-            __wait_for_rommon(spawn_id, 900)
+            __wait_for_rommon(spawn_id, timeout, prompt)
         except:
             LOGGER.info("\nFailed to get a valid prompt")
             spawn_id.close()
@@ -125,7 +144,7 @@ def is_available(host, port, user=DEFAULT_USERNAME, pwd=DEFAULT_PASSWORD,
                 ['(P|p)assword:', 'sendline({})'.format(pwd), None, False, False],
                 ['Connection refused', None, None, False, False],
             ])
-            d1.process(spawn_id, timeout=60)
+            d1.process(spawn_id, timeout=min(60, timeout))
             try:
                 spawn_id.expect("Password OK.*")
             except:
@@ -133,7 +152,7 @@ def is_available(host, port, user=DEFAULT_USERNAME, pwd=DEFAULT_PASSWORD,
             spawn_id.sendline()
             time.sleep(10)
             try:
-                __wait_for_rommon(spawn_id, 900)
+                __wait_for_rommon(spawn_id, timeout, prompt)
             except:
                 LOGGER.info("\nFailed to get a valid prompt")
                 spawn_id.close()
@@ -148,37 +167,201 @@ def is_available(host, port, user=DEFAULT_USERNAME, pwd=DEFAULT_PASSWORD,
     return True
 
 
-def __wait_for_rommon(spawn_id, timeout):
+def is_port_open(host, port, timeout=TCP_CHECK_TIMEOUT):
+    """Checks whether a tcp connection to a port can be established.
+
+    :param host: Ip of the device/console
+    :param port: tcp port
+    :param timeout: in seconds
+    :return: None if the port accepted the connection, otherwise the reason
+             ('refused', 'timeout' or the error message)
+
+    """
+
+    try:
+        with socket.create_connection((host, int(port)), timeout=timeout):
+            return None
+    except ConnectionRefusedError:
+        return 'refused'
+    except socket.timeout:
+        return 'timeout'
+    except OSError as e:
+        if e.errno == errno.ECONNREFUSED:
+            return 'refused'
+        return str(e)
+
+
+class ProbeResult:
+    """Result of the probe of a console.
+
+    host, port: the console
+    available: True/False
+    reason: why the console is not available, None if it is
+    duration: duration of the probe, in seconds
+
+    """
+
+    def __init__(self, host, port, available, reason=None, duration=0):
+        self.host = host
+        self.port = port
+        self.available = available
+        self.reason = reason
+        self.duration = duration
+
+    def __repr__(self):
+        return 'ProbeResult({}:{} available={} reason={})'.format(
+            self.host, self.port, self.available, self.reason)
+
+
+def probe_console(host, port, user=DEFAULT_USERNAME, pwd=DEFAULT_PASSWORD,
+                  prompt='firepower login:', access='telnet', timeout=DEFAULT_PROBE_TIMEOUT):
+    """Checks whether a console is available, without raising exceptions.
+
+    A tcp connection is tried first: a terminal server that can not be
+    reached is reported without spawning telnet/ssh. A refused connection
+    still goes through is_available(), which clears a busy line.
+
+    :param host: Ip of the console
+    :param port: console port
+    :param user: username
+    :param pwd: password
+    :param prompt: expected prompt
+    :param access: type of access: telnet or ssh
+    :param timeout: how long to wait for a valid prompt, in seconds
+    :return: a ProbeResult object
+
+    """
+
+    start_time = time.time()
+    reason = is_port_open(host, port)
+    if reason not in (None, 'refused'):
+        return ProbeResult(host, port, False, 'tcp {}'.format(reason), time.time() - start_time)
+    try:
+        available = is_available(host, port, user, pwd, prompt, access, timeout=timeout)
+        reason = None if available else 'no valid prompt'
+    except Exception as e:
+        available, reason = False, '{}: {}'.format(type(e).__name__, str(e))
+    return ProbeResult(host, port, available, reason, time.time() - start_time)
+
+
+def probe_consoles(consoles, user=DEFAULT_USERNAME, pwd=DEFAULT_PASSWORD,
+                   prompt='firepower login:', access='telnet', timeout=DEFAULT_PROBE_TIMEOUT,
+                   max_workers=DEFAULT_PROBE_WORKERS):
+    """Checks concurrently whether consoles are available.
+
+    :param consoles: list of (host, port) tuples; a dict with the keyword
+                     arguments of probe_console() can be given instead of a
+                     tuple to override user, pwd, prompt, access or timeout
+    :param user: username
+    :param pwd: password
+    :param prompt: expected prompt
+    :param access: type of access: telnet or ssh
+    :param timeout: how long each probe waits for a valid prompt, in seconds
+    :param max_workers: number of consoles probed at the same time
+    :return: list of ProbeResult objects, in the order of consoles
+
+    """
+
+    # the credentials of each console are resolved by is_available(), per terminal server
+    defaults = {'user': user, 'pwd': pwd, 'prompt': prompt, 'access': access, 'timeout': timeout}
+    probes = []
+    for console in consoles:
+        kwargs = dict(defaults)
+        if isinstance(console, dict):
+            kwargs.update(console)
+        else:
+            kwargs['host'], kwargs['port'] = console
+        probes.append(kwargs)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(min(max_workers, len(probes)), 1)) as executor:
+        results = list(executor.map(lambda kwargs: probe_console(**kwargs), probes))
+    LOGGER.info(summarize_probe_results(results))
+    return results
+
+
+def wait_until_all_available(consoles, timeout=300, interval=5,
+                             probe_timeout=DEFAULT_PROBE_TIMEOUT, **kwargs):
+    """Probe consoles concurrently until all of them are available or the
+    timeout expires; only the consoles not available yet are probed again.
+
+    :param consoles: list of consoles, see probe_consoles()
+    :param timeout: in seconds
+    :param interval: delay between two rounds of probes, in seconds
+    :param probe_timeout: how long each probe waits for a valid prompt, in seconds
+    :param kwargs: other arguments of probe_consoles()
+    :return: list of the last ProbeResult of each console, in the order of consoles
+
+    """
+
+    start_time = time.time()
+    results = [None] * len(consoles)
+    pending = list(range(len(consoles)))
+    while True:
+        round_results = probe_consoles([consoles[i] for i in pending],
+                                       timeout=probe_timeout, **kwargs)
+        for i, result in zip(pending, round_results):
+            results[i] = result
+        pending = [i for i in pending if not results[i].available]
+        if not pending or time.time() - start_time + interval >= timeout:
+            break
+        time.sleep(interval)
+    if pending:
+        LOGGER.error('{} of {} consoles not available in {} seconds'.format(
+            len(pending), len(consoles), timeout))
+    return results
+
+
+def summarize_probe_results(results):
+    """Summary of probe results, with the reason of each unavailable console.
+
+    :param results: list of ProbeResult objects
+    :return: the summary as a string
+
+    """
+
+    available = [r for r in results if r.available]
+    lines = ['{} of {} consoles available'.format(len(available), len(results))]
+    for r in results:
+        if not r.available:
+            lines.append('  {}:{} not available ({}) after {} seconds'.format(
+                r.host, r.port, r.reason, round(r.duration, 1)))
+    return '\n'.join(lines)
+
+
+@functools.lru_cache(maxsize=128)
+def valid_prompts_pattern(*prompts):
+    """Single alternation of VALID_PROMPTS and additional prompts.
+
+    The string is built once per set of additional prompts; Dialog
+    compiles it when waiting.
+
+    :param prompts: prompts added to VALID_PROMPTS, such as 'firepower login:'
+    :return: the pattern, as a string
+    """
+
+    alternatives = list(VALID_PROMPTS)
+    for prompt in prompts:
+        if prompt and prompt not in alternatives:
+            alternatives.append(prompt)
+    return '|'.join('(?:{})'.format(p) for p in alternatives)
+
+
+def __wait_for_rommon(spawn_id, timeout, *prompts):
     # The system will reboot, wait for the following prompts
     d = Dialog([['Use BREAK or ESC to interrupt boot', 'sendline({})'.format(chr(27)), None, True, False],
+                [valid_prompts_pattern(*prompts), None, None, False, False],
                 ])
-    
-    for prompt in VALID_PROMPTS:
-        d.append([prompt, None, None, False, False], )
 
     d.process(spawn_id, timeout=timeout)
 
 
-def tty_id_from_roty_id(spawn, port):
+def parse_show_line(output):
     """
-        Function that determines the tty identifier from the roty port
-        :param spawn: the spawn connection
-        :param port: the roty port
-        :return: the tty identifier for the line
+        Function that parses the output of 'show line' of a terminal server
+        :param output: the output of 'show line'
+        :return: a dict mapping each roty port to its tty identifier
     """
-    spawn.sendline('terminal length 30\n')
-    spawn.sendline('show line\n')
-    time.sleep(3)
-    output_lines = []
-    # parse show line output into lines list
-    while True:
-        match_output = spawn.expect('.*').match_output
-        output_lines.extend(match_output.split('\n'))
-        if '--More--' in match_output:
-            spawn.sendline('\x20')
-            time.sleep(3)
-        else:
-            break
+    output_lines = output.split('\n')
 
     # determine header column indexes
     header = None
@@ -204,7 +387,7 @@ def tty_id_from_roty_id(spawn, port):
                 # is not separated by a space from the following
                 # column we need to separate it manually
                 # for consistency
-                if output_lines[i][1] != ' ':
+                if len(output_lines[i]) > 1 and output_lines[i][1] != ' ':
                     output_lines[i] = output_lines[i][0] + ' ' + output_lines[i][1:]
             else:
                 # and make uniform the rest of the lines also with a dummy character
@@ -226,55 +409,104 @@ def tty_id_from_roty_id(spawn, port):
     header_roty_index += 1
     header_tty_index += 1
 
-    # determine tty line id from roty id
-    line_id = None
+    # map roty ids to tty line ids; the first line of a roty id wins
+    line_map = {}
     for line in output_lines:
         fields = tuple(line.split())
         try:
-            if int(fields[header_roty_index]) == port:
-                line_id = fields[header_tty_index]
-                break
+            line_map.setdefault(int(fields[header_roty_index]), fields[header_tty_index])
         except:
             # if we cannot convert the roty id to an int
             # we consider that things are not correctly configured
             # and go to the next output line and continue searching
             pass
-    return line_id
+    return line_map
 
 
-def clear_line(host, port, user=DEFAULT_USERNAME, pwd=DEFAULT_PASSWORD, prompt='#',
-               access='telnet', en_password=DEFAULT_ENPASSWORD, timeout=None):
-    """Clear line corresponding to a device; this is required because only a
-    single console connection is available.
+def fetch_line_map(spawn, prompt='#', timeout=DEFAULT_TIMEOUT):
+    """
+        Function that reads the roty to tty table of a terminal server
+        in a single unpaged 'show line'
+        :param spawn: the spawn connection, in enable mode
+        :param prompt: the prompt of the terminal server
+        :param timeout: in seconds
+        :return: a dict mapping each roty port to its tty identifier
+    """
+    spawn.sendline('terminal length 0')
+    spawn.expect(r'{}\s*$'.format(prompt), timeout=timeout)
+    spawn.sendline('show line')
+    spawn.expect('show line', timeout=timeout)
+    output = []
+    while True:
+        response = spawn.expect(['--More--', r'{}\s*$'.format(prompt)], timeout=timeout)
+        output.append(response.match_output)
+        if response.last_match.re.pattern != '--More--':
+            break
+        # only if the terminal server ignored 'terminal length 0'
+        spawn.send(' ')
+    return parse_show_line(''.join(output))
+
+
+class LineMapCache:
+    """Roty to tty tables of the terminal servers, each one kept for ttl seconds."""
+
+    def __init__(self, ttl=LINE_MAP_TTL):
+        self.ttl = ttl
+        self.line_maps = {}
+
+    def get(self, host):
+        """
+        :param host: ip address of terminal server
+        :return: the cached table, or None if missing or expired
+        """
+        entry = self.line_maps.get(host)
+        if entry and time.time() - entry[0] < self.ttl:
+            return entry[1]
+        return None
+
+    def set(self, host, line_map):
+        self.line_maps[host] = (time.time(), line_map)
+
+    def invalidate(self, host=None):
+        """Forget the table of a terminal server, or of all of them."""
+        if host is None:
+            self.line_maps.clear()
+        else:
+            self.line_maps.pop(host, None)
 
-    If somebody or some process failed to close the connection, it
-    should be cleared explicitly.
-    
-    This function accepts only ssh and telnet connections.
 
-    :param host: ip address of terminal server
-    :param port: device line number in terminal server to be cleared
-                for example, if port 2005 is mapped to line 5, port=5
-    :param user: username
-    :param pwd: password
-    :param prompt: expected prompt after logging in
-    :param access: ssh or telnet; default is set to telnet
-    :param en_password: enable password to switch to line configuration mode
-    :param timeout: how long the connection and authentication would take in seconds;
-                    if not provided, default is 60s
-    :return: None
-    
+LINE_MAP_CACHE = LineMapCache()
+
+
+def tty_id_from_roty_id(spawn, port, host=None, prompt='#'):
+    """
+        Function that determines the tty identifier from the roty port
+        :param spawn: the spawn connection
+        :param port: the roty port
+        :param host: ip address of the terminal server; if given, the roty
+                     to tty table is cached in LINE_MAP_CACHE
+        :param prompt: the prompt of the terminal server
+        :return: the tty identifier for the line
     """
+    line_map = LINE_MAP_CACHE.get(host) if host else None
+    if line_map is None or port not in line_map:
+        line_map = fetch_line_map(spawn, prompt)
+        if host:
+            LINE_MAP_CACHE.set(host, line_map)
+    return line_map.get(port)
 
-    if user == DEFAULT_USERNAME:
-        user = get_username(user)
-    if pwd == DEFAULT_PASSWORD:
-        pwd = get_password(pwd)
-    if en_password == DEFAULT_ENPASSWORD:
-        en_password = get_password(en_password)
 
-    if not timeout:
-        timeout = DEFAULT_TIMEOUT
+# authenticated terminal server sessions: (host, user, access) -> (spawn, last use time);
+# a session is checked out of the dict while it is used, see _terminal_server_session()
+_TS_SESSIONS = {}
+_TS_SESSIONS_LOCK = threading.Lock()
+
+
+def _connect_terminal_server(host, user, pwd, prompt, access, en_password, timeout):
+    """Log into a terminal server and go to enable mode.
+
+    :return: the spawn connection
+    """
 
     d1 = None
     spawn = None
@@ -283,7 +515,7 @@ def clear_line(host, port, user=DEFAULT_USERNAME, pwd=DEFAULT_PASSWORD, prompt='
     if access == 'telnet':
         spawn = Spawn('telnet {} {}'.format(host, '23'))
         d1 = Dialog([
-            ["Connected to.*Escape character is '\^\]'\.", 'sendline()', None, True, False],
+            [r"Connected to.*Escape character is '\^\]'\.", 'sendline()', None, True, False],
             ['.*Username:', 'sendline({})'.format(user), None, True, False],
             ['(p|P)assword:', 'sendline({})'.format(pwd), None, True, True],
             [prompt, 'sendline()', None, False, False],
@@ -314,7 +546,7 @@ def clear_line(host, port, user=DEFAULT_USERNAME, pwd=DEFAULT_PASSWORD, prompt='
         LOGGER.error('Failed to connect to terminal server')
         raise Exception('Failed to connect to terminal server')
 
-    # clear port section
+    # enable mode
     try:
         spawn.expect('#')
     except:
@@ -325,8 +557,123 @@ def clear_line(host, port, user=DEFAULT_USERNAME, pwd=DEFAULT_PASSWORD, prompt='
             spawn.sendline(en_password)
         except:
             pass
+    return spawn
+
+
+def _terminal_server_session(host, user, pwd, prompt, access, en_password, timeout):
+    """Return an authenticated session to a terminal server, reusing the
+    previous one if it still answers and was used less than
+    TS_SESSION_IDLE_TIMEOUT seconds ago.
+
+    The session is removed from the kept sessions until it is given back
+    with _release_terminal_server_session(), so that concurrent callers
+    never share it.
+
+    :return: the spawn connection, in enable mode
+    """
+
+    key = (host, user, access)
+    with _TS_SESSIONS_LOCK:
+        spawn, last_use = _TS_SESSIONS.pop(key, (None, 0))
+    if spawn is not None:
+        try:
+            if time.time() - last_use > TS_SESSION_IDLE_TIMEOUT:
+                raise TimeoutError('session idle for too long')
+            spawn.buffer = ''
+            spawn.sendline()
+            spawn.expect(r'{}\s*$'.format(prompt), timeout=5)
+            LOGGER.debug('reusing terminal server session to {}'.format(host))
+            return spawn
+        except Exception:
+            _close_quietly(spawn)
+    return _connect_terminal_server(host, user, pwd, prompt, access, en_password, timeout)
+
+
+def _release_terminal_server_session(key, spawn):
+    """Keep a session for the next clear_line() to the same terminal server.
+
+    Only one session is kept per key: the one displaced, opened by a
+    concurrent caller, is closed so that no vty stays logged in.
+    """
+
+    with _TS_SESSIONS_LOCK:
+        displaced, _ = _TS_SESSIONS.get(key, (None, 0))
+        _TS_SESSIONS[key] = (spawn, time.time())
+    if displaced is not None and displaced is not spawn:
+        _close_quietly(displaced)
+
+
+def _close_quietly(spawn):
+    try:
+        spawn.close()
+    except Exception:
+        pass
+
+
+def close_terminal_server_sessions():
+    """Close the terminal server sessions kept by clear_line()."""
+
+    with _TS_SESSIONS_LOCK:
+        sessions = list(_TS_SESSIONS.values())
+        _TS_SESSIONS.clear()
+    for spawn, _ in sessions:
+        _close_quietly(spawn)
+
+
+atexit.register(close_terminal_server_sessions)
+
+
+def clear_line(host, port, user=DEFAULT_USERNAME, pwd=DEFAULT_PASSWORD, prompt='#',
+               access='telnet', en_password=DEFAULT_ENPASSWORD, timeout=None,
+               reuse_session=True):
+    """Clear line corresponding to a device; this is required because only a
+    single console connection is available.
+
+    If somebody or some process failed to close the connection, it
+    should be cleared explicitly.
+    
+    This function accepts only ssh and telnet connections.
+
+    The roty to tty table of the terminal server is cached for LINE_MAP_TTL
+    seconds and, with reuse_session, the admin session is kept open for
+    clearing other lines of the same terminal server.
+
+    :param host: ip address of terminal server
+    :param port: device line number in terminal server to be cleared
+                for example, if port 2005 is mapped to line 5, port=5
+    :param user: username
+    :param pwd: password
+    :param prompt: expected prompt after logging in
+    :param access: ssh or telnet; default is set to telnet
+    :param en_password: enable password to switch to line configuration mode
+    :param timeout: how long the connection and authentication would take in seconds;
+                    if not provided, default is 60s
+    :param reuse_session: True/False - whether to keep the terminal server
+                          session open for the next calls
+    :return: None
+    
+    """
+
+    if user == DEFAULT_USERNAME:
+        user = get_username(user, host)
+    if pwd == DEFAULT_PASSWORD:
+        pwd = get_password(pwd, host)
+    if en_password == DEFAULT_ENPASSWORD:
+        en_password = get_password(en_password, host)
+
+    if not timeout:
+        timeout = DEFAULT_TIMEOUT
+
+    if reuse_session:
+        spawn = _terminal_server_session(host, user, pwd, prompt, access, en_password, timeout)
+    else:
+        spawn = _connect_terminal_server(host, user, pwd, prompt, access, en_password, timeout)
+
+    # clear port section; a kept session is given back only if the line was
+    # cleared, any error leaves it in an unknown state, so it is closed
+    cleared = False
     try:
-        line_id = tty_id_from_roty_id(spawn, port)
+        line_id = tty_id_from_roty_id(spawn, port, host=host, prompt=prompt)
         LOGGER.info('detected line number for clearing: {} from port {}'.
                     format(line_id, port))
         if line_id:
@@ -335,8 +682,13 @@ def clear_line(host, port, user=DEFAULT_USERNAME, pwd=DEFAULT_PASSWORD, prompt='
             spawn.sendline('')
             spawn.expect('[OK]')
             LOGGER.info('line: {} was cleared'.format(port))
-        spawn.close()
+        cleared = True
     except TimeoutError:
-        spawn.close()
+        LINE_MAP_CACHE.invalidate(host)
         LOGGER.error('Line: {} was not cleared'.format(port))
         raise Exception('Line {} was NOT cleared'.format(port))
+    finally:
+        if cleared and reuse_session:
+            _release_terminal_server_session((host, user, access), spawn)
+        else:
+            _close_quietly(spawn)
@@ -0,0 +1,579 @@
+"""asyncio counterparts of the console functions, so that a single event loop
+can drive many devices concurrently.
+
+The engine reuses the state machines of the device classes (states, paths and
+dialogs), but not their custom go_to() implementations.
+
+Example:
+    async def show_version(device, ip, port):
+        line = await ssh_console(ip, port, device.sm, timeout=30)
+        try:
+            return await line.execute('show version')
+        finally:
+            await line.disconnect()
+
+    outputs = run_concurrently([show_version(d, ip, port) for d, ip, port in consoles], limit=50)
+
+"""
+
+import asyncio
+import collections
+import inspect
+import logging
+import os
+import pty
+import re
+import shlex
+import sys
+import time
+
+from unicon.eal.expect import TimeoutError as uniconTimeoutError
+
+from kick.miscellaneous.credentials import *
+from .regex_registry import get_regex_registry
+from .stream import AnsiStripper, PromptMatcher, DEFAULT_MATCH_WINDOW
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 10
+DEFAULT_READ_SIZE = 65536
+DEFAULT_USERNAME = 'myusername'
+DEFAULT_PASSWORD = 'mypassword'
+
+# actions given as strings in dialog statements, such as 'sendline(yes)'
+ACTION_PATTERN = re.compile(r'^(\w+)\((.*)\)$', re.DOTALL)
+
+
+# run by a new interpreter in the new session of the spawned command: the pty,
+# its standard input, becomes the controlling terminal, so that ssh and telnet
+# can prompt for passwords, then the command replaces the interpreter; a
+# preexec_fn would do the same in the forked child, but is not safe when the
+# event loop runs alongside other threads
+CONTROLLING_TTY_EXEC = ('import fcntl, os, sys, termios; fcntl.ioctl(0, termios.TIOCSCTTY, 0); '
+                        'os.execvp(sys.argv[1], sys.argv[1:])')
+
+
+class AsyncSpawn:
+    """Non-blocking pty spawn driven by the asyncio event loop."""
+
+    def __init__(self, spawn_command, size=DEFAULT_READ_SIZE, strip_ansi=True):
+        """
+        :param spawn_command: command to spawn, such as 'telnet 1.2.3.4 2005'
+        :param size: maximum number of bytes read at once
+        :param strip_ansi: True/False - whether to remove the xterm ESC color
+            sequences and terminal title sequences while reading
+        """
+
+        self.spawn_command = spawn_command
+        self.size = size
+        self.strip_ansi = strip_ansi
+        self.ansi_stripper = AnsiStripper()
+        self.buffer = ''
+        self.fd = None
+        self.process = None
+        self.eof = False
+        self._chunks = collections.deque()
+        self._data_received = None
+        self._loop = None
+        # output not accepted yet by the pty, written when it is writable
+        self._pending = bytearray()
+        self._drained = None
+
+    async def start(self):
+        """Spawn the command in a new pty and start reading its output."""
+
+        master, slave = pty.openpty()
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                sys.executable, '-c', CONTROLLING_TTY_EXEC, *shlex.split(self.spawn_command),
+                stdin=slave, stdout=slave, stderr=slave, start_new_session=True)
+        except Exception:
+            os.close(master)
+            raise
+        finally:
+            os.close(slave)
+        os.set_blocking(master, False)
+        self.fd = master
+        self._loop = asyncio.get_running_loop()
+        self._data_received = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._loop.add_reader(self.fd, self._read)
+        return self
+
+    def _read(self):
+        try:
+            data = os.read(self.fd, self.size)
+        except BlockingIOError:
+            return
+        except OSError:
+            # EIO is raised by the pty once the spawned process exits
+            data = b''
+        if data:
+            data = data.decode('utf-8', 'ignore')
+            if self.strip_ansi:
+                data = self.ansi_stripper.feed(data)
+            self._chunks.append(data)
+        else:
+            self.eof = True
+            self._loop.remove_reader(self.fd)
+        self._data_received.set()
+
+    def send(self, data):
+        """Write data to the spawned process.
+
+        What the pty does not accept at once is queued and written by the
+        event loop as soon as the pty is writable, see drain().
+
+        :param data: string to be sent
+        :return: None
+        """
+
+        if self.fd is None or self.eof:
+            raise OSError('Input/output error: {} is closed'.format(self.spawn_command))
+        self._pending += data.encode('utf-8')
+        if self._drained.is_set():
+            self._write()
+
+    def _write(self):
+        try:
+            written = os.write(self.fd, self._pending)
+        except BlockingIOError:
+            written = 0
+        except OSError:
+            # the spawned process exited, the output is lost
+            written = len(self._pending)
+        del self._pending[:written]
+        if self._pending and self._drained.is_set():
+            self._drained.clear()
+            self._loop.add_writer(self.fd, self._write)
+        elif not self._pending and not self._drained.is_set():
+            self._loop.remove_writer(self.fd)
+            self._drained.set()
+
+    async def drain(self):
+        """Wait until the pty accepted all the data sent."""
+
+        await self._drained.wait()
+
+    def sendline(self, data=''):
+        """Write data followed by a new line to the spawned process.
+
+        :param data: string to be sent
+        :return: None
+        """
+
+        self.send('{}\r'.format(data))
+
+    async def expect(self, patterns, timeout=DEFAULT_TIMEOUT, window=DEFAULT_MATCH_WINDOW):
+        """Wait for one of the patterns in the output.
+
+        The output received after the match is left in the buffer.
+
+        :param patterns: a string or a compiled pattern, or a list of them
+        :param timeout: in seconds
+        :param window: number of characters searched at the end of the output
+        :return: a StreamMatch object
+        """
+
+        matcher = PromptMatcher(patterns, window)
+        data, self.buffer = self.buffer, ''
+        end_time = self._loop.time() + timeout
+        while True:
+            match = matcher.feed(data)
+            while not match and self._chunks:
+                match = matcher.feed(self._chunks.popleft())
+            if match:
+                self.buffer = match.remainder
+                return match
+            if self.eof:
+                self.buffer = matcher.output
+                raise OSError('Input/output error: {} was closed'.format(self.spawn_command))
+            remaining = end_time - self._loop.time()
+            if remaining <= 0:
+                self.buffer = matcher.output
+                raise uniconTimeoutError('timeout waiting for {}'.format(
+                    [regex.pattern for regex in matcher.regexes]))
+            self._data_received.clear()
+            try:
+                await asyncio.wait_for(self._data_received.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+            data = None
+
+    async def close(self, timeout=5):
+        """Stop reading, close the pty and terminate the spawned process."""
+
+        if self.fd is not None:
+            if not self.eof:
+                self._loop.remove_reader(self.fd)
+            if not self._drained.is_set():
+                self._loop.remove_writer(self.fd)
+                self._pending.clear()
+                self._drained.set()
+            os.close(self.fd)
+            self.fd = None
+        if self.process is not None and self.process.returncode is None:
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+
+
+class AsyncDialog:
+    """asyncio counterpart of unicon Dialog.process().
+
+    Statements use the unicon format:
+    [pattern, action, args, loop_continue, continue_timer]
+    where action is None, a string such as 'sendline(yes)', 'send(x)',
+    'sendline_ctx(password)', or a callable (function or coroutine function)
+    accepting any of spawn, context and the args as keyword arguments.
+
+    """
+
+    def __init__(self, statements):
+        """
+        :param statements: a list of statements, or a unicon Dialog
+        """
+
+        self.statements = []
+        for statement in getattr(statements, 'statements', statements):
+            if isinstance(statement, (list, tuple)):
+                statement = list(statement) + [None, None, False, False][len(statement) - 1:]
+                pattern, action, args, loop_continue, continue_timer = statement[:5]
+            else:
+                pattern, action, args = statement.pattern, statement.action, statement.args
+                loop_continue, continue_timer = statement.loop_continue, statement.continue_timer
+            self.statements.append((pattern, action, args or {}, loop_continue, continue_timer))
+
+    def append(self, statement):
+        """Add a statement at the end of the dialog."""
+
+        self.statements.extend(AsyncDialog([statement]).statements)
+
+    async def process(self, spawn, context=None, timeout=DEFAULT_TIMEOUT):
+        """Process the dialog on an AsyncSpawn.
+
+        :param spawn: AsyncSpawn object
+        :param context: dict with the values used by the *_ctx actions
+        :param timeout: in seconds
+        :return: the StreamMatch of the statement that ended the dialog
+        """
+
+        context = context or {}
+        patterns = [statement[0] for statement in self.statements]
+        end_time = time.time() + timeout
+        while True:
+            match = await spawn.expect(patterns, timeout=max(end_time - time.time(), 0))
+            pattern, action, args, loop_continue, continue_timer = \
+                self.statements[match.last_match_index]
+            await self._run_action(action, args, spawn, context)
+            if not loop_continue:
+                return match
+            if continue_timer:
+                end_time = time.time() + timeout
+
+    @staticmethod
+    async def _run_action(action, args, spawn, context):
+        if action is None:
+            return
+        if callable(action):
+            parameters = inspect.signature(action).parameters
+            kwargs = dict(args)
+            for name, value in (('spawn', spawn), ('context', context)):
+                if name in parameters:
+                    kwargs[name] = value
+            result = action(**kwargs)
+            if inspect.isawaitable(result):
+                await result
+            return
+        m = ACTION_PATTERN.match(action)
+        if not m:
+            raise RuntimeError('unknown dialog action: {}'.format(action))
+        name, value = m.groups()
+        if name.endswith('_ctx'):
+            name, value = name[:-len('_ctx')], context[value]
+        if name == 'sendline':
+            spawn.sendline(value)
+        elif name == 'send':
+            spawn.send(value)
+        else:
+            raise RuntimeError('unknown dialog action: {}'.format(action))
+
+
+class AsyncBasicLine:
+    """asyncio counterpart of BasicLine."""
+
+    def __init__(self, spawn_id, sm, type, timeout=None):
+        """Use AsyncBasicLine.create() to also bring the line to a known state.
+
+        :param spawn_id: AsyncSpawn object
+        :param sm: state machine of the device
+        :param type: 'ssh', 'ssh_vty' or 'telnet'
+        :param timeout: in seconds
+        """
+
+        self.spawn_id = spawn_id
+        self.sm = sm
+        self.type = type
+        self.line_type = 'AsyncBasicLine'
+        self.default_timeout = timeout or DEFAULT_TIMEOUT
+
+    @classmethod
+    async def create(cls, spawn_id, sm, type, timeout=None):
+        """Create the line and detect the state of the device."""
+
+        line = cls(spawn_id, sm, type, timeout=timeout)
+        spawn_id.sendline()
+        await line.go_to('any', timeout=timeout or 30)
+        return line
+
+    # the prompt trimming does not depend on the I/O model
+    regex_registry = property(lambda self: get_regex_registry(self.sm))
+
+    def remove_prompt_from_output(self, prompt, output):
+        from .basic import BasicLine
+        return BasicLine.remove_prompt_from_output(self, prompt, output)
+
+    def _state_dialog(self, states, dialog=None):
+        """Dialog ending on the prompt of any of the given states."""
+
+        statements = AsyncDialog(dialog or []).statements
+        default_dialog = getattr(self.sm, 'default_dialog', None)
+        if default_dialog:
+            statements += AsyncDialog(default_dialog).statements
+        states = [self.sm.get_state(state) for state in states]
+        async_dialog = AsyncDialog([])
+        async_dialog.statements = statements + [
+            (state.pattern, None, {}, False, False) for state in states]
+        return async_dialog, len(statements), states
+
+    def _find_path(self, from_state, to_state):
+        """Shortest list of paths between two states of the state machine."""
+
+        previous = {from_state: None}
+        queue = collections.deque([from_state])
+        while queue:
+            state = queue.popleft()
+            if state == to_state:
+                break
+            for path in self.sm.paths:
+                if path.from_state.name == state and path.to_state.name not in previous:
+                    previous[path.to_state.name] = path
+                    queue.append(path.to_state.name)
+        if to_state not in previous:
+            raise RuntimeError('no path from {} to {}'.format(from_state, to_state))
+        paths = []
+        while previous[to_state]:
+            paths.insert(0, previous[to_state])
+            to_state = previous[to_state].from_state.name
+        return paths
+
+    async def go_to(self, state, timeout=30):
+        """Go to specified state.
+
+        :param state: name of state defined in state machine, or 'any' to
+                      only detect the current state
+        :param timeout: in seconds
+        :return: None
+        """
+
+        if state == 'any' or self.sm.current_state in (None, 'generic'):
+            names = [s.name for s in self.sm.states]
+            dialog, offset, states = self._state_dialog(names)
+            match = await dialog.process(self.spawn_id, timeout=timeout)
+            self.sm.update_cur_state(states[match.last_match_index - offset].name)
+            if state == 'any':
+                return
+
+        for path in self._find_path(self.sm.current_state, state):
+            self.spawn_id.sendline(path.command)
+            dialog, _, _ = self._state_dialog([path.to_state.name], path.dialog)
+            await dialog.process(self.spawn_id, timeout=timeout)
+            self.sm.update_cur_state(path.to_state.name)
+
+    async def execute(self, cmd, timeout=None, exception_on_bad_command=False, prompt=None):
+        """Stay in current mode, run the command and return the output.
+
+        :param cmd: a string, such as "show nameif"
+        :param timeout: in seconds
+        :param exception_on_bad_command: True/False - whether to raise an exception
+            on a bad command
+        :param prompt: a string or a compiled pattern to match against the content of the buffer
+                      if not given, the pattern of the current state will be used
+        :return: output as string
+        """
+
+        if not timeout:
+            timeout = self.default_timeout
+        if not prompt:
+            prompt = self.regex_registry.prompt(self.sm.current_state)
+        prompt = self.regex_registry.compile(prompt)
+
+        # clear buffer before running a command
+        self.spawn_id.buffer = ''
+        self.spawn_id.sendline(cmd)
+        output = (await self.spawn_id.expect(prompt, timeout=timeout)).match_output
+        output = output[output.find('\r\n'):]
+
+        if self.regex_registry.command_errors.search(output):
+            if exception_on_bad_command:
+                raise RuntimeError("bad command: {}".format(cmd))
+            else:
+                logger.debug("bad command: {}".format(cmd))
+
+        return self.remove_prompt_from_output(prompt, output)
+
+    async def execute_lines(self, cmd_lines, timeout=None, exception_on_bad_command=False):
+        r"""stay in the same state, run multiple lines of commands and return
+        the output for all commands.
+
+        :param cmd_lines: a string, such as "show nameif\\nshow ip\\nshow clock"
+        :param timeout: in seconds
+        :param exception_on_bad_command: True/False - whether to raise an exception
+            on a bad command
+        :return: output as string
+        """
+
+        return_data = ""
+        for cmd in cmd_lines.split('\n'):
+            cmd = cmd.strip()
+            if cmd == "":
+                continue  # empty line
+            return_data += await self.execute(cmd, timeout, exception_on_bad_command)
+        return return_data
+
+    async def disconnect(self):
+        """Disconnect the line.
+
+        :return: None
+        """
+
+        if self.spawn_id is None:
+            logger.info('You have already closed the connection to this device previously.')
+            return
+        try:
+            if self.type in ['ssh', 'ssh_vty']:
+                # send \n + ~.
+                self.spawn_id.sendline('')
+                self.spawn_id.send('~.')
+            elif self.type == 'telnet':
+                # send ctrl + ], then q
+                self.spawn_id.send('\035')
+                await self.spawn_id.expect('telnet> ')
+                self.spawn_id.sendline('q')
+        except (OSError, uniconTimeoutError) as e:
+            logger.debug('Line was not closed cleanly: {}'.format(str(e)))
+        await self.spawn_id.close()
+        self.spawn_id = None
+
+
+async def ssh_console(ip, port, sm, username=DEFAULT_USERNAME, password=DEFAULT_PASSWORD,
+                      timeout=DEFAULT_TIMEOUT, line_class=AsyncBasicLine):
+    """asyncio counterpart of BasicDevice.ssh_console().
+
+    :param ip: ip address of terminal server
+    :param port: port of device on terminal server
+    :param sm: state machine of the device, such as Kp(...).sm
+    :param username: username
+    :param password: password
+    :param timeout: in seconds
+    :param line_class: class of the returned line
+    :return: a line object
+    """
+
+    if username == DEFAULT_USERNAME:
+        username = get_username(username, ip)
+    if password == DEFAULT_PASSWORD:
+        password = get_password(password, ip)
+
+    spawn_id = await AsyncSpawn(
+        'ssh -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no '
+        '-l {} -p {} {}'.format(username, port, ip)).start()
+    try:
+        await AsyncDialog([
+            ['continue connecting (yes/no)?', 'sendline(yes)', None, True, False],
+            ['(p|P)assword:', 'sendline_ctx(password)', None, False, False],
+        ]).process(spawn_id, context={'password': password}, timeout=timeout)
+        try:
+            await AsyncDialog([
+                ['Password OK', 'sendline()', None, False, False],
+                ['[.*>#] ', 'sendline()', None, False, False],
+            ]).process(spawn_id, timeout=timeout)
+        except uniconTimeoutError:
+            spawn_id.sendline()
+        return await line_class.create(spawn_id, sm, 'ssh', timeout=timeout)
+    except:
+        await spawn_id.close()
+        raise
+
+
+async def telnet_console(ip, port, sm, username=DEFAULT_USERNAME, password=DEFAULT_PASSWORD,
+                         timeout=DEFAULT_TIMEOUT, line_class=AsyncBasicLine):
+    """asyncio counterpart of BasicDevice.telnet_console().
+
+    If username and password are empty strings, no credentials are required.
+
+    :param ip: ip address of terminal server
+    :param port: port of device on terminal server
+    :param sm: state machine of the device, such as Kp(...).sm
+    :param username: username
+    :param password: password
+    :param timeout: in seconds
+    :param line_class: class of the returned line
+    :return: a line object
+    """
+
+    if username == DEFAULT_USERNAME:
+        username = get_username(username, ip)
+    if password == DEFAULT_PASSWORD:
+        password = get_password(password, ip)
+
+    spawn_id = await AsyncSpawn('telnet {} {}'.format(ip, port)).start()
+    try:
+        await spawn_id.expect(r"Connected to.*Escape character is '\^\]'\.", timeout)
+        if username or password:
+            await AsyncDialog([
+                ['Username: ', 'sendline_ctx(username)', None, True, False],
+                ['Password: ', 'sendline_ctx(password)', None, False, False],
+            ]).process(spawn_id, context={'username': username, 'password': password},
+                       timeout=timeout)
+            try:
+                await spawn_id.expect("Password OK.*", timeout)
+            except uniconTimeoutError:
+                logger.debug("'Password OK' message did not appear ... continue")
+        spawn_id.sendline('')
+        return await line_class.create(spawn_id, sm, 'telnet', timeout=timeout)
+    except:
+        await spawn_id.close()
+        raise
+
+
+def run_concurrently(coroutines, limit=None):
+    """Run coroutines in a new event loop, at most limit at a time.
+
+    :param coroutines: list of coroutines, such as the work to do on each device
+    :param limit: maximum number of coroutines running at the same time;
+                  if not given, all of them are run at once
+    :return: list with the result (or the raised exception) of each coroutine,
+             in the order of coroutines
+    """
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(limit) if limit else None
+
+        async def run(coroutine):
+            if semaphore is None:
+                return await coroutine
+            async with semaphore:
+                return await coroutine
+
+        return await asyncio.gather(*[run(c) for c in coroutines], return_exceptions=True)
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run_all())
+    finally:
+        loop.close()
@@ -1,4 +1,5 @@
 import logging
+import random
 import re
 import subprocess
 import time
@@ -26,6 +27,7 @@ logger = logging.getLogger(__name__)
 # The following overrides original unicon Spawn read function to ignore unicode decode failure    #
 ###################################################################################################
 import os
+import select
 from unicon.eal.backend import pty_backend
 
 try:
@@ -34,6 +36,12 @@ except ImportError:
     from kick.miscellaneous.credentials import KickConsts
 
 from .constants import CONFIGURATION_DIALOG, TYPE_TO_STATE_MAP, DEVICE_LIST
+from .stream import AnsiStripper, BytePromptMatcher, PromptMatcher, DEFAULT_MATCH_WINDOW, strip_ansi, \
+    split_pipelined_output
+from .regex_registry import get_regex_registry
+from .readiness import wait_until
+from .instrumentation import LatencyRecorder, instrumented
+from .ssh_pool import SSH_OPTIONS, get_ssh_pool, is_pooled_connection
 
 DEFAULT_USERNAME = 'myusername'
 DEFAULT_PASSWORD = 'mypassword'
@@ -43,7 +51,21 @@ DEFAULT_ENPASSWORD = 'myenpassword'
 class NewSpawn(pty_backend.Spawn):
     """A new Spawn class that ignore non utf-8 decode error."""
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, strip_ansi=False, bytes_mode=False, **kwargs):
+        """
+        :param strip_ansi: True/False - whether to remove the xterm ESC color
+            sequences and terminal title sequences while reading; off by
+            default, read() returns the output as the device sent it
+        :param bytes_mode: True/False - whether expect_stream() matches the
+            prompt against the raw bytes and decodes only the returned output,
+            by default; BasicLine.wait_for_prompt() always uses the bytes mode
+        """
+        self.strip_ansi = strip_ansi
+        self.bytes_mode = bytes_mode
+        self.ansi_stripper = AnsiStripper()
+        # counters read by the latency hooks of the lines, see instrumentation.py
+        self.bytes_read = 0
+        self.match_time = 0.0
         super().__init__(*args, **kwargs)
         if hasattr(self, 'match_mode_detect'):
             self.match_mode_detect = False
@@ -53,16 +75,106 @@ class NewSpawn(pty_backend.Spawn):
         size = size or self.size
         if self.is_readable():
             byte_data = os.read(self.fd, size)
+            self.bytes_read += len(byte_data)
             # try:
             #     data = byte_data.decode('utf-8')
             # except:
             #     self.log.info("non_utf-8_character %s" % str(byte_data))
             #     data = str(byte_data)
             data = byte_data.decode('utf-8', 'ignore')
+            if self.strip_ansi:
+                data = self.ansi_stripper.feed(data)
             return data
         else:
             return None
 
+    def expect_stream(self, prompt, timeout, window=DEFAULT_MATCH_WINDOW, keep_output=True,
+                      bytes_mode=None):
+        """Wait for the prompt, searching only the end of the output.
+
+        Unlike expect(), the output is kept in a list of chunks and every new
+        chunk is matched against a tail window of the output, so the cost of
+        waiting for the prompt grows linearly with the size of the output.
+        The output received after the prompt is left in the buffer.
+
+        :param prompt: a string or a compiled pattern
+        :param timeout: in seconds
+        :param window: number of characters searched at the end of the output
+        :param keep_output: True/False - in bytes mode, whether to keep all the
+            output or only the last window bytes, e.g. while waiting for a
+            prompt at the end of a long boot log
+        :param bytes_mode: True/False - whether to match the raw bytes, the
+            bytes_mode of the spawn by default
+        :return: a StreamMatch object, or a BytesStreamMatch object in bytes mode
+        """
+
+        if bytes_mode is None:
+            bytes_mode = self.bytes_mode
+        start_time = time.time()
+        try:
+            if bytes_mode:
+                return self._expect_stream_bytes(prompt, timeout, window, keep_output)
+            return self._expect_stream(prompt, timeout, window)
+        finally:
+            self.match_time += time.time() - start_time
+
+    def expect(self, *args, **kwargs):
+        """Override original expect function to account the time spent matching."""
+        start_time = time.time()
+        try:
+            return super().expect(*args, **kwargs)
+        finally:
+            self.match_time += time.time() - start_time
+
+    def _expect_stream(self, prompt, timeout, window):
+        """expect_stream() on the decoded output."""
+
+        matcher = PromptMatcher(prompt, window)
+        data, self.buffer = self.buffer, ''
+        end_time = time.time() + timeout
+        while True:
+            match = matcher.feed(data)
+            if match:
+                self.buffer = match.remainder
+                return match
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                self.buffer = matcher.output
+                raise uniconTimeoutError('timeout waiting for prompt {}'.format(
+                    matcher.regex.pattern))
+            data = None
+            if select.select([self.fd], [], [], min(remaining, 0.1))[0]:
+                data = self.read()
+
+    def _expect_stream_bytes(self, prompt, timeout, window, keep_output):
+        """expect_stream() on the raw bytes read from the device.
+
+        The chunks are not decoded; only the output returned in the match and
+        the output left in the buffer are decoded. The escape sequences are
+        removed from the bytes before matching, the prompts of the state
+        machines match the output without them; the output after the prompt
+        is left in the buffer as received, escape sequences included.
+        """
+
+        matcher = BytePromptMatcher(prompt, window, keep_output=keep_output,
+                                    strip_escapes=True)
+        data, self.buffer = self.buffer.encode('utf-8'), ''
+        end_time = time.time() + timeout
+        while True:
+            match = matcher.feed(data)
+            if match:
+                self.buffer = match.remainder
+                return match
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                self.buffer = matcher.output.decode('utf-8', 'ignore')
+                raise uniconTimeoutError('timeout waiting for prompt {}'.format(
+                    matcher.regex.pattern))
+            data = None
+            if select.select([self.fd], [], [], min(remaining, 0.1))[0]:
+                data = os.read(self.fd, self.size)
+                self.bytes_read += len(data)
+
 
 ###################################################################################################
 # End                                                                                             #
@@ -71,9 +183,20 @@ class NewSpawn(pty_backend.Spawn):
 DEFAULT_TIMEOUT = 10
 # timeout for configuration wizard to complete
 DEFAULT_CONFIGURATION_TIMEOUT = 900
+# number of commands written at once by execute_lines() in pipelined mode
+DEFAULT_PIPELINE_BATCH_SIZE = 10
+# delay before the second reconnect attempt, doubled after each failed attempt
+DEFAULT_RECONNECT_BACKOFF = 2
+DEFAULT_RECONNECT_MAX_BACKOFF = 60
+# the delay is randomly changed by up to this fraction, so that the lines
+# disconnected together do not reconnect together
+DEFAULT_RECONNECT_JITTER = 0.25
 
 
 class BasicDevice:
+    # SshConnectionPool shared by ssh_console() and ssh_vty(), see set_ssh_pool()
+    ssh_pool = None
+
     def __init__(self):
         """Constructor of device.
 
@@ -115,6 +238,37 @@ class BasicDevice:
         logger.debug('setting device default configuration timeout to {}'.format(timeout))
         self.configuration_timeout = timeout
 
+    def set_ssh_pool(self, pool=True):
+        """Reuse authenticated ssh connections in ssh_console() and ssh_vty().
+
+        With a pool, the first connection to a host and port does the
+        password dialog and the next ones (reconnects, availability checks,
+        wait_for_ssh()) open a new channel on it.
+
+        :param pool: a SshConnectionPool object; True for the pool shared by
+                     all the devices; None or False to disable the reuse
+        :return: None
+
+        """
+
+        if pool is True:
+            pool = get_ssh_pool()
+        logger.debug('setting device ssh pool to {}'.format(pool))
+        self.ssh_pool = pool or None
+
+    def _ssh_spawn_command(self, username, ip, port, rsa_key=None):
+        """ssh command to a host, through the ssh pool if set.
+
+        :return: a tuple (command, reused), reused is True if the command
+                 opens a channel on an already authenticated connection
+        """
+
+        if self.ssh_pool:
+            reused = self.ssh_pool.is_connected(username, ip, port)
+            return self.ssh_pool.ssh_command(username, ip, port, rsa_key=rsa_key), reused
+        identity = '-i {} '.format(rsa_key) if rsa_key else ''
+        return 'ssh {} {}-l {} -p {} {} \n'.format(SSH_OPTIONS, identity, username, port, ip), False
+
     def ssh_console(self, ip, port, username=DEFAULT_USERNAME, password=DEFAULT_PASSWORD,
                     timeout=None, en_password=DEFAULT_ENPASSWORD):
         """Set up an ssh console connection.
@@ -132,19 +286,18 @@ class BasicDevice:
         """
 
         if username == DEFAULT_USERNAME:
-            username = get_username(username)
+            username = get_username(username, ip)
         if password == DEFAULT_PASSWORD:
-            password = get_password(password)
+            password = get_password(password, ip)
         if en_password == DEFAULT_ENPASSWORD:
-            en_password = get_en_password(en_password)
+            en_password = get_en_password(en_password, ip)
 
         graphite.publish_kick_metric('device.basic.ssh_console', 1)
         if not timeout:
             timeout = self.default_timeout
 
-        spawn_id = NewSpawn(
-            'ssh -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no '
-            '-l {} -p {} {} \n'.format(username, port, ip))
+        spawn_command, reused = self._ssh_spawn_command(username, ip, port)
+        spawn_id = NewSpawn(spawn_command)
 
         ctx = AttributeDict({'password': password})
         d = Dialog([
@@ -153,15 +306,18 @@ class BasicDevice:
             ['(p|P)assword:', 'sendline_ctx(password)', None, False, False],
         ])
         try:
-            d.process(spawn_id, context=ctx, timeout=timeout)
+            if reused:
+                # the pooled connection is already authenticated, wake up the console
+                spawn_id.sendline()
+            else:
+                d.process(spawn_id, context=ctx, timeout=timeout)
         except OSError:
             spawn_id.close()
             clear_line(ip, int(port) % 100, user=username, pwd=password,
                        prompt='#', access='ssh', en_password=en_password,
                        timeout=timeout)
-            spawn_id = NewSpawn(
-                'ssh -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no '
-                '-l {} -p {} {} \n'.format(username, port, ip))
+            spawn_command, _ = self._ssh_spawn_command(username, ip, port)
+            spawn_id = NewSpawn(spawn_command)
             try:
                 d.process(spawn_id, context=ctx, timeout=timeout)
             except:
@@ -247,11 +403,11 @@ class BasicDevice:
         """
 
         if username == DEFAULT_USERNAME:
-            username = get_username(username)
+            username = get_username(username, ip)
         if password == DEFAULT_PASSWORD:
-            password = get_password(password)
+            password = get_password(password, ip)
         if en_password == DEFAULT_ENPASSWORD:
-            en_password = get_en_password(en_password)
+            en_password = get_en_password(en_password, ip)
 
         graphite.publish_kick_metric(
             'device.basic.telnet_console_with_credential', 1)
@@ -308,11 +464,11 @@ class BasicDevice:
         """
 
         if username == DEFAULT_USERNAME:
-            username = get_username(username)
+            username = get_username(username, ip)
         if password == DEFAULT_PASSWORD:
-            password = get_password(password)
+            password = get_password(password, ip)
         if en_password == DEFAULT_ENPASSWORD:
-            en_password = get_en_password(en_password)
+            en_password = get_en_password(en_password, ip)
 
         # if username and password are empty strings, no credentials are required
         if not username and not password:
@@ -356,13 +512,8 @@ class BasicDevice:
                 raise RuntimeError(
                     'The identity file {} you provided does not exist'.format(
                         rsa_key))
-            spawn_id = NewSpawn(
-                'ssh -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no '
-                '-i {} -l {} -p {} {} \n'.format(rsa_key, username, port, ip))
-        else:
-            spawn_id = NewSpawn(
-                'ssh -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no '
-                '-l {} -p {} {} \n'.format(username, port, ip))
+        spawn_command, _ = self._ssh_spawn_command(username, ip, port, rsa_key=rsa_key)
+        spawn_id = NewSpawn(spawn_command)
 
         ctx = AttributeDict({'password': password})
         d = Dialog([
@@ -446,7 +597,7 @@ class BasicDevice:
 
     def wait_for_ssh(self, ip, port, username='admin', password=KickConsts.DEFAULT_PASSWORD,
                      timeout=10, line_type='ssh', rsa_key=None, wait_time=600):
-        """Ping ssh connection every one minute
+        """Ping ssh connection, backing off from every 10 seconds up to every one minute
 
         :param ip: ip address of the machine
         :param port: ssh port
@@ -463,21 +614,24 @@ class BasicDevice:
         """
 
         start_time = time.time()
-        is_available = False
         logger.info('Waiting for ssh to be available')
-        while start_time + wait_time > time.time():
+
+        def ssh_available():
             try:
                 line = self.ssh_vty(ip=ip, port=port, rsa_key=rsa_key, line_type=line_type,
                                     timeout=timeout, username=username, password=password)
                 if line:
-                    is_available = True
                     line.disconnect()
-                    break
+                    return True
             except Exception as e:
                 current_time = time.time()
                 logger.info('ssh not available after {}'.format(_time_message(start_time, current_time)))
                 logger.info('Error message: {}'.format(str(e)))
-                time.sleep(60)
+            return False
+
+        # poll every 10 seconds at first, backing off up to one minute
+        is_available = wait_until(ssh_available, wait_time, interval=10, max_interval=60,
+                                  name='ssh connection', raise_on_timeout=False)
         if is_available:
             logger.info('ssh connection available')
         else:
@@ -576,6 +730,13 @@ class BasicLine:
 
         """
         self._reconnect_feature = {'enabled': False, 'max_retries': 0}
+        # one dict per reconnect attempt: {'attempt', 'duration', 'success'}
+        self.reconnect_history = []
+        # LatencyRecorder of the line operations, see set_latency_recorder()
+        self.latency_recorder = None
+        # PhaseTimer of the baseline in progress and timeline of the last one, see begin_phase()
+        self.phase_timer = None
+        self.last_timeline = None
         self.spawn_id = spawn_id
         self.sm = sm
         self.type = type
@@ -584,9 +745,19 @@ class BasicLine:
         self.spawn_command = self.spawn_id.spawn_command
         self.spawn_id.sendline()
         self.go_to('any', timeout=timeout)
+        # state of a new session of this line, tried first after a reconnect
+        self.landing_state = self.sm.current_state
         # set default timeout value for functions in this class,
         # such as ssh_console(), ssh_vty(), etc.
 
+    @property
+    def regex_registry(self):
+        """Compiled prompts and error patterns of the state machine of this line.
+
+        :return: a RegexRegistry object
+        """
+        return get_regex_registry(self.sm)
+
     @property
     def reconnect_feature(self):
         """
@@ -597,6 +768,10 @@ class BasicLine:
             {
                 'enabled': True, -> reconnect mechanism is enabled
                 'max_retries': 3 -> max. number of retries to reconnect
+                'backoff': 2 -> optional, delay in seconds before the second attempt,
+                                doubled after each failed attempt
+                'max_backoff': 60 -> optional, maximum delay between two attempts
+                'jitter': 0.25 -> optional, fraction of the delay randomly added or removed
             }
         """
         return self._reconnect_feature
@@ -611,6 +786,10 @@ class BasicLine:
             {
                 'enabled': True, -> reconnect mechanism is enabled
                 'max_retries': 3 -> max. number of retries to reconnect
+                'backoff': 2 -> optional, delay in seconds before the second attempt,
+                                doubled after each failed attempt
+                'max_backoff': 60 -> optional, maximum delay between two attempts
+                'jitter': 0.25 -> optional, fraction of the delay randomly added or removed
             }
         :return: None
         """
@@ -619,6 +798,10 @@ class BasicLine:
         if not isinstance(value.get('enabled', None), bool):
             raise RuntimeError('Please read the setter documentation. You must provide a bool value for the enabled'
                                ' field.')
+        for key in ['backoff', 'max_backoff', 'jitter']:
+            if key in value and (not isinstance(value[key], (int, float)) or value[key] < 0):
+                raise RuntimeError('Please read the setter documentation. You must provide a non negative number '
+                                   'for the {} field.'.format(key))
         if bool(value['enabled']):
             if not isinstance(value.get('max_retries', None), int):
                 raise RuntimeError('Please read the setter documentation. You must provide an int value for the '
@@ -644,6 +827,43 @@ class BasicLine:
         logger.debug('setting line default timeout to {}'.format(timeout))
         self.default_timeout = timeout
 
+    def set_latency_recorder(self, recorder=True):
+        """Record the latency of execute(), execute_lines(), config(), go_to(),
+        run_cmd_dialog() and the wait_till() helpers of this line.
+
+        Each call is recorded with its wall time, the bytes read, the time
+        spent waiting for patterns and, for go_to(), the number of state
+        transitions. A summary report is logged at disconnect().
+
+        :param recorder: a LatencyRecorder object, which can be shared by
+                         several lines; True for a new recorder; None or False
+                         to disable the recording
+        :return: the recorder
+
+        """
+
+        if recorder is True:
+            recorder = LatencyRecorder()
+        self.latency_recorder = recorder or None
+        return self.latency_recorder
+
+    def begin_phase(self, name, **metadata):
+        """Start a phase of the baseline in progress, ending the previous one.
+
+        The baselines decorated with timed_phases() publish the duration of
+        each phase and keep their timeline in last_timeline; outside of
+        them this does nothing.
+
+        :param name: name of the phase, such as 'download' or 'install'
+        :param metadata: additional information stored in the timeline
+        :return: None
+
+        """
+
+        if self.phase_timer is not None:
+            self.phase_timer.begin(name, **metadata)
+
+    @instrumented('go_to')
     def go_to(self, state, **kwargs):
         """Go to specified state.
 
@@ -683,14 +903,48 @@ class BasicLine:
             ['[.*>#$] ', 'sendline()', None, False, False],
         ])
 
+        if is_pooled_connection(self.spawn_command):
+            # the pooled connection is already authenticated, wake up the console
+            new_spawn_id.sendline()
         d.process(new_spawn_id, context=ctx, timeout=timeout)
         self.spawn_id.close()
         self.spawn_id = new_spawn_id
 
+    def detect_state(self, timeout=30):
+        """Find the state of a new session of this line.
+
+        The state the line landed in when it was created is checked first,
+        with a single prompt match. It is trusted only if the prompt matches
+        no other state: a console stays where it was across a reconnect, and
+        e.g. the kp fxos prompt also matches the local-mgmt and lina prompts.
+        Otherwise the state machine looks for the prompts of all its states.
+
+        :param timeout: in seconds
+        :return: name of the current state
+        """
+
+        landing_state = getattr(self, 'landing_state', None)
+        if landing_state:
+            self.spawn_id.sendline()
+            try:
+                output = self._expect(self.regex_registry.prompt(landing_state), timeout=min(timeout, 10))
+                # the last line, with its line break, holds the prompt
+                prompt_line = output[max(output.rfind('\n') - 1, 0):]
+                others = [state.name for state in self.sm.states if state.name != landing_state and
+                          self.regex_registry.prompt(state.name).search(prompt_line)]
+                if not others:
+                    self.sm.update_cur_state(landing_state)
+                    return landing_state
+                logger.debug('prompt of {} state also matches {}'.format(landing_state, others))
+            except uniconTimeoutError:
+                logger.debug('line did not land in {} state'.format(landing_state))
+        self.sm.go_to('any', self.spawn_id, timeout=timeout)
+        return self.sm.current_state
+
     def bring_device_to_previous_state(self, initial_state, timeout):
         logger.info('Device was previously disconnected in {} state. Taking device back to the state it was in when '
                     'the disconnect happened ...'.format(initial_state))
-        self.sm.go_to('any', self.spawn_id)
+        self.detect_state(timeout)
         # at reconnection, reconfigure the terminal if needed
         self.reconfigure_terminal(timeout)
         self.sm.go_to(initial_state, self.spawn_id)
@@ -732,25 +986,56 @@ class BasicLine:
                     error_reason.__cause__.__traceback__)))
 
         retry = int(self._reconnect_feature['max_retries'])
+        delay = self._reconnect_feature.get('backoff', DEFAULT_RECONNECT_BACKOFF)
+        max_delay = self._reconnect_feature.get('max_backoff', DEFAULT_RECONNECT_MAX_BACKOFF)
+        jitter = self._reconnect_feature.get('jitter', DEFAULT_RECONNECT_JITTER)
         exception_raised = None
+        attempt = 0
         while retry > 0:
+            attempt += 1
+            start_time = time.time()
             try:
                 self.do_reconnect_(timeout)
                 # mark successful reconnect
                 exception_raised = None
-                break
             except Exception as e:
                 exception_raised = e
                 retry -= 1
                 logger.error('Connection could not be reestablished.')
                 logger.error('Exception encountered: {}'.format(
                     traceback.format_tb(e.__traceback__)))
+            duration = time.time() - start_time
+            self._record_reconnect(attempt, duration, exception_raised is None)
+            if exception_raised is None:
+                break
+            if retry > 0:
+                sleep_time = min(delay, max_delay) * random.uniform(1 - jitter, 1 + jitter)
+                logger.info('Retrying to reconnect in {} seconds'.format(round(sleep_time, 1)))
+                time.sleep(sleep_time)
+                delay = min(delay * 2, max_delay)
         # if reconnect was not successful (meaning exception_raised is not None)
         # and the number of max retries has been reached then we seem to not
         # be able to reconnect so throwing the exception and failing
         if exception_raised != None:
             raise exception_raised
 
+    def _record_reconnect(self, attempt, duration, success):
+        """Keep and publish the duration of a reconnect attempt.
+
+        :param attempt: number of the attempt, starting at 1
+        :param duration: in seconds
+        :param success: True/False - whether the line was reconnected
+        :return: None
+        """
+
+        self.reconnect_history.append({'attempt': attempt, 'duration': duration, 'success': success})
+        logger.info('Reconnect attempt {} {} in {} seconds'.format(
+            attempt, 'succeeded' if success else 'failed', round(duration, 1)))
+        graphite.publish_kick_metric('device.basic.reconnect.duration', duration)
+        graphite.publish_kick_metric('device.basic.reconnect.{}'.format(
+            'success' if success else 'failure'), 1)
+
+    @instrumented('execute')
     def execute(self, cmd, timeout=None, exception_on_bad_command=False,
                 prompt=None):
         """Stay in current mode, run the command and return the output.
@@ -759,7 +1044,7 @@ class BasicLine:
         :param timeout: in seconds
         :param exception_on_bad_command: True/False - whether to raise an exception
             on a bad command
-        :param prompt: a string representing a pattern to match against the content of the buffer
+        :param prompt: a string or a compiled pattern to match against the content of the buffer
                       if not given, the pattern of the current state will be used
         :return: output as string
 
@@ -769,7 +1054,7 @@ class BasicLine:
             timeout = self.default_timeout
 
         if not prompt:
-            prompt = self.sm.get_state(self.sm.current_state).pattern
+            prompt = self.regex_registry.prompt(self.sm.current_state)
 
         try_reconnect = False
         reason_for_reconnect = None
@@ -800,11 +1085,11 @@ class BasicLine:
         :param timeout: in seconds
         :param exception_on_bad_command: True/False - whether to raise an exception
             on a bad command
-        :param prompt: a string representing a pattern to match against the content of the buffer
-                      if not given, the pattern of the current state will be used
+        :param prompt: a string or a compiled pattern to match against the content of the buffer
         :return: output as string
 
         """
+        prompt = self.regex_registry.compile(prompt)
         # clear buffer before running a command
         if self.spawn_id.read_update_buffer():
             self.spawn_id.buffer = ''
@@ -815,16 +1100,17 @@ class BasicLine:
         # reason it gives prompt first, then output, then prompt again.
         # the typical pattern matching easily breaks here. we rely on the
         # fact of '\r\n' is always flanking the output.
-        output = self.spawn_id.expect(prompt, timeout=timeout).last_match.string
+        if hasattr(self.spawn_id, 'expect_stream'):
+            output = self.spawn_id.expect_stream(prompt, timeout=timeout).match_output
+        else:
+            output = self.spawn_id.expect(prompt.pattern, timeout=timeout).last_match.string
         logger.debug("before trimming in execute(): {}".format(output))
 
         index = output.find('\r\n')
         output = output[index:]
 
         # handle bad command
-        errors = ["% Invalid Command", "% Incomplete Command", "Error: ",
-                  "ERROR: ", "Error ", "ERROR "]
-        if any([error in output for error in errors]):
+        if self.regex_registry.command_errors.search(output):
             if exception_on_bad_command:
                 raise RuntimeError("bad command: {}".format(cmd))
             else:
@@ -832,6 +1118,40 @@ class BasicLine:
 
         return self.remove_prompt_from_output(prompt, output)
 
+    def _expect(self, regex, timeout):
+        """Wait for a compiled pattern and return the output up to and including it.
+
+        :param regex: a compiled pattern
+        :param timeout: in seconds
+        :return: output as string
+        """
+        if hasattr(self.spawn_id, 'expect_stream'):
+            return self.spawn_id.expect_stream(regex, timeout=timeout).match_output
+        return self.spawn_id.expect(regex.pattern, timeout=timeout).match_output
+
+    def wait_for_prompt(self, prompt, timeout=None, keep_output=False):
+        """Wait for a prompt without sending anything, e.g. while the device boots.
+
+        With a NewSpawn, the raw bytes are matched: nothing is decoded until
+        the prompt is found and, unless keep_output is set, only the end of
+        the output is kept.
+
+        :param prompt: a string or a compiled pattern
+        :param timeout: in seconds
+        :param keep_output: True/False - whether to return all the output
+            received or only its end
+        :return: output as string, up to and including the prompt
+        """
+
+        if not timeout:
+            timeout = self.default_timeout
+
+        if hasattr(self.spawn_id, 'expect_stream'):
+            return self.spawn_id.expect_stream(prompt, timeout=timeout, keep_output=keep_output,
+                                               bytes_mode=True).match_output
+        return self.spawn_id.expect(getattr(prompt, 'pattern', prompt),
+                                    timeout=timeout).match_output
+
     def reconfigure_terminal(self, timeout):
         # in case of kp and wm, the reconnection is done directly to the ftd
         # so we have to go to 'fxos_state' to reconfigure the terminal
@@ -845,16 +1165,18 @@ class BasicLine:
         """ After getting the output (with prompt inside), remove prompt and
         whitespace to return the output only.
 
-        :param prompt: string, such as '(warrior|firepower)([ /\\w\\-*()]+)?# '
+        :param prompt: string or compiled pattern, such as '(warrior|firepower)([ /\\w\\-*()]+)?# '
         :param output: string, such as 'firepower-2110# '
         :return: the output, such as ''
         """
 
-        # remove xterm ESC color sequences from the output
-        ansi_colors_escape = re.compile(r'(\x9B|\x1B\[)[0-?]*[ -/]*[@-~]')
-        ansi_title_esc = re.compile(r'\x1B\]0;')
-        output = ansi_title_esc.sub('', ansi_colors_escape.sub('', output))
-        r = re.findall(prompt, output)
+        prompt = self.regex_registry.compile(prompt)
+
+        # remove xterm ESC color sequences from the output, unless the spawn
+        # already removed them while reading
+        if not getattr(self.spawn_id, 'strip_ansi', False):
+            output = strip_ansi(output)
+        r = list(prompt.finditer(output))
         if len(r) == 0:
             # the entire output is returned, this will happen if executing on
             # non-ftd platforms such as endpoints
@@ -864,8 +1186,7 @@ class BasicLine:
             # typical scenario: we see output followed by prompt
             # for example: '\r\n12:38:35.398 UTC Tue Jan 03 2012\r\n\rmadhuri(fxos)# '
             logger.debug("one prompt found.")
-            m = re.search(prompt, output)
-            end = m.span()[0]
+            end = r[0].start()
             return_data = output[:end].strip()
         elif len(r) == 2:
             # somehow terminal server might insert a new line
@@ -873,14 +1194,9 @@ class BasicLine:
             #  03 2012\r\n\rmadhuri(fxos)# '
             logger.debug("two prompts found")
 
-            m1 = re.search(prompt, output)
-            end1 = m1.span()[0]
-            return_data1 = output[:end1].strip()
-
-            output2 = output[m1.span()[1]:]
-            m2 = re.search(prompt, output2)
-            end2 = m2.span()[0]
-            return_data2 = output2[:end2].strip()
+            m1, m2 = r
+            return_data1 = output[:m1.start()].strip()
+            return_data2 = output[m1.end():m2.start()].strip()
             # at lease one should be an empty string
             if return_data1 and return_data2:
                 logger.debug("prompt seen 2 times, got two different lines!")
@@ -916,17 +1232,28 @@ class BasicLine:
         output = self.spawn_id.expect(prompt, timeout=timeout).last_match.string
         return output
 
+    @instrumented('execute_lines')
     def execute_lines(self, cmd_lines, timeout=None,
-                      exception_on_bad_command=False):
+                      exception_on_bad_command=False, pipelined=False,
+                      batch_size=DEFAULT_PIPELINE_BATCH_SIZE):
         r"""stay in the same state, run multiple lines of commands and return
         the output for all commands.
 
         cmd_lines needs to be a '\\n' delimited string.
 
+        In pipelined mode the commands are written to the device in batches of
+        batch_size lines and the combined output is split back per command on
+        the prompts of the current state, see split_pipelined_output(). Use it
+        only for commands that do not trigger a dialog (confirmation, password,
+        etc.) and whose prompt is matched by the pattern of the current state.
+
         :param cmd_lines: a string, such as "show nameif\\nshow ip\\nshow clock"
         :param timeout: in seconds
         :param exception_on_bad_command: True/False - whether to raise an exception
             on a bad command
+        :param pipelined: True/False - whether to send the commands in batches
+            instead of waiting for the prompt after each of them
+        :param batch_size: number of commands sent at once in pipelined mode
         :return: output as string
 
         """
@@ -934,16 +1261,107 @@ class BasicLine:
         if not timeout:
             timeout = self.default_timeout
 
+        cmds = [cmd.strip() for cmd in cmd_lines.split('\n') if cmd.strip()]
+
+        if pipelined:
+            return "".join(self.execute_pipelined(cmds, timeout, exception_on_bad_command,
+                                                  batch_size=batch_size))
+
         return_data = ""
-        for cmd in cmd_lines.split('\n'):
-            cmd = cmd.strip()
-            if cmd == "":
-                continue  # empty line
+        for cmd in cmds:
             time.sleep(0.1)
             return_data += self.execute(cmd, timeout, exception_on_bad_command)
 
         return return_data
 
+    def execute_pipelined(self, cmds, timeout=None, exception_on_bad_command=False,
+                          prompt=None, batch_size=DEFAULT_PIPELINE_BATCH_SIZE):
+        """Stay in current mode, send the commands in batches and return the
+        output of each command.
+
+        :param cmds: a list of commands, such as ['top', 'scope firmware', 'show package']
+        :param timeout: in seconds, applied to each command of a batch
+        :param exception_on_bad_command: True/False - whether to raise an exception
+            on a bad command
+        :param prompt: a string representing a pattern to match against the content of the buffer
+                      if not given, the pattern of the current state will be used
+        :param batch_size: number of commands sent at once
+        :return: list with the output of each command, in the order of cmds
+
+        """
+
+        if not timeout:
+            timeout = self.default_timeout
+
+        if not prompt:
+            prompt = self.sm.get_state(self.sm.current_state).pattern
+
+        # several prompts are expected in the same buffer, so the prompt
+        # can not be anchored to the end of it
+        boundary = self.regex_registry.compile(_unanchored_prompt(getattr(prompt, 'pattern', prompt)))
+        batch_size = max(int(batch_size), 1)
+        outputs = []
+        for i in range(0, len(cmds), batch_size):
+            batch = cmds[i:i + batch_size]
+            chunks = []
+            try:
+                self._send_batch(batch, boundary, timeout, chunks)
+            except OSError as e:
+                if self.type not in ['ssh', 'ssh_vty']:
+                    logger.error('Error while executing command: ', e)
+                    raise e
+                self.do_reconnect(error_reason=e, timeout=timeout)
+
+            for cmd, output in zip(batch, self._split_batch_output(batch, boundary, chunks)):
+                logger.debug("after trimming in execute_pipelined(): {}".format(output))
+                if self.regex_registry.command_errors.search(output):
+                    if exception_on_bad_command:
+                        raise RuntimeError("bad command: {}".format(cmd))
+                    else:
+                        logger.debug("bad command: {}".format(cmd))
+                outputs.append(output)
+
+            # after a reconnect, run the commands left unanswered one by one
+            for cmd in batch[len(chunks):]:
+                outputs.append(self.execute(cmd, timeout, exception_on_bad_command, prompt))
+
+        return outputs
+
+    def _send_batch(self, batch, boundary, timeout, chunks):
+        """Send a batch of commands at once and collect the output up to each prompt.
+
+        :param batch: list of commands
+        :param boundary: compiled pattern of the prompt, not anchored
+        :param timeout: in seconds, applied to each command of the batch
+        :param chunks: list receiving the output up to and including each prompt,
+            so that the commands answered are known if the line fails
+        :return: None
+        """
+
+        # clear buffer before sending the batch
+        if self.spawn_id.read_update_buffer():
+            self.spawn_id.buffer = ''
+        self.spawn_id.send(''.join('{}\n'.format(cmd) for cmd in batch))
+        for _ in batch:
+            output = self._expect(boundary, timeout)
+            logger.debug("before trimming in _send_batch(): {}".format(output))
+            chunks.append(output)
+
+    def _split_batch_output(self, batch, boundary, chunks):
+        """The output of each command of a batch, see split_pipelined_output()
+
+        :param batch: list of commands
+        :param boundary: compiled pattern of the prompt, not anchored
+        :param chunks: the output up to and including each prompt
+        :return: list of outputs, one per chunk
+        """
+
+        # remove xterm ESC color sequences from the output, unless the spawn
+        # already removed them while reading
+        if not getattr(self.spawn_id, 'strip_ansi', False):
+            chunks = [strip_ansi(chunk) for chunk in chunks]
+        return split_pipelined_output(chunks, boundary, batch)
+
     def enable_execute(self, cmd, timeout=None, exception_on_bad_command=False):
         """Go to enable mode, run the command and return the output.
 
@@ -959,7 +1377,7 @@ class BasicLine:
         return self.execute(cmd, timeout, exception_on_bad_command)
 
     def enable_execute_lines(self, cmd_lines, timeout=None,
-                             exception_on_bad_command=False):
+                             exception_on_bad_command=False, pipelined=False):
         r"""Go to enable mode, run multiple lines of commands and return the
         output for the last command.
 
@@ -969,6 +1387,8 @@ class BasicLine:
         :param timeout: in seconds
         :param exception_on_bad_command: True/False - whether to raise an exception
             on a bad command
+        :param pipelined: True/False - whether to send the commands in batches,
+            see execute_lines()
         :return: output as string
 
         """
@@ -977,18 +1397,28 @@ class BasicLine:
             timeout = self.default_timeout
 
         self.go_to('enable_state')
-        return self.execute_lines(cmd_lines, timeout, exception_on_bad_command)
+        return self.execute_lines(cmd_lines, timeout, exception_on_bad_command,
+                                  pipelined=pipelined)
 
-    def config(self, cmd_lines, timeout=None, exception_on_bad_config=False):
+    @instrumented('config')
+    def config(self, cmd_lines, timeout=None, exception_on_bad_config=False,
+               bulk=False, batch_size=DEFAULT_PIPELINE_BATCH_SIZE):
         r"""Go to config mode, send multiple lines of configuration.
 
         cmd_lines needs to be a '\\n' delimited string.
 
+        In bulk mode the lines are streamed in batches of batch_size lines,
+        without waiting for the prompt between the lines of a batch; the output
+        of a batch is split on the prompts to find the line of each error.
+
         :param cmd_lines: a string, such as:
             "interface g0/0\\nip address 1.1.1.1 255.255.255.0\\nnameif outside"
         :param timeout: in seconds
         :param exception_on_bad_config: True/False - whether to raise an exception
-            on a bad config
+            on a bad config; in bulk mode, the lines of the batch following the
+            bad line have already been sent when the exception is raised
+        :param bulk: True/False - whether to stream the lines in batches
+        :param batch_size: number of lines sent at once in bulk mode
         :return: None
 
         """
@@ -1000,6 +1430,11 @@ class BasicLine:
         self.go_to('config_state')
         prompt = self.sm.get_state(self.sm.current_state).pattern
 
+        if bulk:
+            cmds = [cmd.strip() for cmd in cmd_lines.split('\n') if cmd.strip()]
+            self.config_bulk(cmds, prompt, timeout, exception_on_bad_config, batch_size)
+            return
+
         for cmd in cmd_lines.split('\n'):
             cmd = cmd.strip()
             if cmd == "":
@@ -1009,14 +1444,54 @@ class BasicLine:
             output = self.spawn_id.expect(prompt,
                                           timeout=timeout).last_match.string
             # handle bad command
-            errors = ["% Invalid Command", "% Incomplete Command", "Error: ",
-                      "ERROR: "]
-            if any([error in output for error in errors]):
+            if self.regex_registry.config_errors.search(output):
                 if exception_on_bad_config:
                     raise RuntimeError("bad command: {}".format(cmd))
                 else:
                     logger.debug("bad command: {}".format(cmd))
 
+    def config_bulk(self, cmds, prompt, timeout, exception_on_bad_config=False,
+                    batch_size=DEFAULT_PIPELINE_BATCH_SIZE):
+        """Stream configuration lines in batches, in the current state.
+
+        One prompt is waited for per line. A batch is sent once the device has
+        answered all the lines of the previous one, so that the console
+        type-ahead buffer is never overrun.
+
+        :param cmds: a list of configuration lines
+        :param prompt: a string representing the pattern of the config prompts
+        :param timeout: in seconds, applied to each line of a batch
+        :param exception_on_bad_config: True/False - whether to raise an exception
+            on a bad config
+        :param batch_size: number of lines sent at once
+        :return: list of (line number, line) of the bad lines, numbered from 1
+
+        """
+
+        # several prompts are expected in the same buffer, so the prompt
+        # can not be anchored to the end of it
+        boundary = self.regex_registry.compile(_unanchored_prompt(getattr(prompt, 'pattern', prompt)))
+        batch_size = max(int(batch_size), 1)
+        bad_lines = []
+        for i in range(0, len(cmds), batch_size):
+            batch = cmds[i:i + batch_size]
+            chunks = []
+            self._send_batch(batch, boundary, timeout, chunks)
+
+            # the n-th prompt ends the output of the n-th line, so that an
+            # error is not attributed to another line when the echoes come early
+            for line_number, cmd, output in zip(range(i + 1, i + len(batch) + 1), batch,
+                                                self._split_batch_output(batch, boundary, chunks)):
+                if self.regex_registry.config_errors.search(output):
+                    bad_lines.append((line_number, cmd))
+                    if exception_on_bad_config:
+                        raise RuntimeError("bad command: {} (line {}): {}".format(
+                            cmd, line_number, output))
+                    else:
+                        logger.debug("bad command: {} (line {})".format(cmd, line_number))
+        return bad_lines
+
+    @instrumented('dialog')
     def run_cmd_dialog(self, cmd, dialog, target_state=None, timeout=None):
         """run a command (based on user input as "cmd", and follow up on
         dialog.
@@ -1074,6 +1549,8 @@ class BasicLine:
         :return: None
 
         """
+        if getattr(self, 'latency_recorder', None) and self.latency_recorder.records:
+            logger.info(self.latency_recorder.summary())
         if self.spawn_id is not None:
             if self.type in ['ssh', 'ssh_vty']:
                 # send \n + ~.
@@ -1211,6 +1688,17 @@ def _time_message(start_time, end_time):
     return message
 
 
+def _unanchored_prompt(prompt):
+    r"""Remove the end of buffer anchor from a prompt pattern
+    :param prompt: a string representing a prompt pattern, such as '\r\n> $'
+    :return: the pattern without the trailing '$', such as '\r\n> '
+    """
+
+    if prompt.endswith('$') and not prompt.endswith('\\$'):
+        return prompt[:-1]
+    return prompt
+
+
 def _terminal_settings(spawn, prompt, timeout):
     """Run commands for terminal settings
     :param spawn: a Spawn object
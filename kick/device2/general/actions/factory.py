@@ -1,34 +1,86 @@
-from ...elektra.actions import Elektra
-from ...fmc.actions import Fmc
-from ...m3.actions import M3
-from ...m4.actions import M4
-from ...m5.actions import M5
-from ...ftd5500x.actions import Ftd5500x
-from ...ssp.actions import Ssp
-from ...kp.actions import Kp
-from ...series3.actions import Series3
-from ...ep.actions import Ep
-from ...chassis.actions import Chassis
-from ...wm.actions import Wm
-from ...asa.actions import Asa
-from ...wa.actions import Wa
-
-MODEL_TO_HW_MAP = {
-    '63': Series3,
-    '66': Fmc,
-    '69': Elektra,
-    '72': Elektra,
-    '75': Ftd5500x,
-    '76': Ssp,
-    '77': Kp,
-    '78': Wm,
-    '79': Wa,
-    'ep': Ep,    
-    'chassis': Chassis,    
-    'asa': Asa    
+"""Device classes by model number, name or version.
+
+The platforms are imported on first use: each of them pulls in unicon,
+its state machines and dialogs, and a process needing only one platform
+does not pay the import of all of them.
+
+"""
+
+import collections.abc
+import importlib
+
+# device class -> package of the platform, under kick.device2
+DEVICE_CLASSES = {
+    'Elektra': 'elektra',
+    'Fmc': 'fmc',
+    'M3': 'm3',
+    'M4': 'm4',
+    'M5': 'm5',
+    'Ftd5500x': 'ftd5500x',
+    'Ssp': 'ssp',
+    'Kp': 'kp',
+    'Series3': 'series3',
+    'Ep': 'ep',
+    'Chassis': 'chassis',
+    'Wm': 'wm',
+    'Asa': 'asa',
+    'Wa': 'wa',
 }
 
 
+def get_device_class(class_name):
+    """Return a device class, importing its platform on first use
+
+    :param class_name: string (has to match the name of device class)
+    :return: the class
+    """
+
+    if class_name not in DEVICE_CLASSES:
+        raise KeyError(class_name)
+    module = importlib.import_module('...{}.actions'.format(DEVICE_CLASSES[class_name]), __package__)
+    return getattr(module, class_name)
+
+
+def __getattr__(name):
+    # the device classes are still attributes of the module, e.g.
+    # 'from kick.device2.general.actions.factory import Kp'
+    if name in DEVICE_CLASSES:
+        return get_device_class(name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+class _LazyClassMap(collections.abc.Mapping):
+    """Read-only mapping of keys to device classes, given by their names"""
+
+    def __init__(self, class_names):
+        self.class_names = class_names
+
+    def __getitem__(self, key):
+        return get_device_class(self.class_names[key])
+
+    def __iter__(self):
+        return iter(self.class_names)
+
+    def __len__(self):
+        return len(self.class_names)
+
+
+MODEL_TO_HW_MAP = _LazyClassMap({
+    '63': 'Series3',
+    '66': 'Fmc',
+    '69': 'Elektra',
+    '72': 'Elektra',
+    '75': 'Ftd5500x',
+    '76': 'Ssp',
+    '77': 'Kp',
+    '78': 'Wm',
+    '79': 'Wa',
+    'ep': 'Ep',
+    'chassis': 'Chassis',
+    'asa': 'Asa'
+})
+
+
 class Factory():
     @staticmethod
     def factory_by_model(model_number, args=(), kwargs={}):
@@ -56,7 +108,7 @@ class Factory():
 
         """
 
-        return globals()[class_name](*args, **kwargs)
+        return get_device_class(class_name)(*args, **kwargs)
 
     @staticmethod
     def factory_by_version(device_family, version, args=(), kwargs={}):
@@ -71,17 +123,17 @@ class Factory():
 
         if device_family == 'Elektra':
             if version == '96.1(1)47':
-                return Elektra(*args, **kwargs)
+                return get_device_class('Elektra')(*args, **kwargs)
             else:
-                return Elektra(*args, **kwargs)
+                return get_device_class('Elektra')(*args, **kwargs)
         elif device_family == 'Fmc':
             if version.lower() == 'm3':
-                return M3(*args, **kwargs)
+                return get_device_class('M3')(*args, **kwargs)
             elif version.lower() == 'm4':
-                return M4(*args, **kwargs)
+                return get_device_class('M4')(*args, **kwargs)
             elif version.lower() == 'm5':
-                return M5(*args, **kwargs)
+                return get_device_class('M5')(*args, **kwargs)
             else:
-                return Fmc(*args, **kwargs)
+                return get_device_class('Fmc')(*args, **kwargs)
         else:
             raise RuntimeError('unknown device: {}'.format(device_family))
@@ -0,0 +1,190 @@
+"""Latency hooks around the line operations (execute, config, go_to, dialogs, waits)."""
+
+import functools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# number of calls listed per operation in the summary report
+DEFAULT_SUMMARY_TOP = 10
+
+
+class CallRecord:
+    """Measures of one call of a line operation.
+
+    operation: name of the operation, such as 'execute' or 'go_to'
+    target: the command or the destination state
+    device: hostname of the device, if known
+    line_type: type of the line, such as 'KpLine'
+    wall_time: duration of the call, in seconds
+    bytes_read: number of bytes read from the device during the call
+    match_time: time spent waiting for patterns during the call, in seconds
+    hops: number of state transitions of a go_to(), None for other operations
+    from_state: state of the line when the call started
+    self_time: wall_time minus the wall time of the instrumented calls made
+               by this call, e.g. the execute() calls of execute_lines()
+    depth: number of instrumented calls in progress when the call started,
+           0 for a call made by the user of the line
+
+    """
+
+    def __init__(self, operation, target, device, line_type, wall_time,
+                 bytes_read, match_time, hops=None, from_state=None,
+                 self_time=None, depth=0):
+        self.operation = operation
+        self.target = target
+        self.device = device
+        self.line_type = line_type
+        self.wall_time = wall_time
+        self.bytes_read = bytes_read
+        self.match_time = match_time
+        self.hops = hops
+        self.from_state = from_state
+        self.self_time = wall_time if self_time is None else self_time
+        self.depth = depth
+
+    def __repr__(self):
+        return '{}({!r}) {:.3f}s'.format(self.operation, self.target, self.wall_time)
+
+
+class LatencyRecorder:
+    """Collect the CallRecords of one or more lines.
+
+    Hooks are callables receiving each CallRecord, e.g. for publishing the
+    measures as metrics while a baseline runs.
+
+    """
+
+    def __init__(self, hooks=None):
+        """
+        :param hooks: list of callables taking a CallRecord
+        """
+
+        self.records = []
+        self.hooks = list(hooks or [])
+
+    def add_hook(self, hook):
+        """Call hook with each new CallRecord."""
+
+        self.hooks.append(hook)
+
+    def record(self, call_record):
+        self.records.append(call_record)
+        for hook in self.hooks:
+            try:
+                hook(call_record)
+            except Exception as e:
+                logger.debug('latency hook {} failed: {}'.format(hook, str(e)))
+
+    def slowest(self, operation=None, top=DEFAULT_SUMMARY_TOP):
+        """The slowest calls by their self time, optionally of a single operation.
+
+        :param operation: name of the operation, such as 'execute'
+        :param top: number of calls returned
+        :return: list of CallRecords, slowest first
+        """
+
+        records = [r for r in self.records if operation is None or r.operation == operation]
+        return sorted(records, key=lambda r: r.self_time, reverse=True)[:top]
+
+    def summary(self, top=DEFAULT_SUMMARY_TOP):
+        """Report with the time per operation and the slowest calls.
+
+        The self time of a call excludes its nested calls, so the self times
+        of all the operations add up to the time spent in the line.
+
+        :param top: number of calls listed per operation
+        :return: the report as a string
+        """
+
+        lines = ['Latency summary ({} calls, {:.1f}s):'.format(
+            len(self.records), sum(r.self_time for r in self.records))]
+        operations = []
+        for r in self.records:
+            if r.operation not in operations:
+                operations.append(r.operation)
+        for operation in operations:
+            records = [r for r in self.records if r.operation == operation]
+            lines.append('  {}: {} calls, {:.1f}s in total, {:.1f}s self, {:.1f}s waiting for patterns, '
+                         '{} bytes read'.format(operation, len(records),
+                                                sum(r.wall_time for r in records),
+                                                sum(r.self_time for r in records),
+                                                sum(r.match_time for r in records),
+                                                sum(r.bytes_read for r in records)))
+            for r in self.slowest(operation, top):
+                hops = ', {} hops from {}'.format(r.hops, r.from_state) if r.hops is not None else ''
+                lines.append('    {:8.3f}s self {:8.3f}s total  {}{} [{} {}]{}'.format(
+                    r.self_time, r.wall_time, '  ' * r.depth, r.target, r.device or '-', r.line_type, hops))
+        return '\n'.join(lines)
+
+    def clear(self):
+        self.records = []
+
+
+def _count_hops(line, from_state, to_state):
+    """Number of transitions from a state to another, if the state machine knows it"""
+
+    if to_state == 'any' or from_state == to_state:
+        return 0
+    try:
+        return len(line.sm.find_path(from_state, to_state))
+    except Exception:
+        return None
+
+
+def instrumented(operation):
+    """Decorator of line methods, recording their latency when the line has
+    a latency recorder (see BasicLine.set_latency_recorder()).
+
+    The first positional argument of the method is recorded as the target,
+    e.g. the command of execute() or the state of go_to(). The nested calls,
+    such as the execute() calls of execute_lines() or the go_to() of
+    config(), are recorded too; the self time of the outer call excludes
+    them, so that no time is counted twice in the summary.
+
+    :param operation: name of the operation in the records
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            recorder = getattr(self, 'latency_recorder', None)
+            if recorder is None:
+                return func(self, *args, **kwargs)
+            # wall time of the nested calls of each call in progress
+            calls = getattr(self, '_instrumented_calls', None)
+            if calls is None:
+                calls = self._instrumented_calls = []
+
+            spawn_id = self.spawn_id
+            bytes_read = getattr(spawn_id, 'bytes_read', 0)
+            match_time = getattr(spawn_id, 'match_time', 0.0)
+            from_state = self.sm.current_state
+            target = args[0] if args else next(iter(kwargs.values()), None)
+            if callable(target):
+                # e.g. the stop function of wait_till()
+                target = getattr(target, '__name__', target)
+            start_time = time.time()
+            calls.append(0.0)
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                nested_time = calls.pop()
+                wall_time = time.time() - start_time
+                if calls:
+                    calls[-1] += wall_time
+                if self.spawn_id is not spawn_id:
+                    # the line reconnected, count only the new spawn
+                    spawn_id, bytes_read, match_time = self.spawn_id, 0, 0.0
+                hops = _count_hops(self, from_state, target) if operation == 'go_to' else None
+                recorder.record(CallRecord(
+                    operation, target if isinstance(target, str) else repr(target),
+                    getattr(getattr(self.sm, 'patterns', None), 'hostname', None),
+                    self.line_type, wall_time,
+                    getattr(spawn_id, 'bytes_read', 0) - bytes_read,
+                    getattr(spawn_id, 'match_time', 0.0) - match_time,
+                    hops=hops, from_state=from_state,
+                    self_time=wall_time - nested_time, depth=len(calls)))
+        return wrapper
+    return decorator
@@ -0,0 +1,229 @@
+"""Duration of the phases of a baseline (power cycle, download, install, reboot, ...)."""
+
+import contextlib
+import functools
+import json
+import logging
+import os
+import time
+
+try:
+    import kick.graphite.graphite as graphite
+except ImportError:
+    import kick.metrics.metrics as graphite
+
+logger = logging.getLogger(__name__)
+
+# directory where the timeline of each baseline is written, if set
+TIMELINE_DIR = os.environ.get('KICK_TIMELINE_DIR', '')
+
+
+def _publish_duration(name, seconds):
+    """Record a duration in a timer (count, min, max, mean and percentiles),
+    or as a plain value if the metrics module has no timers"""
+
+    timer = getattr(graphite, 'time_kick_metric', None)
+    if timer is not None:
+        timer(name, seconds)
+    else:
+        graphite.publish_kick_metric(name, seconds)
+
+
+class PhaseRecord:
+    """A phase of a run.
+
+    name: name of the phase, such as 'download'
+    start, end: timestamps of the phase; end is None while it runs
+    status: 'ok', 'failed' or 'running'
+    error: message of the exception ending the phase, if any
+    metadata: additional information, such as the image name
+
+    """
+
+    def __init__(self, name, start, metadata=None):
+        self.name = name
+        self.start = start
+        self.end = None
+        self.status = 'running'
+        self.error = None
+        self.metadata = dict(metadata or {})
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.time()) - self.start
+
+    def as_dict(self):
+        return {'name': self.name, 'start': self.start, 'end': self.end,
+                'duration': round(self.duration, 3), 'status': self.status,
+                'error': self.error, 'metadata': self.metadata}
+
+
+class PhaseTimer:
+    """Timeline of the phases of a run, such as a baseline.
+
+    The phases are either delimited with phase(), a context manager, or
+    chained with begin(), each call ending the phase in progress. The
+    duration of each phase is recorded in the
+    device.<platform>.<run>.phase.<phase>.duration timer.
+
+    """
+
+    def __init__(self, platform, run, device=None):
+        """
+        :param platform: such as 'kp' or 'chassis'
+        :param run: name of the run, such as 'baseline_fp2k_ftd'
+        :param device: hostname of the device, if known
+        """
+
+        self.platform = platform
+        self.run = run
+        self.device = device
+        self.start = time.time()
+        self.end = None
+        self.status = 'running'
+        self.phases = []
+        self._current = None
+
+    def _metric(self, name):
+        return 'device.{}.{}.{}'.format(self.platform, self.run, name)
+
+    def _close(self, record, error=None):
+        record.end = time.time()
+        record.status = 'failed' if error is not None else 'ok'
+        record.error = str(error) if error is not None else None
+        logger.info('=== phase {} {} in {:.1f}s'.format(record.name, record.status, record.duration))
+        _publish_duration(self._metric('phase.{}.duration'.format(record.name)), record.duration)
+
+    def begin(self, name, **metadata):
+        """Start a phase, ending the one in progress.
+
+        :param name: name of the phase
+        :param metadata: additional information stored in the timeline
+        :return: the PhaseRecord
+        """
+
+        self.end_phase()
+        self._current = PhaseRecord(name, time.time(), metadata)
+        self.phases.append(self._current)
+        return self._current
+
+    def end_phase(self, error=None):
+        """End the phase in progress, if any.
+
+        :param error: the exception ending the phase
+        """
+
+        if self._current is not None:
+            self._close(self._current, error)
+            self._current = None
+
+    @contextlib.contextmanager
+    def phase(self, name, **metadata):
+        """Time the enclosed block as a phase.
+
+        :param name: name of the phase
+        :param metadata: additional information stored in the timeline
+        """
+
+        record = self.begin(name, **metadata)
+        try:
+            yield record
+        except BaseException as e:
+            if self._current is record:
+                self.end_phase(error=e)
+            raise
+        if self._current is record:
+            self.end_phase()
+
+    def finish(self, error=None):
+        """End the run and publish its duration.
+
+        :param error: the exception ending the run
+        """
+
+        self.end_phase(error)
+        self.end = time.time()
+        self.status = 'failed' if error is not None else 'ok'
+        _publish_duration(self._metric('duration'), self.end - self.start)
+        increment = getattr(graphite, 'increment_kick_metric', None)
+        if increment is not None:
+            increment(self._metric(self.status))
+        else:
+            graphite.publish_kick_metric(self._metric(self.status), 1)
+
+    def timeline(self):
+        """The run as a dictionary, see to_json()"""
+
+        return {'platform': self.platform, 'run': self.run, 'device': self.device,
+                'start': self.start, 'end': self.end,
+                'duration': round((self.end or time.time()) - self.start, 3),
+                'status': self.status, 'phases': [p.as_dict() for p in self.phases]}
+
+    def to_json(self):
+        return json.dumps(self.timeline(), indent=2)
+
+    def save(self, directory=None):
+        """Write the timeline to <directory>/<platform>-<run>-<device>-<start>.json
+
+        :param directory: TIMELINE_DIR by default
+        :return: path of the file
+        """
+
+        directory = directory or TIMELINE_DIR
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '{}-{}-{}-{}.json'.format(
+            self.platform, self.run, self.device or 'device',
+            time.strftime('%Y%m%d-%H%M%S', time.localtime(self.start))))
+        with open(path, 'w') as f:
+            f.write(self.to_json())
+        return path
+
+    def summary(self):
+        """The phases and their duration, for the logs"""
+
+        lines = ['{} {} {} in {:.1f}s:'.format(self.platform, self.run, self.status,
+                                               (self.end or time.time()) - self.start)]
+        for p in self.phases:
+            lines.append('  {:<24} {:8.1f}s  {}'.format(p.name, p.duration, p.status))
+        return '\n'.join(lines)
+
+
+def timed_phases(platform):
+    """Decorator of the baseline methods of the lines, timing their phases.
+
+    A PhaseTimer is set as the phase_timer of the line for the duration of
+    the call, the method marks its phases with begin_phase(). At the end,
+    the summary is logged, the timeline is kept in last_timeline and, if
+    TIMELINE_DIR is set, written there. A decorated method called by
+    another one adds its phases to the timeline of the outer call.
+
+    :param platform: name of the platform in the metrics, such as 'kp'
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if getattr(self, 'phase_timer', None) is not None:
+                return func(self, *args, **kwargs)
+
+            device = getattr(getattr(getattr(self, 'sm', None), 'patterns', None), 'hostname', None)
+            timer = PhaseTimer(platform, func.__name__, device=device)
+            self.phase_timer = timer
+            error = None
+            try:
+                return func(self, *args, **kwargs)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                self.phase_timer = None
+                timer.finish(error)
+                self.last_timeline = timer.timeline()
+                logger.info(timer.summary())
+                if TIMELINE_DIR:
+                    try:
+                        logger.info('timeline written to {}'.format(timer.save()))
+                    except OSError as e:
+                        logger.warning('could not write the timeline: {}'.format(str(e)))
+        return wrapper
+    return decorator
@@ -1,4 +1,6 @@
 """Perform power-bar options on a device."""
+import collections
+import concurrent.futures
 import logging
 import re
 import telnetlib
@@ -15,6 +17,151 @@ FORMATTER = logging.Formatter('%(asctime)s : %(levelname)s : %(name)s : %(messag
 HANDLER.setFormatter(FORMATTER)
 LOGGER.addHandler(HANDLER)
 
+POWER_BAR_ACTIONS = ['status', 'on', 'off', 'reboot']
+# seconds the ports are kept off by power_cycle_all_ports(), once all of them report off;
+# an outlet reporting off does not mean the power supplies of the device have drained
+DEFAULT_OFF_TIME = 60
+# upper bound of the wait for the ports to report the requested status, in seconds
+DEFAULT_STATUS_TIMEOUT = 60
+# delay between two status polls, in seconds
+DEFAULT_STATUS_INTERVAL = 2
+# timeout of each read from a power-bar, in seconds
+DEFAULT_SESSION_TIMEOUT = 30
+
+
+class PowerBarSession:
+    """Authenticated telnet session to a power-bar, running several outlet
+    actions without logging in again.
+
+    Can be used as a context manager:
+        with PowerBarSession('10.1.1.1', user, pwd) as session:
+            session.run('off', 21)
+            session.run('off', 22)
+
+    """
+
+    def __init__(self, power_server, user='admn', pwd='admn', timeout=DEFAULT_SESSION_TIMEOUT):
+        """
+        :param power_server: name or IP Address of power-bar
+        :param user: power-bar credential
+        :param pwd: power-bar credential
+        :param timeout: timeout of each read from the power-bar, in seconds;
+                        None waits forever
+        """
+
+        self.power_server = power_server
+        self.user = user
+        self.pwd = pwd
+        self.timeout = timeout
+        # match both 'Switched PDU:' and 'Switched CDU:' menu selection
+        self.prompt = [string_to_bytes("Switched .*:")]
+        self.session = None
+
+    def open(self):
+        """Log into the power-bar."""
+
+        self.session = telnetlib.Telnet(self.power_server)
+        try:
+            self.session.read_until(string_to_bytes("Username:"), self.timeout)
+            self.session.write(string_to_bytes(self.user + '\n'))
+            self.session.read_until(string_to_bytes("Password:"), self.timeout)
+            self.session.write(string_to_bytes(self.pwd + '\n'))
+            self._expect_prompt()
+        except:
+            self.close()
+            raise
+        return self
+
+    def _expect_prompt(self):
+        # expect returns a tuple, where the first element is the index of
+        # the match (-1 on timeout) and the last element is the text read
+        # up till and including the match
+        index, _, result = self.session.expect(self.prompt, self.timeout)
+        if index < 0:
+            raise RuntimeError('power-bar {} did not show its prompt'.format(self.power_server))
+        return result
+
+    def run(self, action, port):
+        """Perform an action on a port.
+
+        :param action: status, on, off, or reboot
+        :param port: port of the device to perform power action
+        :return: the status of the port for 'status', 'Command successful'
+                 for the other actions, None if the output is not recognized
+        """
+
+        LOGGER.info('power_bar %s port=%s action=%s' % (self.power_server, port, action))
+        if not action.lower() in POWER_BAR_ACTIONS:
+            raise ValueError('action should be one of %s' % str(POWER_BAR_ACTIONS))
+
+        # defined common patterns for the different versions of PDU
+        pattern = r'.*\.?%s +[^ ]+ +([^ ]+).*' % port if action.lower() == 'status' \
+            else r'.*(Command successful).*'
+
+        if self.session is None:
+            self.open()
+        self.session.write(string_to_bytes('%s .%s\n' % (action, port)))
+        result = self._expect_prompt()
+        for line in result.splitlines():
+            LOGGER.debug(line)
+        match = re.search(pattern, bytes_to_string(result), re.IGNORECASE)
+        return match.group(1) if match else None
+
+    def status(self, port):
+        """Status of a port, such as 'On' or 'Off'."""
+
+        status = self.run('status', port)
+        # the status column may be followed by line breaks
+        return status.split()[0] if status and status.split() else status
+
+    def wait_for_status(self, ports, status, timeout=DEFAULT_STATUS_TIMEOUT,
+                        interval=DEFAULT_STATUS_INTERVAL):
+        """Poll the status of ports until all of them report the given status.
+
+        A port whose status output is not recognized is not polled again:
+        its status is unknown, which is not taken as a failure.
+
+        :param ports: list of ports
+        :param status: 'on' or 'off'
+        :param timeout: in seconds
+        :param interval: delay between two polls, in seconds
+        :return: True if all the ports reported the status or an unknown
+                 status, False otherwise
+        """
+
+        end_time = time.time() + timeout
+        pending = list(ports)
+        while True:
+            still_pending = []
+            for port in pending:
+                port_status = self.status(port)
+                if port_status is None:
+                    LOGGER.warning('power-bar {} port {} status unknown, not waiting for {}'.format(
+                        self.power_server, port, status))
+                elif port_status.lower() != status.lower():
+                    still_pending.append(port)
+            pending = still_pending
+            if not pending:
+                return True
+            if time.time() + interval > end_time:
+                LOGGER.error('power-bar {} ports {} not {} in {} seconds'.format(
+                    self.power_server, pending, status, timeout))
+                return False
+            time.sleep(interval)
+
+    def close(self):
+        try:
+            self.session.close()
+        except:
+            pass
+        self.session = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *args):
+        self.close()
+
 
 def power_bar(
               power_server,
@@ -33,66 +180,120 @@ def power_bar(
  
     """
 
-    actions = ['status', 'on', 'off', 'reboot']
-    LOGGER.info('power_bar %s port=%s action=%s' % (power_server, port, action))
-    if not action.lower() in actions:
-        raise ValueError('action should be one of %s' % str(actions))
+    if not action.lower() in POWER_BAR_ACTIONS:
+        raise ValueError('action should be one of %s' % str(POWER_BAR_ACTIONS))
+    with PowerBarSession(power_server, user, pwd) as session:
+        return session.run(action, port)
+
+
+def split_power_bar_ports(power_bar_server, power_bar_port, power_bar_user, power_bar_pwd):
+    """Group the comma-separated power-bar settings by power-bar.
+
+    :return: an ordered dict (server, user, pwd) -> list of ports
+    """
+
+    power_bar_servers = [server.strip() for server in power_bar_server.split(',')]
+    power_bar_ports = [port.strip() for port in power_bar_port.split(',')]
+    power_bar_users = [user.strip() for user in power_bar_user.split(',')]
+    power_bar_pwds = [pwd.strip() for pwd in power_bar_pwd.split(',')]
+    ports = collections.OrderedDict()
+    for server, port, user, pwd in zip(power_bar_servers, power_bar_ports, power_bar_users, power_bar_pwds):
+        ports.setdefault((server, user, pwd), []).append(port)
+    return ports
+
+
+def _set_power_bar_ports(server, user, pwd, ports, action, status_timeout, status_interval):
+    """Turn ports of a power-bar on or off in one session and wait for their status.
 
-    # defined common patterns for the different versions of PDU
-    pattern = r'.*\.?%s +[^ ]+ +([^ ]+).*' % port if action.lower() == 'status' \
-        else r'.*(Command successful).*'
+    :return: True if all the ports were switched and none of them reported
+             another status than the new one, False otherwise
+    """
 
     try:
-        # match both 'Switched PDU:' and 'Switched CDU:' menu selection
-        prompt = [string_to_bytes("Switched .*:")]
-        session = telnetlib.Telnet(power_server)
-        session.read_until(string_to_bytes("Username:"))
-        session.write(string_to_bytes(user + '\n'))
-        session.read_until(string_to_bytes("Password:"))
-        session.write(string_to_bytes(pwd + '\n'))
-        session.expect(prompt)
-        session.write(string_to_bytes('%s .%s\n' % (action, port)))
-        # expect returns a tuple, where the last element is
-        # the text read up till and including the match
-        result = session.expect(prompt)[2]
-        for line in result.splitlines():
-            LOGGER.debug(line)
-        return re.search(pattern, bytes_to_string(result), re.IGNORECASE).group(1)
-    finally:
-        try:
-            session.close()
-        except:
-            pass
+        with PowerBarSession(server, user, pwd) as session:
+            result = True
+            for port in ports:
+                LOGGER.info('->Power {} {} {}'.format(action, server, port))
+                result = session.run(action, port) is not None and result
+            return session.wait_for_status(ports, action, status_timeout, status_interval) and result
+    except Exception as e:
+        LOGGER.error('power {} failed on {}: {}'.format(action, server, str(e)))
+        return False
+
+
+def set_power_bar_ports(power_bar_ports, action, status_timeout=DEFAULT_STATUS_TIMEOUT,
+                        status_interval=DEFAULT_STATUS_INTERVAL):
+    """Turn ports on or off, with one session per power-bar and the power-bars in parallel.
 
+    :param power_bar_ports: dict (server, user, pwd) -> list of ports
+    :param action: 'on' or 'off'
+    :param status_timeout: upper bound of the wait for the new status, in seconds
+    :param status_interval: delay between two status polls, in seconds
+    :return: True if all the ports were switched and none of them reported
+             another status than the new one, False otherwise
+    """
+
+    if not power_bar_ports:
+        return True
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(power_bar_ports)) as executor:
+        futures = [executor.submit(_set_power_bar_ports, server, user, pwd, ports, action,
+                                   status_timeout, status_interval)
+                   for (server, user, pwd), ports in power_bar_ports.items()]
+        return all([future.result() for future in futures])
+
+
+def _power_bar_ports_status(server, user, pwd, ports):
+    try:
+        with PowerBarSession(server, user, pwd) as session:
+            return {port: session.status(port) for port in ports}
+    except Exception as e:
+        LOGGER.error('could not read the status of {}: {}'.format(server, str(e)))
+        return {port: None for port in ports}
+
+
+def get_power_bar_ports_status(power_bar_ports):
+    """Status of ports, with one session per power-bar and the power-bars in parallel.
+
+    :param power_bar_ports: dict (server, user, pwd) -> list of ports
+    :return: dict (server, port) -> status such as 'On' or 'Off', None if unknown
+    """
 
-def power_cycle_all_ports(power_bar_server, power_bar_port, power_bar_user, power_bar_pwd):
+    if not power_bar_ports:
+        return {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(power_bar_ports)) as executor:
+        futures = {server: executor.submit(_power_bar_ports_status, server, user, pwd, ports)
+                   for (server, user, pwd), ports in power_bar_ports.items()}
+        return {(server, port): status for server, future in futures.items()
+                for port, status in future.result().items()}
+
+
+def power_cycle_all_ports(power_bar_server, power_bar_port, power_bar_user, power_bar_pwd,
+                          off_time=DEFAULT_OFF_TIME, status_timeout=DEFAULT_STATUS_TIMEOUT,
+                          status_interval=DEFAULT_STATUS_INTERVAL):
     """Powers off and then powers on all given ports.
 
+    The ports of a power-bar are switched in a single session and the
+    power-bars are switched in parallel; the status of the ports is polled
+    instead of sleeping a fixed time after each action.
+
     :param power_bar_server: comma-separated string of IP addresses of the PDU's
     :param power_bar_port: comma-separated string of power port on the PDU's
     :param power_bar_user: comma-separated usernames for power bar servers
     :param power_bar_pwd:  comma-separated passwords for power bar servers
+    :param off_time: how long the ports are kept off once all of them report off, in seconds
+    :param status_timeout: upper bound of the wait for the ports to report the new status, in seconds
+    :param status_interval: delay between two status polls, in seconds
     :return: True if all ports were powered off and on successfully, False otherwise
     """
 
-    result = True
-    power_bar_servers = [server.strip() for server in power_bar_server.split(',')]
-    power_bar_ports = [port.strip() for port in power_bar_port.split(',')]
-    power_bar_users = [user.strip() for user in power_bar_user.split(',')]
-    power_bar_pwds = [pwd.strip() for pwd in power_bar_pwd.split(',')]
+    power_bar_ports = split_power_bar_ports(power_bar_server, power_bar_port, power_bar_user, power_bar_pwd)
     LOGGER.info('->Power off all power ports')
-    for server, port, user, pwd in zip(power_bar_servers, power_bar_ports, power_bar_users, power_bar_pwds):
-        LOGGER.info('->Power off {} {}'.format(server, port))
-        result = result and power_bar(server, port, action='off', user=user, pwd=pwd)
-        LOGGER.info('->Done ')
-        time.sleep(10)
-    LOGGER.info("Sleeping for 60 secs..")
-    time.sleep(60)
+    result = set_power_bar_ports(power_bar_ports, 'off', status_timeout, status_interval)
+    LOGGER.info('->Done ')
+    LOGGER.info("Keeping the ports off for {} secs..".format(off_time))
+    time.sleep(off_time)
     LOGGER.info('->Power on all power ports')
-    for server, port, user, pwd in zip(power_bar_servers, power_bar_ports, power_bar_users, power_bar_pwds):
-        LOGGER.info('->Power on {} {}'.format(server, port))
-        result = result and power_bar(server, port, action='on', user=user, pwd=pwd)
-        LOGGER.info('->Done')
-        time.sleep(10)
+    result = set_power_bar_ports(power_bar_ports, 'on', status_timeout, status_interval) and result
+    LOGGER.info('->Done')
 
     return result
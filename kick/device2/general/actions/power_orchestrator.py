@@ -0,0 +1,217 @@
+"""Power cycle many devices at once, powering them back on in staggered waves."""
+
+import collections
+import concurrent.futures
+import logging
+import time
+
+from .power_bar import DEFAULT_OFF_TIME, DEFAULT_STATUS_INTERVAL, DEFAULT_STATUS_TIMEOUT, \
+    get_power_bar_ports_status, split_power_bar_ports, set_power_bar_ports
+
+logger = logging.getLogger(__name__)
+
+# number of devices powered on at the same time, to respect the inrush limits of the power-bars
+DEFAULT_WAVE_SIZE = 4
+# seconds between two waves
+DEFAULT_WAVE_INTERVAL = 10
+# seconds each device is given to boot up
+DEFAULT_BOOT_TIMEOUT = 600
+
+
+class PowerTarget:
+    """A device and its power-bar outlets.
+
+    The power-bar settings are comma-separated strings, as in the
+    power_bar_* fields of the lines; line is optional and, if given,
+    its wait_until_device_on() is used for tracking the boot.
+
+    """
+
+    def __init__(self, name, power_bar_server, power_bar_port, power_bar_user='admn',
+                 power_bar_pwd='admn', line=None):
+        self.name = name
+        self.power_bar_server = power_bar_server
+        self.power_bar_port = power_bar_port
+        self.power_bar_user = power_bar_user
+        self.power_bar_pwd = power_bar_pwd
+        self.line = line
+
+    @classmethod
+    def from_line(cls, line, name=None):
+        """Target built from the power-bar settings of a line, such as a KpLine
+        after set_power_bar().
+
+        :param line: the line
+        :param name: name of the device; the hostname of the line if not given
+        :return: a PowerTarget object
+        """
+
+        name = name or getattr(getattr(line.sm, 'patterns', None), 'hostname', None) or repr(line)
+        return cls(name, line.power_bar_server, line.power_bar_port,
+                   line.power_bar_user, line.power_bar_pwd, line=line)
+
+    @classmethod
+    def from_chassis_power_data(cls, name, chassis_power_data, line=None):
+        """Target built from the chassis_power section of chassis_data.
+
+        :param name: name of the device
+        :param chassis_power_data: a dictionary with the power_bar_server,
+            power_bar_port, power_bar_user and power_bar_password keys
+        :param line: the line of the device, for tracking its boot
+        :return: a PowerTarget object
+        """
+
+        return cls(name, chassis_power_data.get('power_bar_server', ''),
+                   chassis_power_data.get('power_bar_port', ''),
+                   chassis_power_data.get('power_bar_user', ''),
+                   chassis_power_data.get('power_bar_password', ''), line=line)
+
+    def power_bar_ports(self):
+        """Ports of the target grouped by power-bar: (server, user, pwd) -> list of ports"""
+
+        return split_power_bar_ports(self.power_bar_server, self.power_bar_port,
+                                     self.power_bar_user, self.power_bar_pwd)
+
+
+class PowerCycleResult:
+    """Result of the power cycle of a target.
+
+    powered_off, powered_on: True if all the outlets reported the new status
+    ready: True if the device booted, False if not, None if not tracked
+    boot_time: seconds from power on to ready, None if not tracked
+    error: error raised while waiting for the device
+
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.powered_off = False
+        self.powered_on = False
+        self.ready = None
+        self.boot_time = None
+        self.error = None
+
+    @property
+    def success(self):
+        return self.powered_off and self.powered_on and self.ready is not False
+
+    def __repr__(self):
+        return 'PowerCycleResult({} off={} on={} ready={})'.format(
+            self.target.name, self.powered_off, self.powered_on, self.ready)
+
+
+def _merge_power_bar_ports(targets):
+    ports = collections.OrderedDict()
+    for target in targets:
+        for power_bar, target_ports in target.power_bar_ports().items():
+            ports.setdefault(power_bar, []).extend(target_ports)
+    return ports
+
+
+def _set_targets(targets, action, status_timeout, status_interval):
+    """Switch the targets with one session per power-bar, the power-bars in parallel.
+
+    :return: dict target name -> True if all its outlets reported the new status
+    """
+
+    ports = {target.name: target.power_bar_ports() for target in targets}
+    results = {}
+    # switch all the outlets at once; if one of the power-bars failed, switch
+    # again only the targets whose outlets did not reach the new status, the
+    # others must not be toggled twice
+    merged = _merge_power_bar_ports(targets)
+    if set_power_bar_ports(merged, action, status_timeout, status_interval):
+        return {target.name: True for target in targets}
+    status = get_power_bar_ports_status(merged)
+    for target in targets:
+        switched = all((status.get((server, port)) or '').lower() == action
+                       for (server, _, _), target_ports in ports[target.name].items()
+                       for port in target_ports)
+        if switched:
+            results[target.name] = True
+            continue
+        logger.info('retrying power {} of {}'.format(action, target.name))
+        results[target.name] = set_power_bar_ports(ports[target.name], action,
+                                                   status_timeout, status_interval)
+    return results
+
+
+def _wait_until_ready(result, boot_timeout):
+    start_time = time.time()
+    try:
+        result.target.line.wait_until_device_on(timeout=boot_timeout)
+        result.ready = True
+    except Exception as e:
+        logger.error('{} did not boot up: {}'.format(result.target.name, str(e)))
+        result.ready = False
+        result.error = e
+    result.boot_time = time.time() - start_time
+
+
+def power_cycle_fleet(targets, wave_size=DEFAULT_WAVE_SIZE, wave_interval=DEFAULT_WAVE_INTERVAL,
+                      off_time=DEFAULT_OFF_TIME, wait_until_device_is_on=True,
+                      boot_timeout=DEFAULT_BOOT_TIMEOUT, status_timeout=DEFAULT_STATUS_TIMEOUT,
+                      status_interval=DEFAULT_STATUS_INTERVAL):
+    """Power cycle many devices: all of them are powered off in parallel, then
+    powered on in waves of wave_size devices, wave_interval seconds apart.
+
+    The boot of the devices with a line is tracked with the
+    wait_until_device_on() of the line as soon as their wave is powered on.
+
+    :param targets: list of PowerTarget objects
+    :param wave_size: number of devices powered on at the same time
+    :param wave_interval: seconds between two waves
+    :param off_time: how long the outlets are kept off once all of them report off, in seconds
+    :param wait_until_device_is_on: True/False - whether to wait for the devices to boot up
+    :param boot_timeout: seconds each device is given to boot up
+    :param status_timeout: upper bound of the wait for the outlets to report the new status, in seconds
+    :param status_interval: delay between two status polls, in seconds
+    :return: list of PowerCycleResult objects, in the order of targets
+    """
+
+    results = collections.OrderedDict((target.name, PowerCycleResult(target)) for target in targets)
+    if len(results) != len(targets):
+        raise ValueError('the names of the power targets must be unique')
+
+    logger.info('->Power off {} devices'.format(len(targets)))
+    for name, powered_off in _set_targets(targets, 'off', status_timeout, status_interval).items():
+        results[name].powered_off = powered_off
+    logger.info("Keeping the devices off for {} secs..".format(off_time))
+    time.sleep(off_time)
+
+    wave_size = max(int(wave_size), 1)
+    trackers = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(targets), 1)) as executor:
+        for i in range(0, len(targets), wave_size):
+            if i:
+                time.sleep(wave_interval)
+            wave = targets[i:i + wave_size]
+            logger.info('->Power on wave {}: {}'.format(i // wave_size + 1,
+                                                        ', '.join(t.name for t in wave)))
+            for name, powered_on in _set_targets(wave, 'on', status_timeout, status_interval).items():
+                results[name].powered_on = powered_on
+            if wait_until_device_is_on:
+                trackers.extend(executor.submit(_wait_until_ready, results[t.name], boot_timeout)
+                                for t in wave if t.line is not None)
+        concurrent.futures.wait(trackers)
+
+    results = list(results.values())
+    logger.info(summarize_power_cycle(results))
+    return results
+
+
+def summarize_power_cycle(results):
+    """Summary of a fleet power cycle.
+
+    :param results: list of PowerCycleResult objects
+    :return: the summary as a string
+    """
+
+    lines = ['{} of {} devices power cycled successfully'.format(
+        len([r for r in results if r.success]), len(results))]
+    for r in results:
+        boot = ', booted in {} seconds'.format(round(r.boot_time, 1)) \
+            if r.ready and r.boot_time is not None else ''
+        lines.append('  {}: off={} on={} ready={}{}'.format(
+            r.target.name, r.powered_off, r.powered_on, r.ready, boot))
+    return '\n'.join(lines)
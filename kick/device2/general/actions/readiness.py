@@ -0,0 +1,137 @@
+"""Readiness probes used instead of fixed sleeps while a device boots or installs."""
+
+import logging
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+# first delay between two polls, in seconds
+DEFAULT_POLL_INTERVAL = 5
+# the delay between two polls is doubled up to this value, in seconds
+DEFAULT_MAX_POLL_INTERVAL = 60
+
+# errors returned by FXOS while DME is not ready yet, e.g.:
+# FPR4120-1-A# scope system
+# Software Error: Exception during execution:
+# [Error: Timed out communicating with DME]
+DME_ERRORS = ['Timed out communicating with DME', 'Software Error']
+
+# upper bound of the wait for DME after the chassis boots, in seconds
+DME_READY_TIMEOUT = 300
+# upper bound of the wait for the console after an FXOS upgrade reboot, in seconds
+REBOOT_READY_TIMEOUT = 480
+
+
+def wait_until(condition, timeout, interval=DEFAULT_POLL_INTERVAL,
+               max_interval=DEFAULT_MAX_POLL_INTERVAL, backoff=2,
+               name='condition', raise_on_timeout=True):
+    """Poll a condition until it is met, doubling the delay between polls.
+
+    :param condition: callable with no arguments, the condition is met when
+                      it returns a true value
+    :param timeout: upper bound of the wait, in seconds
+    :param interval: first delay between two polls, in seconds
+    :param max_interval: maximum delay between two polls, in seconds
+    :param backoff: factor applied to the delay after each poll
+    :param name: name of the condition, used for logging
+    :param raise_on_timeout: True/False - whether to raise an exception or
+                             only log a warning when the timeout expires
+    :return: True if the condition was met, False otherwise
+    """
+
+    start_time = time.time()
+    end_time = start_time + timeout
+    while True:
+        if condition():
+            LOGGER.info('{} met after {} seconds'.format(
+                name, round(time.time() - start_time, 1)))
+            return True
+        remaining = end_time - time.time()
+        if remaining <= 0:
+            break
+        LOGGER.debug('{} not met, polling again in {} seconds'.format(
+            name, round(min(interval, remaining), 1)))
+        time.sleep(min(interval, remaining))
+        interval = min(interval * backoff, max_interval)
+
+    if raise_on_timeout:
+        raise RuntimeError('{} not met in {} seconds'.format(name, timeout))
+    LOGGER.warning('{} not met in {} seconds ... continue'.format(name, timeout))
+    return False
+
+
+def is_prompt_responsive(line, prompts, timeout=10):
+    """Check whether the device answers a new line with one of the prompts.
+
+    :param line: BasicLine object
+    :param prompts: a pattern or a list of patterns, such as the login prompt
+                    and the prompt of a state
+    :param timeout: how long to wait for the prompt, in seconds
+    :return: True if one of the prompts was seen, False otherwise
+    """
+
+    if not isinstance(prompts, (list, tuple)):
+        prompts = [prompts]
+    try:
+        line.spawn_id.sendline()
+        line.spawn_id.expect(prompts, timeout=timeout)
+    except Exception as e:
+        LOGGER.debug('prompt not seen: {}'.format(str(e)))
+        return False
+    return True
+
+
+def is_login_banner_shown(line, login_prompt, timeout=10):
+    """Check whether the device shows its login banner.
+
+    :param line: BasicLine object
+    :param login_prompt: pattern of the login prompt, such as 'firepower login: '
+    :param timeout: how long to wait for the login prompt, in seconds
+    :return: True if the login prompt was seen, False otherwise
+    """
+
+    return is_prompt_responsive(line, login_prompt, timeout=timeout)
+
+
+def is_dme_available(line, state='mio_state', timeout=30):
+    """Check whether FXOS DME answers to commands.
+
+    The probe goes to the given state and runs 'scope system'; DME is
+    available if the command does not return one of DME_ERRORS.
+
+    :param line: BasicLine object
+    :param state: FXOS state of the line, such as 'mio_state' or 'fxos_state'
+    :param timeout: timeout of each command, in seconds
+    :return: True if DME is available, False otherwise
+    """
+
+    try:
+        line.go_to(state, timeout=timeout)
+        output = line.execute('scope system', timeout=timeout)
+        line.execute('top', timeout=timeout)
+    except Exception as e:
+        LOGGER.debug('DME probe failed: {}'.format(str(e)))
+        return False
+    return not any(error in output for error in DME_ERRORS)
+
+
+def wait_until_ready(line, probes, timeout, interval=DEFAULT_POLL_INTERVAL,
+                     max_interval=DEFAULT_MAX_POLL_INTERVAL, raise_on_timeout=True):
+    """Wait until all the probes succeed on a line.
+
+    :param line: BasicLine object
+    :param probes: list of callables taking the line as argument, such as
+                   is_dme_available
+    :param timeout: upper bound of the wait, in seconds
+    :param interval: first delay between two polls, in seconds
+    :param max_interval: maximum delay between two polls, in seconds
+    :param raise_on_timeout: True/False - whether to raise an exception or
+                             only log a warning when the timeout expires
+    :return: True if the device is ready, False otherwise
+    """
+
+    names = ', '.join(getattr(probe, '__name__', str(probe)) for probe in probes)
+    return wait_until(lambda: all(probe(line) for probe in probes), timeout,
+                      interval=interval, max_interval=max_interval,
+                      name='readiness ({})'.format(names),
+                      raise_on_timeout=raise_on_timeout)
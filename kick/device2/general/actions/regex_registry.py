@@ -0,0 +1,98 @@
+"""Compiled prompt and error patterns shared by the lines of a state machine."""
+
+import re
+import weakref
+
+from .stream import ANSI_COLORS_ESCAPE, ANSI_TITLE_ESCAPE, compile_cached
+
+# error strings that mark a bad command in the output of execute() and config()
+COMMAND_ERRORS = ["% Invalid Command", "% Incomplete Command", "Error: ",
+                  "ERROR: ", "Error ", "ERROR "]
+CONFIG_ERRORS = ["% Invalid Command", "% Incomplete Command", "Error: ",
+                 "ERROR: "]
+
+# registry of each state machine
+_REGISTRIES = weakref.WeakKeyDictionary()
+
+
+def compile_pattern(pattern):
+    """Compile a pattern once and return the cached compiled object
+
+    :param pattern: a string or an already compiled pattern
+    :return: the compiled pattern
+    """
+
+    if not isinstance(pattern, str):
+        return pattern
+    return compile_cached(pattern)
+
+
+def compile_errors(errors):
+    """Compile a list of error strings into a single alternation
+
+    :param errors: list of error strings
+    :return: the compiled pattern
+    """
+
+    return compile_pattern('|'.join(re.escape(error) for error in errors))
+
+
+class RegexRegistry:
+    """Compiled prompts of the states of a state machine, together with the
+    ANSI escape and bad command matchers used by BasicLine."""
+
+    ansi_colors_escape = ANSI_COLORS_ESCAPE
+    ansi_title_escape = ANSI_TITLE_ESCAPE
+    command_errors = compile_errors(COMMAND_ERRORS)
+    config_errors = compile_errors(CONFIG_ERRORS)
+
+    def __init__(self, sm):
+        """
+        :param sm: the state machine
+        """
+
+        self.sm = sm
+        self.prompts = {}
+
+    def prompt(self, state):
+        """Compiled prompt of a state.
+
+        The prompt is compiled again only if the pattern of the state changes,
+        e.g. after the state machine is reinitialized with a new hostname.
+
+        :param state: name of the state
+        :return: the compiled pattern
+        """
+
+        pattern = self.sm.get_state(state).pattern
+        cached = self.prompts.get(state)
+        if cached is None or cached.pattern != pattern:
+            cached = self.prompts[state] = compile_pattern(pattern)
+        return cached
+
+    @staticmethod
+    def compile(pattern):
+        """Compiled object of a pattern given by the user.
+
+        :param pattern: a string or an already compiled pattern
+        :return: the compiled pattern
+        """
+
+        return compile_pattern(pattern)
+
+
+def get_regex_registry(sm):
+    """Return the registry of a state machine, creating it on first use
+
+    :param sm: the state machine
+    :return: a RegexRegistry object
+    """
+
+    try:
+        registry = _REGISTRIES.get(sm)
+        if registry is None:
+            registry = _REGISTRIES[sm] = RegexRegistry(sm)
+    except TypeError:
+        # the state machine can not be weakly referenced
+        registry = RegexRegistry(sm)
+    return registry
@@ -0,0 +1,1004 @@
+"""Offline simulator of the device consoles, for driving the lines without hardware.
+
+A SimulatedDevice replays a Personality: the prompts of its states, the
+commands moving between them and the output of the other commands. Its
+console is served either on the standard input/output of a process, so
+that NewSpawn runs it in a pty like the telnet or ssh clients, or on a tcp
+port speaking telnet (with an optional terminal server login) or ssh.
+
+The timing of a real console is reproduced by SimulatorConfig: latency of
+the replies, baud rate of the serial line, volume of the output, --More--
+paging and random disconnects, drawn from a seeded generator so that a run
+can be repeated when measuring the I/O engine.
+
+    python -m kick.device2.general.actions.simulator kp --baud 9600 --latency 0.05
+
+    line = connect_simulator(kp, 'kp', SimulatorConfig(baud=9600, page_length=24))
+
+"""
+
+import argparse
+import codecs
+import logging
+import os
+import random
+import re
+import shlex
+import socketserver
+import sys
+import termios
+import threading
+import time
+import tty
+
+logger = logging.getLogger(__name__)
+
+# size of the reads from the console, in bytes
+READ_SIZE = 4096
+# lines of output of the bulk commands, such as 'show tech-support', when no volume is set
+DEFAULT_BULK_LINES = 1000
+# a throttled write is split in chunks sent every THROTTLE_INTERVAL seconds
+THROTTLE_INTERVAL = 0.02
+MORE_PROMPT = '--More--'
+# first words of the configuration lines accepted by the lina config state
+LINA_CONFIG_COMMANDS = ['interface', 'nameif', 'ip', 'ipv6', 'security-level', 'shutdown', 'management-only',
+                        'description', 'speed', 'duplex', 'mtu', 'vlan', 'hostname', 'domain-name', 'dns',
+                        'name-server', 'route', 'access-list', 'access-group', 'object', 'object-group',
+                        'nat', 'username', 'aaa', 'ssh', 'telnet', 'http', 'logging', 'ntp', 'clock',
+                        'boot', 'failover', 'crypto', 'policy-map', 'class-map', 'service-policy', 'write']
+
+# telnet commands and options
+IAC, DONT, DO, WONT, WILL, SB, SE = 255, 254, 253, 252, 251, 250, 240
+ECHO, SUPPRESS_GO_AHEAD = 1, 3
+
+
+class Disconnected(Exception):
+    """The console was closed, by the peer or by a simulated disconnect."""
+
+
+class Reply:
+    """Reaction of a state to a command.
+
+    output: text printed, or a callable (session, match) -> text
+    goto: name of the next state, None to stay in the state
+    bulk: SimulatorConfig.output_volume lines are added to the output
+    action: callable (session, match) run before the output, e.g. for
+            changing the scope of the FXOS prompt
+
+    """
+
+    def __init__(self, output='', goto=None, bulk=False, action=None):
+        self.output = output
+        self.goto = goto
+        self.bulk = bulk
+        self.action = action
+
+
+class SimState:
+    """A state of a personality."""
+
+    def __init__(self, name, prompt, commands=(), secret=False, error=None, counter=None):
+        """
+        :param name: name of the state, such as 'fxos'
+        :param prompt: prompt of the state, formatted with the context of the
+                       device, e.g. '{hostname}# '
+        :param commands: list of (regex, Reply) tuples, the regex must match
+                         the whole command
+        :param secret: the input is not echoed, as for passwords
+        :param error: output of the unknown commands, accepted silently if None
+        :param counter: context key incremented by each command, such as
+                        the number of the rommon prompt
+        """
+
+        self.name = name
+        self.prompt = prompt
+        self.commands = [(re.compile(r'\s*{}\s*$'.format(pattern)), reply) for pattern, reply in commands]
+        self.secret = secret
+        self.error = error
+        self.counter = counter
+
+    def match(self, command):
+        """The Reply to a command and the match object, (None, None) if the command is unknown"""
+
+        for regex, reply in self.commands:
+            m = regex.match(command)
+            if m:
+                return reply, m
+        return None, None
+
+
+class Personality:
+    """The scripted behaviour of a device console."""
+
+    def __init__(self, name, states, initial, context=None, banner=''):
+        """
+        :param name: name of the personality, such as 'kp'
+        :param states: list of SimState objects
+        :param initial: name of the state of a new device
+        :param context: initial values of the prompt fields, such as hostname
+        :param banner: text printed when a console connects
+        """
+
+        self.name = name
+        self.states = {state.name: state for state in states}
+        self.initial = initial
+        self.context = dict(context or {})
+        self.banner = banner
+        if initial not in self.states:
+            raise RuntimeError('unknown initial state {} of {}'.format(initial, name))
+
+
+class SimulatorConfig:
+    """Timing and failures of a simulated console.
+
+    latency: seconds before each reply
+    jitter: random seconds added to latency, at most
+    baud: speed of the serial line, 0 for no limit; a character is 10 bits
+    output_volume: lines added to the output of the bulk commands
+    page_length: lines shown before a --More-- prompt, 0 for no paging;
+                 'terminal length 0' disables it for the session
+    disconnect_rate: probability of closing the console after a command
+    seed: seed of the random generator of the latency jitter and of the disconnects
+    typeahead_echo: the input is echoed as soon as it is received, as by a
+                    line discipline, so the echo of commands typed ahead comes
+                    before the output and the prompt of the previous command
+
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, baud=0, output_volume=0, page_length=0,
+                 disconnect_rate=0.0, seed=None, typeahead_echo=False):
+        self.latency = latency
+        self.jitter = jitter
+        self.baud = baud
+        self.output_volume = output_volume
+        self.page_length = page_length
+        self.disconnect_rate = disconnect_rate
+        self.seed = seed
+        self.typeahead_echo = typeahead_echo
+
+    def as_args(self):
+        """The configuration as command line options of the simulator"""
+
+        return ['--latency', str(self.latency), '--jitter', str(self.jitter), '--baud', str(self.baud),
+                '--output-volume', str(self.output_volume), '--page-length', str(self.page_length),
+                '--disconnect-rate', str(self.disconnect_rate)] + \
+               (['--seed', str(self.seed)] if self.seed is not None else []) + \
+               (['--typeahead-echo'] if self.typeahead_echo else [])
+
+
+class SimulatedDevice:
+    """A device replaying a personality.
+
+    The state is kept between the sessions, as on a console port: a new
+    session lands where the previous one left the device.
+
+    """
+
+    def __init__(self, personality, state=None, **context):
+        """
+        :param personality: a Personality object or the name of a registered one
+        :param state: state of the device, the initial state of the personality by default
+        :param context: values of the prompt fields, such as hostname='FPR4120-1-A'
+        """
+
+        if isinstance(personality, str):
+            personality = get_personality(personality)
+        self.personality = personality
+        self.state = state or personality.initial
+        self.context = dict(personality.context, **context)
+        self.lock = threading.Lock()
+        self.stats = {'sessions': 0, 'commands': 0, 'bytes_in': 0, 'bytes_out': 0, 'disconnects': 0}
+
+    @property
+    def current(self):
+        return self.personality.states[self.state]
+
+    def prompt(self):
+        return self.current.prompt.format(**self.context)
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.stats[key] += value
+
+
+class _FdChannel:
+    """Console on file descriptors, such as the standard input/output in a pty."""
+
+    def __init__(self, in_fd, out_fd):
+        self.in_fd = in_fd
+        self.out_fd = out_fd
+
+    def recv(self, size):
+        try:
+            return os.read(self.in_fd, size)
+        except OSError:
+            return b''
+
+    def sendall(self, data):
+        while data:
+            data = data[os.write(self.out_fd, data):]
+
+    def close(self):
+        pass
+
+
+class _TelnetChannel:
+    """Console on a telnet connection.
+
+    The server echoes the input, so the client is switched to character
+    mode; the telnet commands sent by the client are removed from the input.
+
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._pending = b''
+        self.sock.sendall(bytes([IAC, WILL, ECHO, IAC, WILL, SUPPRESS_GO_AHEAD, IAC, DO, SUPPRESS_GO_AHEAD]))
+
+    def recv(self, size):
+        while True:
+            data = self.sock.recv(size)
+            if not data:
+                return b''
+            data = self._filter(self._pending + data)
+            if data:
+                return data
+
+    def _filter(self, data):
+        out = bytearray()
+        i = 0
+        self._pending = b''
+        while i < len(data):
+            if data[i] != IAC:
+                out.append(data[i])
+                i += 1
+                continue
+            if i + 1 >= len(data):
+                self._pending = data[i:]
+                break
+            command = data[i + 1]
+            if command == IAC:
+                out.append(IAC)
+                i += 2
+            elif command in (DO, DONT, WILL, WONT):
+                if i + 2 >= len(data):
+                    self._pending = data[i:]
+                    break
+                i += 3
+            elif command == SB:
+                end = data.find(bytes([IAC, SE]), i)
+                if end < 0:
+                    self._pending = data[i:]
+                    break
+                i = end + 2
+            else:
+                i += 2
+        return bytes(out)
+
+    def sendall(self, data):
+        self.sock.sendall(data.replace(bytes([IAC]), bytes([IAC, IAC])))
+
+    def close(self):
+        self.sock.close()
+
+
+class ConsoleSession:
+    """A connection to the console of a SimulatedDevice."""
+
+    def __init__(self, device, channel, config=None, rng=None):
+        """
+        :param device: the SimulatedDevice
+        :param channel: object with recv(size), sendall(data) and close()
+        :param config: a SimulatorConfig object
+        :param rng: random.Random generator, seeded from config by default
+        """
+
+        self.device = device
+        self.channel = channel
+        self.config = config or SimulatorConfig()
+        self.rng = rng or random.Random(self.config.seed)
+        self.paging = self.config.page_length > 0
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._buffer = ''
+        # number of characters of the buffer already echoed, and whether the
+        # last character read was, see SimulatorConfig.typeahead_echo
+        self._echoed = 0
+        self._last_echoed = False
+        self._skip_lf = False
+
+    # output
+
+    def write(self, text):
+        """Send text at the baud rate of the configuration"""
+
+        data = text.encode('utf-8')
+        self.device.count('bytes_out', len(data))
+        if not self.config.baud:
+            self.channel.sendall(data)
+            return
+        rate = self.config.baud / 10.0
+        chunk_size = max(1, int(rate * THROTTLE_INTERVAL))
+        for i in range(0, len(data), chunk_size):
+            chunk = data[i:i + chunk_size]
+            self.channel.sendall(chunk)
+            time.sleep(len(chunk) / rate)
+
+    def write_output(self, lines):
+        """Send the lines of an output, paged if paging is on"""
+
+        if not lines:
+            return
+        page = self.config.page_length
+        if not self.paging or len(lines) <= page:
+            self.write('\r\n'.join(lines) + '\r\n')
+            return
+        i = 0
+        show = page
+        while i < len(lines):
+            self.write('\r\n'.join(lines[i:i + show]) + '\r\n')
+            i += show
+            if i >= len(lines):
+                break
+            self.write(MORE_PROMPT)
+            key = self.read_char()
+            # erase --More-- as the devices do
+            self.write('\r' + ' ' * len(MORE_PROMPT) + '\r')
+            if key in 'qQ\x03':
+                self.write('\r\n')
+                break
+            show = 1 if key in '\r\n' else page
+            if key == '\r':
+                self._skip_lf = True
+
+    def prompt(self):
+        self.write(self.device.prompt())
+
+    # input
+
+    def read_char(self):
+        while not self._buffer:
+            data = self.channel.recv(READ_SIZE)
+            if not data:
+                raise Disconnected('closed by the peer')
+            self.device.count('bytes_in', len(data))
+            self._buffer = self._decoder.decode(data)
+            if self.config.typeahead_echo and not self.device.current.secret:
+                self.write(re.sub(r'\r\n?|\n', '\r\n', self._buffer.replace('\x00', '')))
+                self._echoed = len(self._buffer)
+        char, self._buffer = self._buffer[0], self._buffer[1:]
+        self._last_echoed = self._echoed > 0
+        self._echoed = max(self._echoed - 1, 0)
+        return char
+
+    def read_line(self, secret=False):
+        """Read a command, echoing it unless secret
+
+        :return: the command, None if interrupted with ctrl-c
+        """
+
+        line = ''
+        while True:
+            char = self.read_char()
+            echo = not secret and not self._last_echoed
+            if self._skip_lf:
+                self._skip_lf = False
+                if char in '\n\x00':
+                    continue
+            if char in '\r\n':
+                self._skip_lf = char == '\r'
+                if not self._last_echoed:
+                    self.write('\r\n')
+                return line
+            if char in '\x7f\x08':
+                if line:
+                    line = line[:-1]
+                    if echo:
+                        self.write('\b \b')
+            elif char == '\x03':
+                self.write('^C\r\n')
+                return None
+            else:
+                line += char
+                if echo:
+                    self.write(char)
+
+    # commands
+
+    def _bulk(self, command):
+        count = self.config.output_volume or DEFAULT_BULK_LINES
+        return ['{} line {:06d}: {}'.format(self.device.personality.name, i, 'x' * 48) for i in range(count)]
+
+    def handle(self, command):
+        """Run a command in the current state
+
+        :return: the lines of the output
+        """
+
+        state = self.device.current
+        if state.counter:
+            self.device.context[state.counter] = self.device.context.get(state.counter, 0) + 1
+        if not state.secret:
+            if re.match(r'\s*terminal (length|pager( lines)?) 0\s*$', command):
+                self.paging = False
+                return []
+            if re.match(r'\s*terminal (length|pager( lines)?) \d+\s*$', command) or \
+                    re.match(r'\s*terminal width \d+\s*$', command) or not command.strip():
+                return []
+
+        reply, m = state.match(command)
+        if reply is None:
+            if state.error is None:
+                return []
+            return state.error.format(command=command.strip(), **self.device.context).split('\n')
+
+        if reply.action is not None:
+            reply.action(self, m)
+        output = reply.output(self, m) if callable(reply.output) else reply.output
+        lines = output.split('\n') if output else []
+        if reply.bulk:
+            lines.extend(self._bulk(command))
+        if reply.goto is not None:
+            self.device.state = reply.goto
+        return lines
+
+    def _delay(self):
+        delay = self.config.latency + (self.rng.uniform(0, self.config.jitter) if self.config.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def run(self):
+        """Serve the console until it is closed"""
+
+        self.device.count('sessions')
+        try:
+            if self.device.personality.banner:
+                self.write(self.device.personality.banner.replace('\n', '\r\n') + '\r\n')
+            self.prompt()
+            while True:
+                command = self.read_line(secret=self.device.current.secret)
+                if command is None:
+                    self.prompt()
+                    continue
+                self.device.count('commands')
+                if self.config.disconnect_rate and self.rng.random() < self.config.disconnect_rate:
+                    self.device.count('disconnects')
+                    raise Disconnected('simulated disconnect')
+                lines = self.handle(command)
+                self._delay()
+                self.write_output(lines)
+                self.prompt()
+        except Disconnected as e:
+            logger.debug('{} console: {}'.format(self.device.personality.name, str(e)))
+        except OSError as e:
+            logger.debug('{} console: {}'.format(self.device.personality.name, str(e)))
+        finally:
+            self.channel.close()
+
+
+def _terminal_server_login(session, username, password):
+    """Login of a terminal server port, as in telnet_console_with_credential()"""
+
+    for _ in range(3):
+        session.write('\r\nUser Access Verification\r\n\r\nUsername: ')
+        user = session.read_line()
+        session.write('Password: ')
+        secret = session.read_line(secret=True)
+        if user == username and secret == password:
+            session.write('Password OK\r\n')
+            return True
+        session.write('% Authentication failed\r\n')
+    return False
+
+
+class SimulatorServer:
+    """Console of a SimulatedDevice on a tcp port, with telnet or ssh.
+
+    With a username and a password, the telnet port asks for them first, as
+    a terminal server does, and the ssh server checks them.
+
+    """
+
+    def __init__(self, device, config=None, host='127.0.0.1', port=0, protocol='telnet',
+                 username=None, password=None):
+        """
+        :param device: a SimulatedDevice object or the name of a personality
+        :param config: a SimulatorConfig object
+        :param host: address to listen on
+        :param port: port to listen on, any free port if 0
+        :param protocol: 'telnet' or 'ssh'
+        :param username: username of the terminal server login
+        :param password: password of the terminal server login
+        """
+
+        if protocol not in ('telnet', 'ssh'):
+            raise RuntimeError('unsupported protocol {}'.format(protocol))
+        self.device = device if isinstance(device, SimulatedDevice) else SimulatedDevice(device)
+        self.config = config or SimulatorConfig()
+        self.protocol = protocol
+        self.username = username
+        self.password = password
+        self._connections = 0
+        self._host_key = None
+        if protocol == 'ssh':
+            import paramiko
+            self._host_key = paramiko.RSAKey.generate(2048)
+
+        simulator = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                simulator._serve(self.request)
+
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler, bind_and_activate=False)
+        self._server.allow_reuse_address = True
+        self._server.daemon_threads = True
+        self._server.server_bind()
+        self._server.server_activate()
+        self._thread = None
+
+    @property
+    def address(self):
+        """(host, port) of the server"""
+
+        return self._server.server_address[:2]
+
+    def _rng(self):
+        # a generator per connection, reproducible for a given seed
+        self._connections += 1
+        if self.config.seed is None:
+            return random.Random()
+        return random.Random('{}-{}'.format(self.config.seed, self._connections))
+
+    def _serve(self, sock):
+        if self.protocol == 'ssh':
+            self._serve_ssh(sock)
+            return
+        session = ConsoleSession(self.device, _TelnetChannel(sock), self.config, self._rng())
+        if self.username is not None:
+            try:
+                if not _terminal_server_login(session, self.username, self.password):
+                    sock.close()
+                    return
+            except (Disconnected, OSError):
+                sock.close()
+                return
+        session.run()
+
+    def _serve_ssh(self, sock):
+        import paramiko
+
+        simulator = self
+
+        class Server(paramiko.ServerInterface):
+            def __init__(self):
+                self.shell = threading.Event()
+
+            def check_auth_password(self, username, password):
+                if simulator.username is None or \
+                        (username == simulator.username and password == simulator.password):
+                    return paramiko.AUTH_SUCCESSFUL
+                return paramiko.AUTH_FAILED
+
+            def get_allowed_auths(self, username):
+                return 'password'
+
+            def check_channel_request(self, kind, chanid):
+                if kind == 'session':
+                    return paramiko.OPEN_SUCCEEDED
+                return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+            def check_channel_pty_request(self, *args):
+                return True
+
+            def check_channel_shell_request(self, channel):
+                self.shell.set()
+                return True
+
+        transport = paramiko.Transport(sock)
+        transport.add_server_key(self._host_key)
+        server = Server()
+        try:
+            transport.start_server(server=server)
+            channel = transport.accept(timeout=30)
+            if channel is None or not server.shell.wait(timeout=30):
+                return
+            ConsoleSession(self.device, channel, self.config, self._rng()).run()
+        except (paramiko.SSHException, EOFError, OSError) as e:
+            logger.debug('ssh console: {}'.format(str(e)))
+        finally:
+            transport.close()
+
+    def start(self):
+        """Serve in a background thread
+
+        :return: self
+        """
+
+        self._thread = threading.Thread(target=self._server.serve_forever, name='kick-simulator', daemon=True)
+        self._thread.start()
+        logger.info('{} simulator listening on {}:{} ({})'.format(
+            self.device.personality.name, self.address[0], self.address[1], self.protocol))
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def serve_stdio(device, config=None):
+    """Serve the console on the standard input/output.
+
+    This is how the simulator runs under NewSpawn: the terminal of the pty
+    is switched to raw mode, the simulator echoing the input itself.
+
+    :param device: a SimulatedDevice object
+    :param config: a SimulatorConfig object
+    """
+
+    saved = None
+    if os.isatty(sys.stdin.fileno()):
+        saved = termios.tcgetattr(sys.stdin.fileno())
+        tty.setraw(sys.stdin.fileno())
+    try:
+        ConsoleSession(device, _FdChannel(sys.stdin.fileno(), sys.stdout.fileno()), config).run()
+    finally:
+        if saved is not None:
+            termios.tcsetattr(sys.stdin.fileno(), termios.TCSADRAIN, saved)
+
+
+def simulator_command(personality, config=None, state=None, **context):
+    """Command running the simulator on its standard input/output, for NewSpawn
+
+    :param personality: name of a registered personality, such as 'kp'
+    :param config: a SimulatorConfig object
+    :param state: state the device starts in
+    :param context: values of the prompt fields, such as hostname
+    :return: the command
+    """
+
+    args = [sys.executable, '-m', __name__, personality] + (config or SimulatorConfig()).as_args()
+    if state:
+        args += ['--state', state]
+    for key, value in sorted(context.items()):
+        args += ['--set', '{}={}'.format(key, value)]
+    return ' '.join(shlex.quote(a) for a in args)
+
+
+def connect_simulator(device, personality, config=None, state=None, timeout=None, line_type='telnet', **context):
+    """Line of a device class connected to a simulator instead of its console.
+
+    :param device: a device object, such as Kp or Chassis, providing sm and line_class
+    :param personality: name of a registered personality, such as 'kp'
+    :param config: a SimulatorConfig object
+    :param state: state the simulated device starts in
+    :param timeout: timeout of the line, in seconds
+    :param line_type: type of the line, 'telnet' or 'ssh'
+    :param context: values of the prompt fields, such as hostname
+    :return: a line object
+    """
+
+    from .basic import NewSpawn
+
+    spawn_id = NewSpawn(simulator_command(personality, config, state, **context))
+    try:
+        return device.line_class(spawn_id, device.sm, line_type, timeout=timeout)
+    except:
+        spawn_id.close()
+        raise
+
+
+# personalities
+
+def _scope(session, m):
+    session.device.context.setdefault('scopes', []).append(m.group(1))
+    _update_scope(session)
+
+
+def _up(session, m):
+    scopes = session.device.context.setdefault('scopes', [])
+    if scopes:
+        scopes.pop()
+    _update_scope(session)
+
+
+def _top(session, m):
+    session.device.context['scopes'] = []
+    _update_scope(session)
+
+
+def _update_scope(session):
+    scopes = session.device.context.get('scopes', [])
+    session.device.context['scope'] = ' /{} '.format('/'.join(scopes)) if scopes else ''
+
+
+def _exit_scope(target):
+    """exit leaves the current scope, or the state at the top level"""
+
+    def action(session, m):
+        if session.device.context.get('scopes'):
+            _up(session, m)
+        else:
+            session.device.state = target
+    return action
+
+
+def _login_states(login_prompt, after, banner=''):
+    return [SimState('prelogin', login_prompt, [(r'.+', Reply(goto='login_password'))]),
+            SimState('login_password', 'Password: ',
+                     [(r'.*', Reply(banner, goto=after))], secret=True)]
+
+
+def _sudo_states(expert_prompt, sudo_prompt, parent):
+    return [SimState('expert', expert_prompt,
+                     [(r'sudo su -', Reply(goto='sudo_password')),
+                      (r'exit', Reply(goto=parent)),
+                      (r'(ls|pwd|whoami|uname.*)', Reply('admin')),
+                      (r'cat .*', Reply('', bulk=True))]),
+            SimState('sudo_password', 'Password: ', [(r'.*', Reply(goto='sudo'))], secret=True),
+            SimState('sudo', sudo_prompt,
+                     [(r'exit', Reply(goto='expert')),
+                      (r'cat .*', Reply('', bulk=True))])]
+
+
+def _lina_states(hostname, exit_state, version):
+    show_version = (r'show version.*', Reply(
+        'Cisco Adaptive Security Appliance Software Version {}\n'
+        'Firepower Extensible Operating System Version 2.6(1.133)\n\n'
+        'Compiled on Tue 02-Jul-19 by builders'.format(version)))
+    return [SimState('disable', hostname + '> ',
+                     [(r'en(able)?', Reply(goto='enable_password')),
+                      (r'(\x01d)?exit', Reply(goto=exit_state)),
+                      show_version],
+                     error='                          ^\nERROR: % Invalid input detected at \'^\' marker.'),
+            SimState('enable_password', 'Password: ', [(r'.*', Reply(goto='enable'))], secret=True),
+            SimState('enable', hostname + '# ',
+                     [(r'conf(igure)? t(erminal)?', Reply(goto='config')),
+                      (r'disable', Reply(goto='disable')),
+                      (r'(\x01d)?exit', Reply(goto=exit_state)),
+                      (r'show (running-config|tech-support).*', Reply('', bulk=True)),
+                      show_version]),
+            SimState('config', hostname + '(config)# ',
+                     [(r'(end|exit)', Reply(goto='enable')),
+                      (r'show (running-config|tech-support).*', Reply('', bulk=True)),
+                      show_version,
+                      (r'(no )?({})\b.*'.format('|'.join(LINA_CONFIG_COMMANDS)), Reply())],
+                     error='                          ^\nERROR: % Invalid input detected at \'^\' marker.')]
+
+
+def _rommon_states(after_boot):
+    return [SimState('rommon', 'rommon {rommon} > ',
+                     [(r'set', Reply('ROMMON Variable Settings:\n  ADDRESS=0.0.0.0\n  SERVER=0.0.0.0\n'
+                                     '  GATEWAY=0.0.0.0\n  PORT=Management0/0\n  VLAN=untagged\n'
+                                     '  IMAGE=\n  CONFIG=\n  LINKTIMEOUT=20\n  PKTTIMEOUT=4\n  RETRY=20')),
+                      (r'\w+=.*', Reply()),
+                      (r'sync', Reply('Updating NVRAM Parameters...')),
+                      (r'(ping|tftpdnld|tftp).*', Reply('Sending 20, 100-byte ICMP Echoes, timeout is 4 seconds:\n'
+                                                        '!!!!!!!!!!!!!!!!!!!!\nSuccess rate is 100 percent (20/20)',
+                                                        bulk=True)),
+                      (r'boot.*', Reply('Launching BootLoader...\nBoot configuration file contains 1 entry.\n'
+                                        'Loading the default image...', goto=after_boot))],
+                     error='command "{command}" not supported', counter='rommon')]
+
+
+def fxos_mio_personality(hostname='firepower'):
+    """Chassis supervisor (MIO) with the FXOS scopes, local-mgmt, fxos and a native FTD module"""
+
+    version = 'Version: 2.6(1.133)\nStartup-Vers: 2.6(1.133)'
+    states = _login_states('{hostname} login: ', 'mio', 'Last login: Mon Jan  6 10:00:00 UTC 2020 on ttyS0') + [
+        SimState('mio', '{hostname}{scope}# ',
+                 [(r'scope (\S+).*', Reply(action=_scope)),
+                  (r'enter (\S+).*', Reply(action=_scope)),
+                  (r'up', Reply(action=_up)),
+                  (r'top', Reply(action=_top)),
+                  (r'top\s*;\s*exit', Reply(action=_top, goto='prelogin')),
+                  (r'exit', Reply(action=_exit_scope('prelogin'))),
+                  (r'commit-buffer', Reply()),
+                  (r'connect local-mgmt.*', Reply(goto='local_mgmt')),
+                  (r'connect fxos.*', Reply(goto='fxos')),
+                  (r'connect module \d+ (console|telnet)',
+                   Reply('Telnet escape character is \'~\'.\nTrying 127.5.1.1...\nConnected to 127.5.1.1.\n'
+                         'Escape character is \'~\'.\n\nCISCO Serial Over LAN:\n'
+                         'Close Network Connection to Exit', goto='module')),
+                  (r'show version.*', Reply(version)),
+                  (r'show (chassis inventory|server status|slot|app-instance).*',
+                   Reply('Server  Equipped PID Equipped VID Equipped Serial (SN) Slot Status  Ackd Memory (MB)\n'
+                         '------- ------------ ------------ -------------------- ----------- ----------------\n'
+                         '1/1     FPR9K-SM-44  V01          FLM0000000A          Equipped    262144')),
+                  (r'show (tech-support|detail|firmware|event).*', Reply('', bulk=True))],
+                 error='% Invalid Command at \'^\' marker'),
+        SimState('local_mgmt', '{hostname}(local-mgmt)# ',
+                 [(r'exit', Reply(goto='mio')),
+                  (r'(dir|show).*', Reply('', bulk=True))]),
+        SimState('fxos', '{hostname}(fxos)# ',
+                 [(r'exit', Reply(goto='mio')),
+                  (r'show.*', Reply('', bulk=True))]),
+        SimState('module', 'Firepower-module1>',
+                 [(r'(exit|~)', Reply(goto='mio')),
+                  (r'connect ftd.*', Reply('Connecting to ftd console... enter exit to return to bootCLI',
+                                           goto='fireos')),
+                  (r'connect asa.*', Reply('Connecting to asa console... enter exit to return to bootCLI',
+                                           goto='disable'))]),
+        SimState('fireos', '> ',
+                 [(r'exit', Reply(goto='module')),
+                  (r'expert', Reply(goto='expert')),
+                  (r'system support diagnostic-cli', Reply('Attaching to Diagnostic CLI ... '
+                                                           'Press \'Ctrl+a then d\' to detach.\n'
+                                                           'Type help or \'?\' for a list of available commands.',
+                                                           goto='disable')),
+                  (r'show version.*', Reply('-------------------[ {} ]--------------------\n'
+                                                    'Model                     : Cisco Firepower 9000 Series '
+                                                    'SM-44 Threat Defense (72) Version 6.6.0 (Build 90)'.format(hostname))),
+                  (r'show.*', Reply('', bulk=True))])
+    ] + _sudo_states('admin@{hostname}:~$ ', 'root@{hostname}:/home/admin# ', 'fireos') + \
+        _lina_states('firepower', 'fireos', '9.14(1)')
+    return Personality('mio', states, 'mio', {'hostname': hostname, 'scope': '', 'scopes': []})
+
+
+def kp_personality(hostname='firepower'):
+    """FPR2100 (KP) FTD: fxos_state, fireos_state, expert, lina cli and rommon"""
+
+    states = _login_states('{hostname} login: ', 'fxos') + [
+        SimState('fxos', '{hostname}{scope}# ',
+                 [(r'scope (\S+).*', Reply(action=_scope)),
+                  (r'up', Reply(action=_up)),
+                  (r'top', Reply(action=_top)),
+                  (r'exit', Reply(action=_exit_scope('prelogin'))),
+                  (r'commit-buffer', Reply()),
+                  (r'connect ftd.*', Reply(goto='fireos')),
+                  (r'connect local-mgmt.*', Reply(goto='local_mgmt')),
+                  (r'show version.*', Reply('Version: 2.6(1.133)\nStartup-Vers: 2.6(1.133)\n'
+                                                    'Package-Vers: 6.6.0-90\nPlatform-Vers: 2.6(1.133)')),
+                  (r'show (tech-support|detail|firmware|event).*', Reply('', bulk=True))],
+                 error='% Invalid Command at \'^\' marker'),
+        SimState('local_mgmt', '{hostname}(local-mgmt)# ',
+                 [(r'exit', Reply(goto='fxos')),
+                  (r'(dir|show).*', Reply('', bulk=True))]),
+        SimState('fireos', '> ',
+                 [(r'exit', Reply(goto='fxos')),
+                  # on the console, connect fxos asks for exit, see KpDialogs.d_ftd_to_fxos
+                  (r'connect fxos', Reply('You came from FXOS Service Manager. '
+                                          'Please enter \'exit\' to go back.')),
+                  (r'expert', Reply(goto='expert')),
+                  (r'system support diagnostic-cli', Reply('Attaching to Diagnostic CLI ... '
+                                                           'Press \'Ctrl+a then d\' to detach.\n'
+                                                           'Type help or \'?\' for a list of available commands.',
+                                                           goto='disable')),
+                  (r'configure manager add .*', Reply('Manager successfully configured.\n'
+                                                      'Please make note of reg_key as this will be required '
+                                                      'while adding Device in FMC.')),
+                  (r'show version.*', Reply('-------------------[ {} ]--------------------\n'
+                                                    'Model                     : Cisco Firepower 2130 Threat '
+                                                    'Defense (77) Version 6.6.0 (Build 90)'.format(hostname))),
+                  (r'show.*', Reply('', bulk=True))])
+    ] + _sudo_states('admin@{hostname}:~$ ', 'root@{hostname}:/home/admin# ', 'fireos') + \
+        _lina_states('firepower', 'fireos', '9.14(1)') + _rommon_states('prelogin')
+    return Personality('kp', states, 'fxos', {'hostname': hostname, 'scope': '', 'scopes': [], 'rommon': 1})
+
+
+def rommon_personality(hostname='ciscoasa'):
+    """ROMMON of an ASA 5500-X, booting into the lina cli"""
+
+    states = _rommon_states('disable') + _lina_states(hostname, 'disable', '9.8(4)')
+    return Personality('rommon', states, 'rommon', {'hostname': hostname, 'rommon': 1},
+                       banner='Cisco Systems ROMMON, Version 1.1.8, RELEASE SOFTWARE\n'
+                              'Use BREAK or ESC to interrupt boot.\nUse SPACE to begin boot immediately.\n'
+                              'Boot interrupted.')
+
+
+def asa_personality(hostname='firepower'):
+    """FTD on an ASA 5500-X (Ftd5500x): FTD cli, expert shell and the lina cli"""
+
+    states = _login_states('{hostname} login: ', 'fireos') + [
+        SimState('fireos', '> ',
+                 [(r'exit', Reply(goto='prelogin')),
+                  (r'expert', Reply(goto='expert')),
+                  (r'system support diagnostic-cli', Reply('Attaching to Diagnostic CLI ... '
+                                                           'Press \'Ctrl+a then d\' to detach.\n'
+                                                           'Type help or \'?\' for a list of available commands.',
+                                                           goto='disable')),
+                  (r'configure manager add .*', Reply('Manager successfully configured.')),
+                  (r'show version.*', Reply('-------------------[ {} ]--------------------\n'
+                                                    'Model                     : Cisco ASA5525-X Threat '
+                                                    'Defense (75) Version 6.6.0 (Build 90)'.format(hostname))),
+                  (r'show.*', Reply('', bulk=True))])
+    ] + _sudo_states('admin@{hostname}:~$ ', 'root@{hostname}:/home/admin# ', 'fireos') + \
+        _lina_states(hostname, 'fireos', '9.14(1)') + _rommon_states('prelogin')
+    return Personality('asa', states, 'prelogin', {'hostname': hostname, 'rommon': 1})
+
+
+def series3_personality(hostname='firepower'):
+    """Series3 sensor: FTD cli and expert shell"""
+
+    states = _login_states('{hostname} login: ', 'fireos', 'Copyright 2004-2020, Cisco and/or its affiliates. '
+                                                           'All rights reserved.') + [
+        SimState('fireos', '> ',
+                 [(r'exit', Reply(goto='prelogin')),
+                  (r'expert', Reply(goto='expert')),
+                  (r'configure manager add .*', Reply('Manager successfully configured.')),
+                  (r'show version.*', Reply('--------------------[ {} ]---------------------\n'
+                                                    'Model                     : Cisco Firepower 8140 (63) '
+                                                    'Version 6.6.0 (Build 90)'.format(hostname))),
+                  (r'show.*', Reply('', bulk=True))],
+                 error='Syntax error: Illegal parameter')
+    ] + _sudo_states('admin@{hostname}:~$ ', 'root@{hostname}:~# ', 'fireos')
+    return Personality('series3', states, 'prelogin', {'hostname': hostname})
+
+
+PERSONALITIES = {
+    'mio': fxos_mio_personality,
+    'kp': kp_personality,
+    'rommon': rommon_personality,
+    'asa': asa_personality,
+    'series3': series3_personality,
+}
+
+
+def get_personality(name, **kwargs):
+    """A registered personality
+
+    :param name: 'mio', 'kp', 'rommon', 'asa' or 'series3'
+    :param kwargs: arguments of the personality, such as hostname
+    :return: a Personality object
+    """
+
+    try:
+        return PERSONALITIES[name](**kwargs)
+    except KeyError:
+        raise RuntimeError('unknown personality {}, choose from {}'.format(name, ', '.join(sorted(PERSONALITIES))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline simulator of a device console.')
+    parser.add_argument('personality', choices=sorted(PERSONALITIES))
+    parser.add_argument('--state', help='state the device starts in')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='value of a prompt field, e.g. hostname=FPR4120-1-A')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before each reply')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random seconds added to the latency, at most')
+    parser.add_argument('--baud', type=int, default=0, help='baud rate of the console, 0 for no limit')
+    parser.add_argument('--output-volume', type=int, default=0, help='lines of output of the bulk commands')
+    parser.add_argument('--page-length', type=int, default=0, help='lines before --More--, 0 for no paging')
+    parser.add_argument('--disconnect-rate', type=float, default=0.0,
+                        help='probability of a disconnect after a command')
+    parser.add_argument('--seed', type=int, help='seed of the jitter and of the disconnects')
+    parser.add_argument('--typeahead-echo', action='store_true',
+                        help='echo the input as soon as it is received')
+    parser.add_argument('--listen', choices=('telnet', 'ssh'),
+                        help='serve on a tcp port instead of the standard input/output')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--username', help='username of the terminal server login')
+    parser.add_argument('--password', help='password of the terminal server login')
+    args = parser.parse_args(argv)
+
+    context = dict(item.split('=', 1) for item in args.set)
+    config = SimulatorConfig(latency=args.latency, jitter=args.jitter, baud=args.baud,
+                             output_volume=args.output_volume, page_length=args.page_length,
+                             disconnect_rate=args.disconnect_rate, seed=args.seed,
+                             typeahead_echo=args.typeahead_echo)
+    personality = get_personality(args.personality, **({'hostname': context['hostname']}
+                                                       if 'hostname' in context else {}))
+    device = SimulatedDevice(personality, args.state, **context)
+    if not args.listen:
+        serve_stdio(device, config)
+        return
+
+    logging.basicConfig(level=logging.INFO)
+    server = SimulatorServer(device, config, args.host, args.port, args.listen, args.username, args.password)
+    server.start()
+    print('listening on {}:{}'.format(*server.address), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""Pool of authenticated ssh connections, shared through OpenSSH ControlMaster sockets.
+
+The first ssh to a (username, host, port) does the key exchange and the
+password dialog and becomes the master of the connection; the next ssh
+commands to the same destination open a new channel on the master in a
+few milliseconds, without asking for the password again. A master with
+no channel for idle_timeout seconds exits on its own (ControlPersist).
+
+"""
+
+import atexit
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import weakref
+
+logger = logging.getLogger(__name__)
+
+# seconds a master is kept alive after its last channel is closed
+DEFAULT_IDLE_TIMEOUT = 300
+# seconds between two keepalives of a master; a master whose peer went
+# away (e.g. the device rebooted) exits after 3 missed keepalives
+DEFAULT_SERVER_ALIVE_INTERVAL = 15
+# timeout of the 'ssh -O' control commands, in seconds
+CONTROL_COMMAND_TIMEOUT = 10
+
+SSH_OPTIONS = '-o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no'
+
+# all the pools, for finding the pool of a spawn command
+_POOLS = weakref.WeakSet()
+
+
+class SshConnectionPool:
+    """Build the ssh commands sharing a master connection per destination."""
+
+    def __init__(self, control_dir=None, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 server_alive_interval=DEFAULT_SERVER_ALIVE_INTERVAL):
+        """
+        :param control_dir: directory of the control sockets; a private
+                            temporary directory is created if not given
+        :param idle_timeout: seconds a master is kept alive without channels
+        :param server_alive_interval: seconds between two keepalives of a master
+        """
+
+        self._control_dir = control_dir
+        self._owns_control_dir = control_dir is None
+        self.idle_timeout = idle_timeout
+        self.server_alive_interval = server_alive_interval
+        # spawn command -> (username, host, port) of the pooled connections
+        self.connections = {}
+        _POOLS.add(self)
+
+    @property
+    def control_dir(self):
+        if self._control_dir is None:
+            self._control_dir = tempfile.mkdtemp(prefix='kick-ssh-')
+        return self._control_dir
+
+    def control_path(self, username, host, port):
+        """Path of the control socket of a destination.
+
+        The name is hashed, unix socket paths are limited to ~100 characters.
+
+        :param username: ssh username
+        :param host: ip address or hostname
+        :param port: ssh port
+        :return: path of the socket
+        """
+
+        key = '{}@{}:{}'.format(username, host, port).encode('utf-8')
+        return os.path.join(self.control_dir, hashlib.sha1(key).hexdigest()[:16])
+
+    def _control_options(self, username, host, port):
+        return '-o ControlMaster=auto -o ControlPath={} -o ControlPersist={} ' \
+               '-o ServerAliveInterval={} -o ServerAliveCountMax=3'.format(
+                   self.control_path(username, host, port), self.idle_timeout,
+                   self.server_alive_interval)
+
+    def ssh_command(self, username, host, port, rsa_key=None):
+        """ssh command opening a channel on the master of a destination.
+
+        :param username: ssh username
+        :param host: ip address or hostname
+        :param port: ssh port
+        :param rsa_key: identity file (full path)
+        :return: the command, to be given to NewSpawn
+        """
+
+        identity = '-i {} '.format(rsa_key) if rsa_key else ''
+        command = 'ssh {} {} {}-l {} -p {} {} \n'.format(
+            SSH_OPTIONS, self._control_options(username, host, port), identity,
+            username, port, host)
+        self.connections[command] = (username, host, port)
+        return command
+
+    def _control(self, operation, username, host, port):
+        command = 'ssh {} -O {} -l {} -p {} {}'.format(
+            self._control_options(username, host, port), operation, username, port, host)
+        try:
+            return subprocess.run(command.split(), stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL,
+                                  timeout=CONTROL_COMMAND_TIMEOUT).returncode == 0
+        except subprocess.TimeoutExpired:
+            return False
+
+    def is_connected(self, username, host, port):
+        """Check whether a master connection to a destination is alive.
+
+        :return: True if a new channel will not need the password dialog
+        """
+
+        if not os.path.exists(self.control_path(username, host, port)):
+            return False
+        return self._control('check', username, host, port)
+
+    def is_connected_command(self, spawn_command):
+        """Check whether a command built by ssh_command() will reuse a master.
+
+        :param spawn_command: the spawn command of a line
+        :return: True/False
+        """
+
+        destination = self.connections.get(spawn_command)
+        return bool(destination) and self.is_connected(*destination)
+
+    def close(self, username, host, port):
+        """Close the master connection of a destination and all its channels."""
+
+        if os.path.exists(self.control_path(username, host, port)):
+            logger.debug('closing ssh master connection to {}@{}:{}'.format(username, host, port))
+            self._control('exit', username, host, port)
+
+    def close_all(self):
+        """Close all the master connections of the pool."""
+
+        for destination in set(self.connections.values()):
+            self.close(*destination)
+        self.connections.clear()
+        if self._owns_control_dir and self._control_dir is not None:
+            shutil.rmtree(self._control_dir, ignore_errors=True)
+            self._control_dir = None
+
+
+def is_pooled_connection(spawn_command):
+    """Check whether a spawn command opens a channel on an authenticated connection
+
+    :param spawn_command: the spawn command of a line
+    :return: True if a pool built the command and its master is alive
+    """
+
+    return any(pool.is_connected_command(spawn_command) for pool in list(_POOLS))
+
+
+_DEFAULT_POOL = None
+
+
+def get_ssh_pool():
+    """Return the pool shared by the devices, creating it on first use
+
+    :return: a SshConnectionPool object
+    """
+
+    global _DEFAULT_POOL
+    if _DEFAULT_POOL is None:
+        _DEFAULT_POOL = SshConnectionPool()
+        atexit.register(_DEFAULT_POOL.close_all)
+    return _DEFAULT_POOL
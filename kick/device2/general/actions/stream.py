@@ -0,0 +1,366 @@
+"""Incremental helpers for matching prompts in the output read from a spawn."""
+
+import functools
+import re
+
+# xterm ESC color sequences and terminal title sequences
+ANSI_COLORS_ESCAPE = re.compile(r'(\x9B|\x1B\[)[0-?]*[ -/]*[@-~]')
+ANSI_TITLE_ESCAPE = re.compile(r'\x1B\]0;')
+# an escape sequence cut at the end of a chunk
+ANSI_PARTIAL_ESCAPE = re.compile(r'(\x1B(\[[0-?]*[ -/]*|\]0?)?|\x9B[0-?]*[ -/]*)\Z')
+# the same sequences in the raw output; the 8-bit CSI is not a character of
+# its own in utf-8, only the 7-bit sequences are removed
+ANSI_ESCAPE_BYTES = re.compile(rb'\x1B\[[0-?]*[ -/]*[@-~]|\x1B\]0;')
+ANSI_PARTIAL_ESCAPE_BYTES = re.compile(rb'\x1B(\[[0-?]*[ -/]*|\]0?)?\Z')
+
+# number of characters kept at the end of the output for prompt detection
+DEFAULT_MATCH_WINDOW = 4096
+# number of compiled patterns kept, str and bytes ones together; the least
+# recently used ones are dropped, the patterns given by the callers (commands,
+# prompts) are not known in advance
+COMPILED_CACHE_SIZE = 512
+
+
+@functools.lru_cache(maxsize=COMPILED_CACHE_SIZE)
+def compile_cached(pattern, flags=0):
+    """Compile a str or bytes pattern, keeping the most recently used ones
+
+    :param pattern: a string or a bytes
+    :param flags: flags of re.compile()
+    :return: the compiled pattern
+    """
+
+    return re.compile(pattern, flags)
+
+
+def strip_ansi(text):
+    """Remove xterm ESC color sequences and terminal title sequences from text
+
+    :param text: a string
+    :return: the string without escape sequences
+    """
+
+    return ANSI_TITLE_ESCAPE.sub('', ANSI_COLORS_ESCAPE.sub('', text))
+
+
+class AnsiStripper:
+    """Remove escape sequences from a stream of chunks.
+
+    An escape sequence split between two chunks is held back until the
+    next chunk completes it.
+
+    """
+
+    def __init__(self):
+        self.pending = ''
+
+    def feed(self, data):
+        """Strip the escape sequences from a new chunk.
+
+        :param data: chunk read from the device
+        :return: the chunk without escape sequences
+        """
+
+        data = self.pending + data
+        self.pending = ''
+        partial = ANSI_PARTIAL_ESCAPE.search(data)
+        if partial:
+            self.pending = data[partial.start():]
+            data = data[:partial.start()]
+        return strip_ansi(data)
+
+    def flush(self):
+        """Return and forget the held back characters."""
+
+        data, self.pending = self.pending, ''
+        return data
+
+
+class ByteAnsiStripper:
+    """Remove escape sequences from a stream of raw chunks, without decoding them."""
+
+    def __init__(self):
+        self.pending = b''
+
+    def feed(self, data):
+        """Strip the escape sequences from a new chunk.
+
+        :param data: chunk read from the device, as bytes
+        :return: the chunk without escape sequences
+        """
+
+        data = self.pending + data
+        self.pending = b''
+        partial = ANSI_PARTIAL_ESCAPE_BYTES.search(data)
+        if partial:
+            self.pending = data[partial.start():]
+            data = data[:partial.start()]
+        return ANSI_ESCAPE_BYTES.sub(b'', data)
+
+
+def _raw_remainder(raw, stripped_length, remainder_length):
+    """The raw bytes after a match ending in a stripped chunk.
+
+    :param raw: the chunk before stripping, with the held back bytes of the
+                previous chunk in front of it
+    :param stripped_length: length of the stripped chunk
+    :param remainder_length: number of stripped bytes after the match
+    :return: the raw bytes after the last byte of the match, escape sequences
+             and a cut escape sequence included
+    """
+
+    # indexes in raw of the bytes kept by the stripping
+    kept, start = [], 0
+    end = len(raw)
+    partial = ANSI_PARTIAL_ESCAPE_BYTES.search(raw)
+    if partial:
+        end = partial.start()
+    for m in ANSI_ESCAPE_BYTES.finditer(raw, 0, end):
+        kept.extend(range(start, m.start()))
+        start = m.end()
+    kept.extend(range(start, end))
+    return raw[kept[stripped_length - remainder_length - 1] + 1:]
+
+
+class StreamMatch:
+    """Result of a PromptMatcher match.
+
+    match_output: the output up to and including the prompt
+    last_match: the re match object, relative to the tail window
+    remainder: the output received after the prompt
+    last_match_index: index of the matched pattern, when matching a list
+
+    """
+
+    def __init__(self, match_output, last_match, remainder, last_match_index=0):
+        self.match_output = match_output
+        self.last_match = last_match
+        self.remainder = remainder
+        self.last_match_index = last_match_index
+
+
+class PromptMatcher:
+    """Match a prompt against a stream of chunks.
+
+    The chunks are stored in a list and only the last window characters
+    are searched for the prompt, so the cost of each chunk does not depend
+    on the amount of output already received.
+
+    """
+
+    def __init__(self, prompt, window=DEFAULT_MATCH_WINDOW):
+        """
+        :param prompt: a string or a compiled pattern, or a list of them; with
+                       a list, the pattern matching first in the output wins
+        :param window: number of characters searched at the end of the output;
+                       must be larger than the longest prompt
+        """
+
+        prompts = prompt if isinstance(prompt, (list, tuple)) else [prompt]
+        self.regexes = [re.compile(p) if isinstance(p, str) else p for p in prompts]
+        self.regex = self.regexes[0]
+        self.window = window
+        self.chunks = []
+        self.size = 0
+        self.tail = ''
+
+    def feed(self, data):
+        """Add a chunk and search the prompt in the tail window.
+
+        :param data: chunk read from the device
+        :return: a StreamMatch if the prompt is found, None otherwise
+        """
+
+        if not data:
+            return None
+        self.chunks.append(data)
+        self.size += len(data)
+        # keep the end of the previous tail, a prompt may be split between chunks
+        self.tail = self.tail[-self.window:] + data
+        index, match = None, None
+        for i, regex in enumerate(self.regexes):
+            m = regex.search(self.tail)
+            if m and (match is None or m.start() < match.start()):
+                index, match = i, m
+        if not match:
+            return None
+
+        output = ''.join(self.chunks)
+        end = self.size - len(self.tail) + match.end()
+        return StreamMatch(output[:end], match, output[end:], index)
+
+    @property
+    def output(self):
+        """All the output received so far."""
+
+        return ''.join(self.chunks)
+
+
+def compile_bytes_pattern(prompt):
+    """Compile a prompt for matching the raw bytes read from the device
+
+    The flags of a compiled str pattern are kept, except re.UNICODE which
+    does not apply to bytes.
+
+    :param prompt: a string, a bytes or a compiled (str or bytes) pattern
+    :return: the compiled bytes pattern
+    """
+
+    pattern = getattr(prompt, 'pattern', prompt)
+    if isinstance(pattern, bytes):
+        return prompt if not isinstance(prompt, bytes) else compile_cached(prompt)
+    return compile_cached(pattern.encode('utf-8'), getattr(prompt, 'flags', 0) & ~re.UNICODE)
+
+
+class BytesStreamMatch:
+    """Result of a BytePromptMatcher match.
+
+    The output is kept as bytes and decoded only when match_output or
+    remainder is accessed.
+
+    match_bytes: the output up to and including the prompt
+    last_match: the re match object, relative to the matcher buffer
+    remainder_bytes: the output received after the prompt
+
+    """
+
+    def __init__(self, match_bytes, last_match, remainder_bytes):
+        self.match_bytes = match_bytes
+        self.last_match = last_match
+        self.remainder_bytes = remainder_bytes
+
+    @property
+    def match_output(self):
+        """The output up to and including the prompt, as a string."""
+
+        return self.match_bytes.decode('utf-8', 'ignore')
+
+    @property
+    def remainder(self):
+        """The output received after the prompt, as a string."""
+
+        return self.remainder_bytes.decode('utf-8', 'ignore')
+
+
+class BytePromptMatcher:
+    """Match a prompt against a stream of raw chunks, without decoding them.
+
+    The chunks are appended to a bytearray and only the last window bytes
+    plus the new chunk are searched for the prompt. With keep_output set to
+    False, the output older than the window is dropped, so waiting for a
+    prompt in a long boot log uses constant memory.
+
+    With strip_escapes set, the escape sequences are removed before matching
+    but the remainder of a match is given back raw, so that the output read
+    after the prompt is the output sent by the device.
+
+    """
+
+    def __init__(self, prompt, window=DEFAULT_MATCH_WINDOW, keep_output=True,
+                 strip_escapes=False):
+        """
+        :param prompt: a string, a bytes or a compiled pattern
+        :param window: number of bytes searched before the new chunk;
+                       must be larger than the longest prompt
+        :param keep_output: True/False - whether to keep all the output or
+                            only the last window bytes
+        :param strip_escapes: True/False - whether to remove the escape
+                              sequences from the chunks before matching
+        """
+
+        self.regex = compile_bytes_pattern(prompt)
+        self.window = window
+        self.keep_output = keep_output
+        self.stripper = ByteAnsiStripper() if strip_escapes else None
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Add a chunk and search the prompt in the tail window.
+
+        :param data: chunk read from the device, as bytes
+        :return: a BytesStreamMatch if the prompt is found, None otherwise
+        """
+
+        raw = data
+        if self.stripper is not None and data:
+            raw = self.stripper.pending + data
+            data = self.stripper.feed(data)
+        if not data:
+            return None
+        start = max(len(self.buffer) - self.window, 0)
+        self.buffer += data
+        match = self.regex.search(self.buffer, start)
+        if not match:
+            if not self.keep_output and len(self.buffer) > self.window:
+                del self.buffer[:len(self.buffer) - self.window]
+            return None
+
+        end = match.end()
+        remainder = bytes(self.buffer[end:])
+        if self.stripper is not None:
+            if len(remainder) < len(data):
+                # the match ends in this chunk, give back its raw bytes after the match
+                remainder = _raw_remainder(raw, len(data), len(remainder))
+            else:
+                remainder += self.stripper.pending
+            self.stripper.pending = b''
+        return BytesStreamMatch(bytes(self.buffer[:end]), match, remainder)
+
+    @property
+    def output(self):
+        """The output kept so far, as bytes."""
+
+        return bytes(self.buffer)
+
+
+def _echo_key(text):
+    # a terminal wraps a long echo with ' \r' or line breaks, compare without the spaces
+    return re.sub(r'\s+', '', text)
+
+
+def split_pipelined_output(chunks, prompt, cmds):
+    """Split the output of commands sent at once into the output of each command.
+
+    The n-th prompt ends the output of the n-th command, wherever the echoes
+    are: a device may echo the commands typed ahead as soon as they arrive,
+    before the output and the prompt of the previous command. The echoes are
+    searched in the order of the commands over all the output and removed
+    from the part they are found in, also when the terminal wrapped them.
+
+    :param chunks: list of outputs, the n-th one ending with the n-th prompt,
+                   as returned by successive expect_stream() calls
+    :param prompt: compiled pattern of the prompt, not anchored to the end of the output
+    :param cmds: the commands sent, in order; the commands without a chunk
+                 yet are only used to remove their echo
+    :return: list with the output of each chunk, without the echoes and the prompt
+    """
+
+    parts = []
+    for chunk in chunks:
+        match = prompt.search(chunk)
+        parts.append((chunk[:match.start()] if match else chunk).split('\n'))
+    lines = [(i, j) for i, part in enumerate(parts) for j in range(len(part))]
+
+    removed = set()
+    position = 0
+    for cmd in cmds:
+        key = _echo_key(cmd)
+        if not key:
+            continue
+        for k in range(position, len(lines)):
+            i, j = lines[k]
+            text = _echo_key(parts[i][j])
+            if not text or not key.startswith(text):
+                continue
+            # a wrapped echo continues on the next lines of the same part
+            end = j
+            while text != key and end + 1 < len(parts[i]) and key.startswith(text + _echo_key(parts[i][end + 1])):
+                end += 1
+                text += _echo_key(parts[i][end])
+            if text == key:
+                removed.update((i, n) for n in range(j, end + 1))
+                position = k + end - j + 1
+                break
+
+    return ['\n'.join(line for j, line in enumerate(part) if (i, j) not in removed).strip()
+            for i, part in enumerate(parts)]
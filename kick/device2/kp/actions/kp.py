@@ -21,8 +21,14 @@ from .constants import KpConstants
 from .patterns import KpPatterns
 from .statemachine import KpStateMachine, KpFtdStateMachine, KpAsaStateMachine
 from ...general.actions.basic import BasicDevice, BasicLine, NewSpawn
+from ...general.actions.instrumentation import instrumented
+from ...general.actions.phase_timer import timed_phases
+from ...general.actions.readiness import wait_until, is_dme_available, is_prompt_responsive, \
+    DME_READY_TIMEOUT
 from ...general.actions.power_bar import power_cycle_all_ports
 
+from kick.servers.mirror import rewrite_artifact_url
+
 KICK_EXTERNAL = False
 
 try:
@@ -420,12 +426,13 @@ class KpLine(BasicLine):
         ])
         d.process(self.spawn_id, timeout=timeout)
 
-        # sleep 120 seconds to avoid errors like:
+        # wait for DME to avoid errors like:
         # FPR4120-1-A# scope system
         # Software Error: Exception during execution:
         # [Error: Timed out communicating with DME]
         # after chasis is upgraded, device is rebooted
-        time.sleep(120)
+        wait_until(lambda: is_dme_available(self, state='fxos_state'), DME_READY_TIMEOUT,
+                   name='DME availability', raise_on_timeout=False)
         self.init_terminal()
 
     def set_power_bar(self, power_bar_server, power_bar_port, power_bar_user='admn', power_bar_pwd='admn'):
@@ -644,6 +651,7 @@ class KpLine(BasicLine):
                 return download_status
         raise RuntimeError("download took too long: {}".format(image_name))
 
+    @instrumented('wait_till')
     def wait_till(self, stop_func, stop_func_args, wait_upto=300,
                   sleep_step=10):
         """Wait till stop_func returns True.
@@ -685,6 +693,8 @@ class KpLine(BasicLine):
         :param ftd_version: ftd version, e.g. 6.2.1-1088
 
         """
+        fxos_url, file_server_password = rewrite_artifact_url(fxos_url, file_server_password)
+
         bundle_package_name = fxos_url.split("/")[-1].strip()
         self.go_to('fxos_state')
 
@@ -1252,7 +1262,10 @@ class KpLine(BasicLine):
         logger.info('=== Tftp download and install integrated fxos build')
         self.rommon_tftp_download(tftp_server, rommon_file, username)
 
-        time.sleep(60)
+        # wait for the login or fxos prompt instead of a fixed delay
+        wait_until(lambda: is_prompt_responsive(self, [self.sm.patterns.prompt.prelogin_prompt,
+                                                       self.sm.patterns.prompt.fxos_prompt]),
+                   60, name='fxos prompt', raise_on_timeout=False)
         logger.info('=== Rommon build installed.')
         self.init_terminal()
 
@@ -1846,7 +1859,10 @@ class KpLine(BasicLine):
         logger.info('=== Tftp download and install integrated fxos build')
         self.rommon_tftp_download(tftp_server, rommon_file, username)
 
-        time.sleep(60)
+        # wait for the login or fxos prompt instead of a fixed delay
+        wait_until(lambda: is_prompt_responsive(self, [self.sm.patterns.prompt.prelogin_prompt,
+                                                       self.sm.patterns.prompt.fxos_prompt]),
+                   60, name='fxos prompt', raise_on_timeout=False)
         logger.info('=== Rommon build installed.')
         self.init_terminal()
 
@@ -2051,6 +2067,7 @@ class KpLine(BasicLine):
 
         self.go_to('fxos_state')
 
+    @timed_phases('kp')
     def baseline_fp2k_ftd(self, tftp_server, rommon_file,
                           uut_hostname, uut_username, uut_password,
                           uut_ip, uut_netmask, uut_gateway,
@@ -2107,10 +2124,12 @@ class KpLine(BasicLine):
         self.power_cycle_flag = power_cycle_flag
 
         if power_cycle_flag:
+            self.begin_phase('power_cycle')
             self.power_cycle_goto_rommon(timeout=reboot_timeout)
 
         # Drop fp2k to rommon mode
         # Download rommon build and Install the build
+        self.begin_phase('rommon_install', image=rommon_file)
         logger.info('=== Drop fp2k to rommon mode')
         logger.info('=== Download rommon build and Install the build')
         self.install_rommon_build_fp2k(tftp_server=tftp_server,
@@ -2122,6 +2141,7 @@ class KpLine(BasicLine):
                                        format_timeout=reboot_timeout)
 
         # Set out of band ip, dns and domain
+        self.begin_phase('bootstrap')
         logger.info('=== Set out of band ip, dns and domain')
         dns_server = dns_servers.split(',')[0]
         domain = uut_hostname.partition('.')[2]
@@ -2129,7 +2149,8 @@ class KpLine(BasicLine):
             domain = search_domains
         # Software Error: Exception during execution:
         # [Error: Timed out communicating with DME]
-        time.sleep(120)
+        wait_until(lambda: is_dme_available(self, state='fxos_state'), DME_READY_TIMEOUT,
+                   name='DME availability', raise_on_timeout=False)
         cmd_lines_initial = """
             top
             scope system
@@ -2156,6 +2177,7 @@ class KpLine(BasicLine):
 
         # Download fxos package, select download protocol
         # based on the url prefix tftp or scp
+        self.begin_phase('download', image=fxos_url)
         logger.info('=== Download fxos package, select download protocol')
         logger.info('=== based on the url prefix tftp or scp')
         self.download_ftd_fp2k(fxos_url=fxos_url,
@@ -2163,6 +2185,7 @@ class KpLine(BasicLine):
                                ftd_version=ftd_version)
 
         # Upgrade fxos package
+        self.begin_phase('install')
         logger.info('=== Upgrade fxos package')
         bundle_package = fxos_url.split('/')[-1].strip()
         self.upgrade_bundle_package_fp2k(bundle_package_name=bundle_package,
@@ -2182,6 +2205,7 @@ class KpLine(BasicLine):
                                          timeout=timeout)
 
 
+        self.begin_phase('verify')
         self.go_to('any')
         self.go_to('fireos_state')
         if manager is not None and mode != 'local':
@@ -8,6 +8,7 @@ from unicon.eal.expect import Spawn
 from .patterns import M4Patterns
 from .statemachine import M4Statemachine
 from ...fmc.actions import Fmc, FmcLine
+from ...general.actions.phase_timer import timed_phases
 
 try:
     from kick.graphite.graphite import publish_kick_metric
@@ -16,12 +17,13 @@ except ImportError:
 
 try:
     from kick.file_servers.file_servers import prepare_installation_files, \
-        get_devices_dict, search_engfs_with_regex, flattenlist
+        get_devices_dict, search_engfs_with_regex
     from kick.file_servers.file_server_consts import devit_servers
     KICK_EXTERNAL = False
 except ImportError:
-    from kick.servers.servers import get_devices_dict, search_engfs_with_regex, flattenlist
+    from kick.servers.servers import get_devices_dict, search_engfs_with_regex
     KICK_EXTERNAL = True
+from kick.servers.resolver import ArtifactResolver
 
 try:
     from kick.kick_constants import KickConsts
@@ -36,6 +38,13 @@ MAX_TIME_INSTALL = 7200
 SSH_DEFAULT_TIMEOUT = 90
 
 
+def _is_iso(file_name):
+    return file_name.endswith('.iso')
+
+
+ISO_RESOLVER = ArtifactResolver(search=search_engfs_with_regex, devices=get_devices_dict)
+
+
 class M4(Fmc):
     def __init__(self, hostname='firepower',
                  login_username='admin',
@@ -183,6 +192,7 @@ class M4Line(FmcLine):
                              mgmt_ip, mgmt_netmask, mgmt_gateway,
                              None, mgmt_ip6, mgmt_prefix, mgmt_gateway6, change_password)
 
+    @timed_phases('m4')
     def baseline_fmc_m4(self, iso_map_name, http_link, iso_file_name,
                         mgmt_ip, mgmt_netmask, mgmt_gateway, timeout=None,
                         mgmt_ip6=None, mgmt_prefix=None, mgmt_gateway6=None,
@@ -209,6 +219,7 @@ class M4Line(FmcLine):
         # set baseline timeout
         self.set_installation_timeouts(timeout)
         logger.info('Baseline FMC ')
+        self.begin_phase('prepare')
         logger.info('=== set Serial Over LAN enabled')
         self.execute('scope sol')
         self.execute('set enabled yes')
@@ -231,6 +242,7 @@ class M4Line(FmcLine):
         except:
             pass
 
+        self.begin_phase('map_image', image=iso_file_name)
         logger.info('=== Set map-www')
         map_cmd = 'map-www {} {} {}'.format(iso_map_name, http_link, iso_file_name)
         logger.info('=== Command to set map-www is {}'.format(map_cmd))
@@ -258,6 +270,7 @@ class M4Line(FmcLine):
         self.execute('scope chassis')
         self.spawn_id.sendline('commit')
 
+        self.begin_phase('reboot')
         logger.info('=== Reboot the system, connect host, waiting ...')
         d3 = Dialog([
             ['Do you want to reboot the system',
@@ -290,6 +303,7 @@ class M4Line(FmcLine):
             d3_2.process(self.spawn_id, timeout=30)
         except:
             pass
+        self.begin_phase('install')
         d4 = Dialog([
             ['Enter selection', 'sendline({})'.format('2'), None, True, False],
             ['Restore the system?', 'sendline({})'.format('yes'), None, True, False],
@@ -305,15 +319,18 @@ class M4Line(FmcLine):
 
         logger.info('=== Image has been loaded successfully')
 
+        self.begin_phase('verify')
         logger.info('=== Validate mysql process')
         self.sm.update_cur_state('admin_state')
         self.validate_mysql_process()
 
+        self.begin_phase('bootstrap')
         logger.info('=== Configure network')
         self.configure_network(mgmt_gateway, mgmt_ip, mgmt_netmask,
                                mgmt_ip6, mgmt_prefix, mgmt_gateway6,
                                change_password)
 
+        self.begin_phase('validate_version')
         logger.info('=== Validate version')
         self.validate_version(iso_file_name=iso_file_name)
 
@@ -414,38 +431,31 @@ class M4Line(FmcLine):
             raise Exception('Please provide values for version and build')
 
         if branch in ['Development', 'Testing', 'Release']:
-            devices = get_devices_dict(version='{}-{}'.format(version, build), image=type_)
             iso_file_path = '/{}/{}-{}/iso/'.format(branch, version, build)
             formatted_branch = branch
             formatted_version = "{}-{}".format(version, build)
         else:
-            devices = get_devices_dict(version='{}-{}'.format(version, build), image=type_)
             iso_file_path = '/Feature/{}/{}-{}.{}/iso/'.format(branch, version, build, branch)
             formatted_branch = 'Feature/{}'.format(branch)
             formatted_version = "{}-{}.{}".format(version, build, branch)
 
-        if http_server is not None:
-            files = [search_engfs_with_regex(http_server, formatted_branch, formatted_version, folder, pattern)
-                     for folder in devices['m4']['subdir'] for pattern in devices['m4']['patterns']]
-            for file in flattenlist(files):
-                if file.endswith('.iso'):
-                    iso_file_path += file
-                    logger.info("Found {}".format(iso_file_path))
-                    return iso_file_path
-
         if KICK_EXTERNAL:
             devit_server = devitServer
         else:
             devit_server = devit_servers
-
-        for site in devit_server:
-            files = [search_engfs_with_regex(site, formatted_branch, formatted_version, folder, pattern)
-                     for folder in devices['m4']['subdir'] for pattern in devices['m4']['patterns']]
-            for file in flattenlist(files):
-                if file.endswith('.iso'):
-                    iso_file_path += file
-                    logger.info("Found {}".format(iso_file_path))
-                    return iso_file_path
+        if isinstance(devit_server, str):
+            devit_server = [devit_server] if devit_server else []
+
+        # the custom http server is preferred, the engfs servers are looked up all at once
+        for sites in ([http_server] if http_server is not None else [], list(devit_server)):
+            if not sites:
+                continue
+            artifact = ISO_RESOLVER.resolve(sites, 'm4', formatted_branch, '{}-{}'.format(version, build),
+                                            image=type_, build_dir=formatted_version, accept=_is_iso)
+            if artifact is not None:
+                iso_file_path += artifact.name
+                logger.info("Found {}".format(iso_file_path))
+                return iso_file_path
 
         raise FileNotFoundError("Failed to detect installation file for M4 on the engfs server"
                                 " for the given parameters: branch={}, version={}"
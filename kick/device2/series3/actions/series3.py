@@ -22,6 +22,7 @@ from unicon.eal.dialogs import Dialog
 from kick.device2.series3.actions.webserver import Webserver
 from ...general.actions.basic import BasicDevice, BasicLine
 from kick.device2.general.actions.power_bar import power_cycle_all_ports
+from ...general.actions.phase_timer import timed_phases
 try:
     from kick.graphite.graphite import publish_kick_metric
 except ImportError:
@@ -571,6 +572,7 @@ image=/boot/{}
             logger.error('Exception: configuration of manager failed')
             raise RuntimeError('>>>>>> configure manager result:\n{}\ndoes not match'.format(response))
 
+    @timed_phases('series3')
     def series3_baseline(self, ftd, http_server, scp_server, scp_port,
                          scp_username, scp_password, scp_hostname,
                          version_build, iso_image_path,
@@ -683,14 +685,17 @@ image=/boot/{}
         self.manager_key = manager_key
         self.manager_nat_id = manager_nat_id
 
+        self.begin_phase('prepare')
         logger.info('=== Generate config file on the http server ...')
         self.generate_config_file()
 
+        self.begin_phase('download', image=self.iso_file)
         logger.info('=== Copy bz and usb files to dut ...')
         logger.info('=== Generate lilo file on dut ...')
         self.go_to('sudo_state')
         self.copy_bz_usb_files_setup_lilo_to_install()
 
+        self.begin_phase('reboot')
         if not self.console:
             logger.info('=== Confirm device is rebooted ...')
             self.confirm_device_rebooted()
@@ -704,14 +709,17 @@ image=/boot/{}
             time.sleep(60)
             self.spawn_id.sendline('{}'.format(self.sm.patterns.default_password))
 
+        self.begin_phase('install')
         logger.info('=== Wait for device to be up and configure device ...')
         self.poll_device_and_configure()
 
         self.go_to('any')
 
         if self.manager is not None:
+            self.begin_phase('register')
             self.configure_manager()
 
+        self.begin_phase('verify')
         logger.info('=== Validate version installed ...')
         self.validate_version()
 
@@ -934,7 +942,7 @@ image=/boot/{}
             self.spawn_id.expect('boot:')
 
             self.spawn_id.send("Restore_Serial\r")
-            self.spawn_id.expect(self.sm.patterns.prompt.lilo_boot_menu_prompt, timeout=120)
+            self.wait_for_prompt(self.sm.patterns.prompt.lilo_boot_menu_prompt, timeout=120)
 
             self._move_from_lilo_boot_menu_to_lilo_os()
         else:
@@ -982,7 +990,7 @@ image=/boot/{}
                 self.spawn_id.expect('boot:')
 
                 self.spawn_id.send("Restore_Serial\r")
-                self.spawn_id.expect(self.sm.patterns.prompt.lilo_boot_menu_prompt, timeout=120)
+                self.wait_for_prompt(self.sm.patterns.prompt.lilo_boot_menu_prompt, timeout=120)
 
                 self._move_from_lilo_boot_menu_to_lilo_os()
 
@@ -1202,7 +1210,7 @@ image=/boot/{}
 
         time.sleep(20)
         self.spawn_id.sendline("")
-        self.spawn_id.expect(">", timeout=300)
+        self.wait_for_prompt(">", timeout=300)
 
     def replace_asa_image(self, source_location, pwd, timeout=300):
         """ Not implemented for Series3Line class"""
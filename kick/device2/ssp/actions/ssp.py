@@ -18,8 +18,13 @@ from .constants import SspConstants
 from .patterns import SspPatterns
 from .statemachine import SspStateMachine
 from ...general.actions.basic import BasicDevice, BasicLine
+from ...general.actions.instrumentation import instrumented
+from ...general.actions.readiness import wait_until, is_dme_available, is_prompt_responsive, \
+    DME_READY_TIMEOUT, REBOOT_READY_TIMEOUT
 from ...general.actions.power_bar import power_cycle_all_ports
 
+from kick.servers.mirror import rewrite_artifact_url
+
 KICK_EXTERNAL = False
 
 try:
@@ -238,7 +243,7 @@ class SspLine(BasicLine):
     def bring_device_to_previous_state(self, initial_state, timeout):
         logger.info('Device was previously disconnected in {} state. Taking device back to the state it was in when'
                     'the disconnect happened ...'.format(initial_state))
-        self.sm.go_to('any', self.spawn_id)
+        self.detect_state(timeout)
         super().reconfigure_terminal(timeout)
         # at reconnection, reconfigure the terminal if needed
         self.sm.go_to('fpr_module_state', self.spawn_id)
@@ -351,12 +356,13 @@ class SspLine(BasicLine):
         ])
         d1.process(self.spawn_id, timeout=timeout)
 
-        # sleep 120 seconds to avoid errors like:
+        # wait for DME to avoid errors like:
         # FPR4120-1-A# scope system
         # Software Error: Exception during execution:
         # [Error: Timed out communicating with DME]
         # after chasis is upgraded, device is rebooted
-        time.sleep(120)
+        wait_until(lambda: is_dme_available(self, state='mio_state'), DME_READY_TIMEOUT,
+                   name='DME availability', raise_on_timeout=False)
         self.init_terminal()
 
     def set_power_bar(self, power_bar_server, power_bar_port, power_bar_user='admn', power_bar_pwd='admn'):
@@ -524,6 +530,7 @@ class SspLine(BasicLine):
                          to the container, then continue normally with the scp download
 
         """
+        fxos_url, file_server_password = rewrite_artifact_url(fxos_url, file_server_password)
 
         bundle_package_name = fxos_url.split("/")[-1].strip()
         version = self.get_bundle_package_version(bundle_package_name)
@@ -604,6 +611,8 @@ class SspLine(BasicLine):
         :param file_server_password: sftp server password
 
         """
+        csp_url, file_server_password = rewrite_artifact_url(csp_url, file_server_password)
+
         self.go_to('mio_state')
         image_name = os.path.basename(csp_url)
         app_version = re.search(r'\d+\.\d+\.\d+\.\d+', image_name).group(0)
@@ -1132,6 +1141,7 @@ class SspLine(BasicLine):
 
         return app_list
 
+    @instrumented('wait_till')
     def wait_till(self, stop_func, stop_func_args, wait_upto=600):
         """Wait till stop_func returns True.
 
@@ -1840,7 +1850,10 @@ class SspLine(BasicLine):
 
             logger.info('==== Reconnect after reboot...')
             # Wait for reboot to finish and reconnect
-            time.sleep(480)
+            wait_until(lambda: is_prompt_responsive(self, [self.sm.patterns.prompt.prelogin_prompt,
+                                                           self.sm.get_state('mio_state').pattern]),
+                       REBOOT_READY_TIMEOUT, interval=30, name='console after reboot',
+                       raise_on_timeout=False)
 
         self.monitor_installation(version=version, timeout=2400)
         return True
@@ -1,3 +1,310 @@
+"""KICK! metrics.
+
+The metrics are queued in memory and sent in batches by a background
+thread, so that publishing never waits for the network: when the queue is
+full the new points are dropped and counted in kick.metrics.dropped.
+
+The sink is selected with the KICK_METRICS_SINK environment variable or
+with configure_metrics():
+
+    graphite://host:2003            Graphite plaintext protocol over tcp
+    statsd://host:8125              StatsD over udp
+    textfile:///var/lib/node_exporter/kick.prom
+                                    Prometheus node_exporter textfile
+
+Without a sink the metrics are discarded, as before.
+
+"""
+
+import atexit
+import functools
+import getpass
+import logging
+import math
+import os
+import queue
+import re
+import socket
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# points kept in memory waiting for the flusher
+DEFAULT_QUEUE_SIZE = 10000
+# seconds between two flushes
+DEFAULT_FLUSH_INTERVAL = 10
+# points sent to the sink at once
+DEFAULT_BATCH_SIZE = 500
+# timeout of the connections to the sink, in seconds
+SINK_TIMEOUT = 5
+# percentiles reported for the timers and histograms
+PERCENTILES = (50, 90, 99)
+
+
+class GraphiteSink:
+    """Send the points with the Graphite plaintext protocol."""
+
+    def __init__(self, host, port=2003):
+        self.host = host
+        self.port = port
+
+    def send(self, points):
+        data = ''.join('{} {} {}\n'.format(name, value, int(moment)) for name, value, moment in points)
+        with socket.create_connection((self.host, self.port), timeout=SINK_TIMEOUT) as sock:
+            sock.sendall(data.encode('utf-8'))
+
+
+class StatsdSink:
+    """Send the points as StatsD gauges; the aggregation is done by the pipeline."""
+
+    # bytes per datagram, below the usual MTU
+    MAX_DATAGRAM = 1400
+
+    def __init__(self, host, port=8125):
+        self.address = (host, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, points):
+        datagram = b''
+        for name, value, moment in points:
+            line = '{}:{}|g\n'.format(name, value).encode('utf-8')
+            if datagram and len(datagram) + len(line) > self.MAX_DATAGRAM:
+                self.sock.sendto(datagram, self.address)
+                datagram = b''
+            datagram += line
+        if datagram:
+            self.sock.sendto(datagram, self.address)
+
+
+class PrometheusTextfileSink:
+    """Write the last value of each metric to a node_exporter textfile."""
+
+    def __init__(self, path):
+        self.path = path
+        self.values = {}
+
+    @staticmethod
+    def _name(name):
+        return re.sub(r'[^a-zA-Z0-9_:]', '_', name)
+
+    def send(self, points):
+        for name, value, moment in points:
+            self.values[self._name(name)] = value
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            for name in sorted(self.values):
+                f.write('{} {}\n'.format(name, self.values[name]))
+        # node_exporter must never read a partial file
+        os.replace(tmp_path, self.path)
+
+
+def sink_from_url(url):
+    """Sink of a KICK_METRICS_SINK url, see the module documentation
+
+    :param url: such as 'graphite://localhost:2003'
+    :return: a sink object, None for an empty url
+    """
+
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == 'graphite':
+        return GraphiteSink(parsed.hostname, parsed.port or 2003)
+    if parsed.scheme == 'statsd':
+        return StatsdSink(parsed.hostname, parsed.port or 8125)
+    if parsed.scheme == 'textfile':
+        return PrometheusTextfileSink(parsed.path)
+    raise ValueError('unsupported metrics sink: {}'.format(url))
+
+
+def _percentile(values, percentile):
+    values = sorted(values)
+    return values[max(int(math.ceil(percentile / 100 * len(values))) - 1, 0)]
+
+
+class MetricsPipeline:
+    """In-process aggregation of the metrics and background export.
+
+    Raw points (publish()) are sent as they are. Counters, timers,
+    histograms and gauges are aggregated between two flushes:
+    counters are summed, gauges keep their last value, timers and
+    histograms report count, min, max, mean and percentiles.
+
+    """
+
+    def __init__(self, sink, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 queue_size=DEFAULT_QUEUE_SIZE, batch_size=DEFAULT_BATCH_SIZE, prefix='kick'):
+        """
+        :param sink: object with a send(points) method, points being a list
+                     of (name, value, timestamp) tuples
+        :param flush_interval: seconds between two flushes
+        :param queue_size: points kept in memory, the next ones are dropped
+        :param batch_size: points sent to the sink at once
+        :param prefix: prefix of the pipeline's own metrics
+        """
+
+        self.sink = sink
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.prefix = prefix
+        self.dropped = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='kick-metrics', daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def publish(self, name, value, moment=None):
+        """Send a point as it is"""
+
+        self._put(('point', name, value, moment or time.time()))
+
+    def increment(self, name, value=1):
+        self._put(('counter', name, value, None))
+
+    def timing(self, name, seconds):
+        self._put(('timer', name, seconds, None))
+
+    def histogram(self, name, value):
+        self._put(('histogram', name, value, None))
+
+    def gauge(self, name, value):
+        self._put(('gauge', name, value, None))
+
+    def _drain(self):
+        items = []
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                return items
+
+    def _aggregate(self, items, now):
+        points = []
+        counters, gauges, samples = {}, {}, {}
+        for kind, name, value, moment in items:
+            if kind == 'point':
+                points.append((name, value, moment))
+            elif kind == 'counter':
+                counters[name] = counters.get(name, 0) + value
+            elif kind == 'gauge':
+                gauges[name] = value
+            else:
+                samples.setdefault(name, []).append(value)
+        points.extend((name, value, now) for name, value in counters.items())
+        points.extend((name, value, now) for name, value in gauges.items())
+        for name, values in samples.items():
+            points.extend([('{}.count'.format(name), len(values), now),
+                           ('{}.min'.format(name), min(values), now),
+                           ('{}.max'.format(name), max(values), now),
+                           ('{}.mean'.format(name), sum(values) / len(values), now)])
+            points.extend(('{}.p{}'.format(name, p), _percentile(values, p), now) for p in PERCENTILES)
+        return points
+
+    def flush(self):
+        """Send the queued points now."""
+
+        with self._flush_lock:
+            now = time.time()
+            points = self._aggregate(self._drain(), now)
+            if self.dropped:
+                points.append(('{}.metrics.dropped'.format(self.prefix), self.dropped, now))
+                self.dropped = 0
+            for i in range(0, len(points), self.batch_size):
+                try:
+                    self.sink.send(points[i:i + self.batch_size])
+                except Exception as e:
+                    # the metrics are lost, the devices must not wait for them
+                    self.failed += len(points) - i
+                    logger.debug('could not send {} metrics: {}'.format(len(points) - i, str(e)))
+                    break
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        """Stop the flusher and send the remaining points."""
+
+        self._stop.set()
+        self._thread.join(timeout=self.flush_interval)
+        self.flush()
+
+
+_PIPELINE = None
+_PIPELINE_LOCK = threading.Lock()
+_CONFIGURED = False
+
+
+def configure_metrics(sink=None, **kwargs):
+    """Set the sink of the metrics, replacing the one of KICK_METRICS_SINK.
+
+    :param sink: a sink object or url, see the module documentation; None
+                 to discard the metrics
+    :param kwargs: arguments of MetricsPipeline, such as flush_interval
+    :return: the MetricsPipeline object, None without sink
+    """
+
+    global _PIPELINE, _CONFIGURED
+    if isinstance(sink, str):
+        sink = sink_from_url(sink)
+    with _PIPELINE_LOCK:
+        if _PIPELINE is not None:
+            _PIPELINE.close()
+        _PIPELINE = MetricsPipeline(sink, **kwargs) if sink is not None else None
+        _CONFIGURED = True
+    return _PIPELINE
+
+
+def get_pipeline():
+    """The metrics pipeline, created from KICK_METRICS_SINK on first use
+
+    :return: a MetricsPipeline object, None if the metrics are discarded
+    """
+
+    if not _CONFIGURED:
+        try:
+            configure_metrics(os.environ.get('KICK_METRICS_SINK'))
+        except ValueError as e:
+            logger.warning(str(e))
+            configure_metrics(None)
+    return _PIPELINE
+
+
+def _close_pipeline():
+    if _PIPELINE is not None:
+        _PIPELINE.close()
+
+
+atexit.register(_close_pipeline)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_username():
+    try:
+        return getpass.getuser()
+    except Exception:
+        return 'unknown'
+
+
+@functools.lru_cache(maxsize=1)
+def __get_host_hostname():
+    return socket.gethostname().split('.')[0]
+
+
+def _metric_path(metric_name, user=None, host_name=None):
+    return 'kick.{}.{}.{}'.format(user or _get_username(),
+                                  host_name or __get_host_hostname(), metric_name)
 
 
 def publish_kick_metric(
@@ -15,4 +322,31 @@ def publish_kick_metric(
     kick.<user>.<host_name>.<metric_name>
 
     """
-    pass
+
+    pipeline = get_pipeline()
+    if pipeline is not None:
+        pipeline.publish(_metric_path(metric_name, user, host_name), value, moment)
+
+
+def increment_kick_metric(metric_name, value=1):
+    """Add value to a KICK! counter, summed between two flushes"""
+
+    pipeline = get_pipeline()
+    if pipeline is not None:
+        pipeline.increment(_metric_path(metric_name), value)
+
+
+def time_kick_metric(metric_name, seconds):
+    """Record a duration in a KICK! timer, see MetricsPipeline"""
+
+    pipeline = get_pipeline()
+    if pipeline is not None:
+        pipeline.timing(_metric_path(metric_name), seconds)
+
+
+def histogram_kick_metric(metric_name, value):
+    """Record a value in a KICK! histogram, see MetricsPipeline"""
+
+    pipeline = get_pipeline()
+    if pipeline is not None:
+        pipeline.histogram(_metric_path(metric_name), value)
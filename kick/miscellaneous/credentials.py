@@ -1,5 +1,15 @@
 import configparser
+import json
+import logging
 import os
+import re
+import stat
+import threading
+
+# the module is star-imported by the device modules
+__all__ = ['get_username', 'get_password', 'get_en_password', 'KickConsts']
+
+logger = logging.getLogger(__name__)
 
 config = configparser.ConfigParser()
 try:
@@ -13,46 +23,259 @@ USERNAME = 'username'
 PASSWORD = 'password'
 EN_PASSWORD = 'en_password'
 
-def get_username(user):
+# prefix of the environment variables read by EnvCredentialProvider
+ENV_PREFIX = 'KICK_'
+# vault file read by default, if it exists
+VAULT_FILE = os.environ.get('KICK_VAULT_FILE', os.path.join(os.path.expanduser('~'), '.kick', 'vault.json'))
+
+
+class CredentialProvider:
+    """Source of credentials.
+
+    lookup() returns the value of a key (USERNAME, PASSWORD, EN_PASSWORD)
+    for a host, or the default value when host is None; version() changes
+    when the source changes, which invalidates the resolved credentials.
+
+    """
+
+    def lookup(self, key, host=None):
+        raise NotImplementedError
+
+    def version(self):
+        return None
+
+
+class _FileCredentialProvider(CredentialProvider):
+    """Credentials of a file, parsed again only when its mtime changes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _reload(self):
+        with self._lock:
+            mtime = self._stat()
+            if mtime != self._mtime:
+                self._load(mtime is not None)
+                self._mtime = mtime
+
+    def _load(self, exists):
+        raise NotImplementedError
+
+    def version(self):
+        self._reload()
+        return self._mtime
+
+
+class IniCredentialProvider(_FileCredentialProvider):
+    """Credentials of a config.ini file.
+
+    The DEFAULT section holds the default credentials; a section named
+    after a host (e.g. [10.1.1.1] or [ts1.example.com]) overrides them for
+    that host.
+
+    """
+
+    def __init__(self, path, parser=None):
+        """
+        :param path: path of the ini file
+        :param parser: ConfigParser filled in place, a new one if not given
+        """
+
+        super().__init__(path)
+        self.parser = parser if parser is not None else configparser.ConfigParser()
+        if parser is not None:
+            # already read
+            self._mtime = self._stat()
+
+    def _load(self, exists):
+        self.parser.clear()
+        self.parser[DEFAULT].clear()
+        if exists:
+            try:
+                self.parser.read(self.path)
+            except configparser.Error as e:
+                logger.warning('could not read {}: {}'.format(self.path, str(e)))
+
+    def lookup(self, key, host=None):
+        self._reload()
+        if host is None:
+            return self.parser[DEFAULT].get(key)
+        if self.parser.has_section(host):
+            # the sections inherit DEFAULT, only the values of the host override
+            own = {k: v for k, v in self.parser.items(host, raw=True)
+                   if self.parser.defaults().get(k) != v}
+            if key in own:
+                return self.parser.get(host, key)
+        return None
+
+
+class VaultFileCredentialProvider(_FileCredentialProvider):
+    """Credentials of a local json vault file, readable only by its owner:
+
+        {"default": {"username": "...", "password": "..."},
+         "hosts": {"10.1.1.1": {"password": "..."}}}
+
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.data = {}
+
+    def _load(self, exists):
+        self.data = {}
+        if not exists:
+            return
+        if os.stat(self.path).st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+            logger.warning('ignoring {}: it must be readable only by its owner (chmod 600)'.format(self.path))
+            return
+        try:
+            with open(self.path) as f:
+                self.data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning('could not read {}: {}'.format(self.path, str(e)))
+
+    def lookup(self, key, host=None):
+        self._reload()
+        if host is None:
+            return self.data.get('default', {}).get(key)
+        return self.data.get('hosts', {}).get(host, {}).get(key)
+
+
+class EnvCredentialProvider(CredentialProvider):
+    """Credentials of the environment: KICK_USERNAME, KICK_PASSWORD and
+    KICK_EN_PASSWORD, overridden for a host by e.g. KICK_10_1_1_1_PASSWORD.
+    """
+
+    def __init__(self, prefix=ENV_PREFIX):
+        self.prefix = prefix
+
+    def _name(self, key, host):
+        if host is None:
+            return '{}{}'.format(self.prefix, key).upper()
+        return '{}{}_{}'.format(self.prefix, re.sub(r'\W', '_', host), key).upper()
+
+    def lookup(self, key, host=None):
+        return os.environ.get(self._name(key, host))
+
+    def version(self):
+        return tuple(sorted((k, v) for k, v in os.environ.items() if k.startswith(self.prefix)))
+
+
+class CredentialResolver:
+    """Resolve the credentials from a list of providers, the first ones
+    taking precedence.
+
+    The value of the host in any provider wins over the default values; the
+    resolved values are cached until a provider changes.
+
+    """
+
+    def __init__(self, providers):
+        self.providers = list(providers)
+        self._cache = {}
+        self._versions = None
+        self._lock = threading.Lock()
+
+    def resolve(self, key, host=None):
+        """Value of a credential.
+
+        :param key: USERNAME, PASSWORD or EN_PASSWORD
+        :param host: the terminal server or device, for per-host credentials
+        :return: the value, None if no provider has it
+        """
+
+        versions = tuple(p.version() for p in self.providers)
+        with self._lock:
+            if versions != self._versions:
+                self._cache.clear()
+                self._versions = versions
+            if (key, host) in self._cache:
+                return self._cache[(key, host)]
+
+        value = None
+        if host is not None:
+            value = next((v for v in (p.lookup(key, host) for p in self.providers) if v is not None), None)
+        if value is None:
+            value = next((v for v in (p.lookup(key) for p in self.providers) if v is not None), None)
+        with self._lock:
+            self._cache[(key, host)] = value
+        return value
+
+    def clear(self):
+        """Forget the resolved credentials."""
+
+        with self._lock:
+            self._cache.clear()
+
+
+_RESOLVER = CredentialResolver([EnvCredentialProvider(),
+                                VaultFileCredentialProvider(VAULT_FILE),
+                                IniCredentialProvider(os.path.join(kick_path, 'config.ini'), config)])
+
+
+def set_credential_providers(providers):
+    """Replace the providers of the credentials
+
+    :param providers: list of CredentialProvider objects, the first ones taking precedence
+    :return: the new CredentialResolver
+    """
+
+    global _RESOLVER
+    _RESOLVER = CredentialResolver(providers)
+    return _RESOLVER
+
+
+def get_credential_resolver():
+    return _RESOLVER
+
+
+def _resolve(key, value, host):
+    resolved = _RESOLVER.resolve(key, host)
+    return resolved if resolved is not None else value
+
+
+def get_username(user, host=None):
     """
     Gets the username from config file if present
 
     :param user: username given by user
             if not given, defaulted to ['myusername']
+    :param host: terminal server or device, for per-host credentials
     :return: username
     """
-    if USERNAME in config[DEFAULT]:
-        return config[DEFAULT][USERNAME]
-    else:
-        return user
+    return _resolve(USERNAME, user, host)
 
 
-def get_password(pwd):
+def get_password(pwd, host=None):
     """
     Gets the password from config file if present
 
     :param pwd: password given by user
             if not given, defaulted to ['mypassword']
+    :param host: terminal server or device, for per-host credentials
     :return: password
     """
-    if PASSWORD in config[DEFAULT]:
-        return config[DEFAULT][PASSWORD]
-    else:
-        return pwd
+    return _resolve(PASSWORD, pwd, host)
 
 
-def get_en_password(en_password):
+def get_en_password(en_password, host=None):
     """
     Gets the en_password from config file if present
 
     :param en_password: en_password given by user
             if not given, defaulted to ['myenpassword']
+    :param host: terminal server or device, for per-host credentials
     :return: en_password
     """
-    if EN_PASSWORD in config[DEFAULT]:
-        return config[DEFAULT][EN_PASSWORD]
-    else:
-        return en_password
+    return _resolve(EN_PASSWORD, en_password, host)
 
 
 class KickConsts(object):
@@ -0,0 +1,324 @@
+"""Local mirror of the installation files, shared by the baselines of a kick server.
+
+The files are downloaded once from the build servers into a content
+addressed store (objects/<sha256>) and published under their name in
+files/, the directory exported to the devices by the local tftp, http or
+scp server. The urls given to the devices are then rewritten to point to
+the nearest of these endpoints, so that parallel baselines of the same
+build do not download it from the build servers again.
+
+The store is shared between processes: the index and the downloads are
+protected by a file lock, and the least recently used files are evicted
+when the store grows over its capacity.
+
+"""
+
+import concurrent.futures
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+from .servers import get_session, REQUEST_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# bytes kept in the store before the least recently used files are evicted
+DEFAULT_MIRROR_CAPACITY = 100 * 1024 ** 3
+# size of the chunks written to the store, in bytes
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# number of files downloaded at the same time by prefetch()
+DEFAULT_PREFETCH_WORKERS = 4
+# timeout of the tcp connection used for measuring the distance to an endpoint, in seconds
+ENDPOINT_PROBE_TIMEOUT = 2
+
+_DEFAULT_PORTS = {'tftp': 69, 'http': 80, 'https': 443, 'scp': 22}
+
+
+class MirrorEndpoint:
+    """A server exporting the files/ directory of the mirror.
+
+    scheme: 'tftp', 'http' or 'scp'
+    host: address of the server, as seen from the devices
+    prefix: path of the files/ directory on the server, e.g. '/tftpboot/mirror'
+    username, password: credentials of the scp endpoints
+
+    """
+
+    def __init__(self, scheme, host, prefix='', username='', password='', port=None):
+        self.scheme = scheme
+        self.host = host
+        self.prefix = prefix.strip('/')
+        self.username = username
+        self.password = password
+        self.port = port or _DEFAULT_PORTS.get(scheme)
+
+    def url(self, name):
+        """Url of a file of the mirror, in the format used by the devices"""
+
+        path = '/'.join(p for p in (self.prefix, name) if p)
+        if self.scheme == 'scp':
+            return 'scp://{}@{}:/{}'.format(self.username, self.host, path)
+        return '{}://{}/{}'.format(self.scheme, self.host, path)
+
+    def latency(self):
+        """Time to open a tcp connection to the endpoint, None if it is not reachable
+
+        tftp is udp: the ssh port of the server is used instead.
+        """
+
+        port = _DEFAULT_PORTS['scp'] if self.scheme == 'tftp' else self.port
+        start_time = time.time()
+        try:
+            with socket.create_connection((self.host, port), timeout=ENDPOINT_PROBE_TIMEOUT):
+                return time.time() - start_time
+        except OSError:
+            return None
+
+    def __repr__(self):
+        return 'MirrorEndpoint({})'.format(self.url(''))
+
+
+class ArtifactMirror:
+    """Content addressed store of the installation files."""
+
+    def __init__(self, root, endpoints=None, capacity=DEFAULT_MIRROR_CAPACITY):
+        """
+        :param root: directory of the store
+        :param endpoints: list of MirrorEndpoint objects exporting root/files
+        :param capacity: bytes kept in the store
+        """
+
+        self.root = root
+        self.endpoints = list(endpoints or [])
+        self.capacity = capacity
+        self._nearest = None
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        for d in ('objects', 'files', 'tmp', 'locks'):
+            os.makedirs(os.path.join(root, d), exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked(self, name='index'):
+        """Lock shared by the threads and the processes using the store"""
+
+        with self._locks_lock:
+            lock = self._locks.setdefault(name, threading.Lock())
+        lock_path = os.path.join(self.root, 'locks', hashlib.sha1(name.encode('utf-8')).hexdigest())
+        with lock, open(lock_path, 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.root, 'index.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self, index):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, 'tmp'))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, os.path.join(self.root, 'index.json'))
+
+    def _object_path(self, sha256):
+        return os.path.join(self.root, 'objects', sha256[:2], sha256)
+
+    def file_path(self, name):
+        """Path of a file in the exported directory"""
+
+        return os.path.join(self.root, 'files', name)
+
+    def lookup(self, name):
+        """Index entry of a file, None if it is not in the mirror
+
+        :param name: name of the file, such as 'cisco-ftd-fp2k.6.4.0-102.SPA'
+        :return: dictionary with the sha256, size, source and last_used keys
+        """
+
+        with self._locked():
+            index = self._load_index()
+            entry = index.get(name)
+            if entry is None or not os.path.exists(self.file_path(name)):
+                return None
+            entry['last_used'] = time.time()
+            self._save_index(index)
+            return entry
+
+    def fetch(self, url, name=None, sha256=None):
+        """Download a file into the mirror, unless it is already there.
+
+        :param url: http(s) url of the file on the build server
+        :param name: name of the file in the mirror, the last part of url by default
+        :param sha256: expected checksum of the file
+        :return: path of the file in the exported directory
+        """
+
+        name = name or os.path.basename(urlparse(url).path)
+        # a second baseline of the same build waits for the download of the
+        # first one instead of downloading the file again
+        with self._locked('file:' + name):
+            entry = self.lookup(name)
+            if entry is not None and (sha256 is None or entry['sha256'] == sha256):
+                return self.file_path(name)
+
+            logger.info('mirroring {}'.format(url))
+            start_time = time.time()
+            digest = hashlib.sha256()
+            size = 0
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, 'tmp'))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    r = get_session().get(url, stream=True, timeout=REQUEST_TIMEOUT)
+                    r.raise_for_status()
+                    for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+                if sha256 is not None and digest.hexdigest() != sha256:
+                    raise RuntimeError('checksum mismatch for {}: expected {}, got {}'.format(
+                        url, sha256, digest.hexdigest()))
+            except Exception:
+                os.remove(tmp_path)
+                raise
+
+            with self._locked():
+                object_path = self._object_path(digest.hexdigest())
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.replace(tmp_path, object_path)
+                # files/<name> is a hard link, tftp servers do not follow
+                # symlinks out of their root
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(self.file_path(name))
+                os.link(object_path, self.file_path(name))
+                index = self._load_index()
+                index[name] = {'sha256': digest.hexdigest(), 'size': size, 'source': url,
+                               'last_used': time.time()}
+                self._evict(index, keep=name)
+                self._save_index(index)
+            logger.info('mirrored {} ({} bytes) in {:.0f} seconds'.format(
+                name, size, time.time() - start_time))
+            return self.file_path(name)
+
+    def _evict(self, index, keep):
+        """Remove the least recently used files until the store fits its capacity"""
+
+        total = sum(entry['size'] for entry in index.values())
+        for name in sorted(index, key=lambda n: index[n]['last_used']):
+            if total <= self.capacity:
+                break
+            if name == keep:
+                continue
+            entry = index.pop(name)
+            total -= entry['size']
+            logger.info('evicting {} from the mirror'.format(name))
+            with contextlib.suppress(OSError):
+                os.remove(self.file_path(name))
+            # an object can be published under several names
+            if not any(e['sha256'] == entry['sha256'] for e in index.values()):
+                with contextlib.suppress(OSError):
+                    os.remove(self._object_path(entry['sha256']))
+
+    def prefetch(self, urls, max_workers=DEFAULT_PREFETCH_WORKERS):
+        """Download files into the mirror in parallel.
+
+        :param urls: list of http(s) urls, or of objects with an url attribute
+                     such as the ResolvedArtifact of the resolver
+        :param max_workers: number of files downloaded at the same time
+        :return: dictionary name -> path in the mirror, or the exception
+                 raised by its download
+        """
+
+        urls = [getattr(u, 'url', u) for u in urls]
+        results = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self.fetch, url): url for url in urls if url}
+            for future in concurrent.futures.as_completed(futures):
+                name = os.path.basename(urlparse(futures[future]).path)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    logger.error('could not mirror {}: {}'.format(futures[future], str(e)))
+                    results[name] = e
+        return results
+
+    def nearest_endpoint(self, scheme=None):
+        """The reachable endpoint with the lowest connection time.
+
+        :param scheme: only consider the endpoints of this scheme
+        :return: a MirrorEndpoint object, None if no endpoint is reachable
+        """
+
+        if self._nearest is None:
+            latencies = [(e.latency(), e) for e in self.endpoints]
+            self._nearest = [e for latency, e in sorted(
+                (l for l in latencies if l[0] is not None), key=lambda l: l[0])]
+        return next((e for e in self._nearest if scheme is None or e.scheme == scheme), None)
+
+    def rewrite(self, url, password=''):
+        """Url of a file in the mirror, if it is there.
+
+        Only an endpoint of the same scheme as url is used: the download
+        dialogs of the devices expect the scheme chosen by the caller, e.g.
+        the password prompt of scp.
+
+        :param url: url of the file given to the device
+        :param password: password of url, for scp
+        :return: (url, password) of the nearest mirror, or the arguments
+                 unchanged if the file is not in the mirror or no endpoint
+                 has the scheme of url
+        """
+
+        name = os.path.basename(urlparse(url).path) or os.path.basename(url)
+        if not name or self.lookup(name) is None:
+            return url, password
+        endpoint = self.nearest_endpoint(urlparse(url).scheme)
+        if endpoint is None:
+            return url, password
+        logger.info('using the mirror for {}: {}'.format(name, endpoint.url(name)))
+        return endpoint.url(name), endpoint.password if endpoint.scheme == 'scp' else password
+
+
+_MIRROR = None
+
+
+def set_artifact_mirror(mirror):
+    """Use a mirror for the files downloaded by the devices
+
+    :param mirror: an ArtifactMirror object, None to stop using the mirror
+    """
+
+    global _MIRROR
+    _MIRROR = mirror
+
+
+def get_artifact_mirror():
+    return _MIRROR
+
+
+def rewrite_artifact_url(url, password=''):
+    """Url of a file in the mirror set by set_artifact_mirror(), if there is one.
+
+    :param url: url of the file given to the device
+    :param password: password of url, for scp
+    :return: (url, password)
+    """
+
+    if _MIRROR is None or not url:
+        return url, password
+    try:
+        return _MIRROR.rewrite(url, password)
+    except OSError as e:
+        logger.warning('not using the mirror for {}: {}'.format(url, str(e)))
+        return url, password
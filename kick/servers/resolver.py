@@ -0,0 +1,175 @@
+"""Find the installation files of a build on several build servers at once."""
+
+import concurrent.futures
+import logging
+import os
+import threading
+from urllib.parse import urljoin
+
+from .servers import get_artifact_catalog, search_engfs_with_regex
+
+logger = logging.getLogger(__name__)
+
+# number of directory listings fetched at the same time
+DEFAULT_RESOLVER_WORKERS = 8
+
+
+class ResolvedArtifact:
+    """An installation file found on a build server.
+
+    site: the build server
+    branch, build_dir: directory of the build on the server
+    subdir: directory of the file in the build, such as 'iso'
+    name: name of the file
+
+    """
+
+    def __init__(self, site, branch, build_dir, subdir, name):
+        self.site = site
+        self.branch = branch
+        self.build_dir = build_dir
+        self.subdir = subdir
+        self.name = name
+
+    @property
+    def path(self):
+        """Path of the file on the server"""
+
+        return os.path.join(self.branch, self.build_dir, self.subdir, self.name)
+
+    @property
+    def url(self):
+        """Url of the file, None if the site is not given as an http url"""
+
+        if not self.site.startswith('http'):
+            return None
+        return urljoin(self.site, self.path)
+
+    def __repr__(self):
+        return 'ResolvedArtifact({!r}, {!r})'.format(self.site, self.path)
+
+
+def _site_choice(found, subdirs):
+    """Best file of a site, once the preferred subdirs are known
+
+    :return: (subdir, name), None if a preferred subdir is still pending,
+             False if the site has none of the files
+    """
+
+    for subdir in subdirs:
+        if subdir not in found:
+            return None
+        if found[subdir]:
+            return subdir, found[subdir][0]
+    return False
+
+
+class ArtifactResolver:
+    """Look up the files of a build on all the sites and subdirs concurrently.
+
+    The sites are mirrors: the first site where the file is found wins and
+    the lookups still queued are cancelled. Within a site, the order of the
+    subdirs and of the patterns of the catalog is kept. The results
+    of the lookups that found a file are memoized per sites, platform,
+    branch and version (and image, arch, feature).
+
+    """
+
+    def __init__(self, max_workers=DEFAULT_RESOLVER_WORKERS, search=search_engfs_with_regex,
+                 devices=get_artifact_catalog):
+        """
+        :param max_workers: number of directory listings fetched at the same time
+        :param search: function(site, branch, version, subdir, pattern) returning
+                       the files of a directory matching pattern
+        :param devices: function returning the patterns and subdirs of the
+                        platforms, as get_artifact_catalog() or get_devices_dict()
+        """
+
+        self.max_workers = max_workers
+        self.search = search
+        self.devices = devices
+        self.resolved = {}
+        self.lock = threading.Lock()
+
+    def _search(self, site, branch, version, subdir, patterns, accept):
+        files = []
+        try:
+            # the listing is cached by search_engfs_with_regex(), only the
+            # first pattern downloads it
+            for pattern in patterns:
+                files.extend(f for f in self.search(site, branch, version, subdir, pattern)
+                             if f not in files and (accept is None or accept(f)))
+        except Exception as e:
+            logger.debug('lookup in {} {}/{}/{} failed: {}'.format(site, branch, version, subdir, str(e)))
+        return files
+
+    def resolve(self, sites, platform, branch, version, image=None, arch=None, feature=None,
+                build_dir=None, accept=None):
+        """Find a file of a build.
+
+        :param sites: list of build servers, such as ['http://10.106.134.200/']
+        :param platform: platform of the catalog, such as 'm4'
+        :param branch: such as 'Release' or 'Feature/SSL_OFFLOAD'
+        :param version: build version, such as '6.2.3-430'
+        :param image: 'Autotest' or 'Restore', see get_artifact_catalog()
+        :param arch: device architecture, see get_artifact_catalog()
+        :param feature: feature branch name, see get_artifact_catalog()
+        :param build_dir: directory of the build under branch, if not the
+                          version, such as '6.2.3-430.SSL_OFFLOAD'
+        :param accept: function(name) returning True for the files wanted,
+                       e.g. lambda f: f.endswith('.iso')
+        :return: a ResolvedArtifact object, None if no site has the file
+        """
+
+        build_dir = build_dir or version
+        key = (tuple(sites), platform, branch, build_dir, version, image, arch, feature, accept)
+        with self.lock:
+            if key in self.resolved:
+                return self.resolved[key]
+
+        device = self.devices(version, image=image, arch=arch, feature=feature)[platform]
+        subdirs = device['subdir']
+        found = {site: {} for site in sites}
+        artifact = None
+        futures = {}
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            for site in sites:
+                for subdir in subdirs:
+                    futures[executor.submit(self._search, site, branch, build_dir, subdir,
+                                            device['patterns'], accept)] = (site, subdir)
+            for future in concurrent.futures.as_completed(futures):
+                site, subdir = futures[future]
+                found[site][subdir] = future.result()
+                choice = _site_choice(found[site], subdirs)
+                if choice:
+                    artifact = ResolvedArtifact(site, branch, build_dir, choice[0], choice[1])
+                    break
+        finally:
+            # the lookups in progress are left to finish, their listings end up in the cache
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+        if artifact is None:
+            logger.debug('no {} file for {} {} on {}'.format(platform, branch, build_dir, sites))
+            return None
+        logger.info('Found {}'.format(artifact))
+        with self.lock:
+            self.resolved[key] = artifact
+        return artifact
+
+    def clear(self):
+        """Forget the resolved files."""
+
+        with self.lock:
+            self.resolved.clear()
+
+
+RESOLVER = ArtifactResolver()
+
+
+def resolve_artifact(sites, platform, branch, version, **kwargs):
+    """Find a file of a build with the shared resolver, see ArtifactResolver.resolve()"""
+
+    return RESOLVER.resolve(sites, platform, branch, version, **kwargs)
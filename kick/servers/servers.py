@@ -3,13 +3,278 @@ import os
 from urllib.parse import urljoin
 import os.path
 import requests
-from bs4 import BeautifulSoup
 from functools import reduce
+import functools
+from html.parser import HTMLParser
 
+import hashlib
+import json
 import logging
+import tempfile
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+# seconds a directory listing is used without asking the server whether it changed
+LISTING_TTL = 300
+# status codes of a missing directory, remembered for LISTING_TTL seconds
+MISSING_LISTING_STATUS = (404, 410)
+# directory of the persistent listing cache; set KICK_LISTING_CACHE_DIR to ''
+# to keep the listings in memory only
+LISTING_CACHE_DIR = os.environ.get('KICK_LISTING_CACHE_DIR',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'kick', 'listings'))
+
+
+class ListingCache:
+    """Directory listings of the build servers, keyed by url.
+
+    A listing younger than ttl seconds is used as is; an older one is
+    revalidated with a conditional GET (ETag / Last-Modified), so that an
+    unchanged directory is not downloaded and parsed again. A missing
+    directory is remembered as an empty listing for ttl seconds as well.
+    The listings are also written to cache_dir, to be shared between
+    processes, and kept in memory once read from there.
+
+    """
+
+    def __init__(self, ttl=LISTING_TTL, cache_dir=LISTING_CACHE_DIR):
+        """
+        :param ttl: seconds a listing is used without revalidation
+        :param cache_dir: directory of the persistent layer, None or '' to disable it
+        """
+
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def _path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _load(self, url):
+        entry = self.entries.get(url)
+        if entry is None and self.cache_dir:
+            try:
+                with open(self._path(url)) as f:
+                    entry = json.load(f)
+                if entry.get('url') != url:
+                    entry = None
+            except (OSError, ValueError):
+                entry = None
+            if entry is not None:
+                with self.lock:
+                    entry = self.entries.setdefault(url, entry)
+        return entry
+
+    def _store(self, url, entry):
+        with self.lock:
+            self.entries[url] = entry
+        if not self.cache_dir:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # write to a temporary file first, other processes may read the entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._path(url))
+        except OSError as e:
+            logger.debug('could not write listing cache for {}: {}'.format(url, str(e)))
+
+    def peek(self, url):
+        """Images listed at url if the cached listing is fresh, None otherwise"""
+
+        entry = self._load(url)
+        if entry is not None and time.time() - entry['fetched_at'] < self.ttl:
+            return entry['images']
+        return None
+
+    def get(self, url, fetch):
+        """Names of the images listed at url.
+
+        :param url: url of the directory
+        :param fetch: function(url, headers) returning a requests Response
+        :return: list of image names
+        """
+
+        entry = self._load(url)
+        if entry is not None and time.time() - entry['fetched_at'] < self.ttl:
+            return entry['images']
+
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            r = fetch(url, headers)
+        except requests.RequestException as e:
+            if entry is None:
+                raise
+            logger.warning('using the cached listing of {}: {}'.format(url, str(e)))
+            return entry['images']
+
+        if r.status_code == 304 and entry is not None:
+            logger.debug("listing of {} not modified".format(url))
+            entry = dict(entry, fetched_at=time.time())
+        elif r.status_code == 200:
+            entry = {'url': url, 'etag': r.headers.get('ETag'),
+                     'last_modified': r.headers.get('Last-Modified'),
+                     'fetched_at': time.time(), 'images': parse_listing(_iter_text(r))}
+        else:
+            logger.debug("{} returned {}".format(url, r.status_code))
+            r.close()
+            if r.status_code in MISSING_LISTING_STATUS:
+                self.set_missing(url)
+            return []
+        self._store(url, entry)
+        return entry['images']
+
+    def set_missing(self, url):
+        """Remember that the directory at url does not exist."""
+
+        self._store(url, {'url': url, 'etag': None, 'last_modified': None,
+                          'fetched_at': time.time(), 'images': [], 'missing': True})
+
+    def clear(self):
+        """Forget the listings kept in memory."""
+
+        with self.lock:
+            self.entries.clear()
+
+
+LISTING_CACHE = ListingCache()
+
+
+# size of the chunks of the directory pages given to the parser, in bytes
+LISTING_CHUNK_SIZE = 64 * 1024
+# (connect, read) timeouts of the requests to the build servers, in seconds
+REQUEST_TIMEOUT = (10, 60)
+# connections kept open per build server
+HTTP_POOL_SIZE = 16
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+def get_session():
+    """Return the requests session shared by the lookups, creating it on first use.
+
+    The session keeps the connections to the build servers open, so that
+    the listings of several directories do not pay a new TCP/TLS handshake.
+
+    :return: a requests.Session object
+    """
+
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE,
+                                                    pool_maxsize=HTTP_POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _SESSION = session
+    return _SESSION
+
+
+def _fetch(url, headers):
+    return get_session().get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT)
+
+
+def _iter_text(response):
+    """Body of a streamed response as decoded chunks"""
+
+    if response.encoding is None:
+        response.encoding = 'utf-8'
+    try:
+        yield from response.iter_content(chunk_size=LISTING_CHUNK_SIZE, decode_unicode=True)
+    finally:
+        response.close()
+
+
+class LinkExtractor(HTMLParser):
+    """Streaming extractor of the images of a directory page.
+
+    Fed with chunks of the page, it collects the names of the links whose
+    text content is the same string as their href and title, without
+    building the document tree.
+
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.images = []
+        self._link = None
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            self._link = dict(attrs)
+            self._text = []
+
+    def handle_data(self, data):
+        if self._link is not None:
+            self._text.append(data)
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self._link is not None:
+            text = ''.join(self._text)
+            if text == self._link.get('title') == self._link.get('href'):
+                self.images.append(text)
+            self._link = None
+
+    def pop_images(self):
+        """Images found since the last call"""
+
+        images, self.images = self.images, []
+        return images
+
+
+def iter_listing(chunks):
+    """Yield the images of a directory page as they are parsed.
+
+    :param chunks: the html of the page, as a string or an iterable of strings
+    :return: generator of image names
+    """
+
+    if isinstance(chunks, str):
+        chunks = [chunks]
+    parser = LinkExtractor()
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+            yield from parser.pop_images()
+        parser.close()
+        yield from parser.pop_images()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def parse_listing(data):
+    """Names of the images of a directory page.
+
+    We rely on the assumption that for a valid image, its text content is
+    the same string as its href, as well as its title.
+
+    :param data: html of the directory page
+    :return: list of image names
+    """
+
+    return list(iter_listing(data))
+
+
+def _listing_url(site, branch, version, subdir):
+    # url below will look like: https://firepower-engfs-sjc.cisco.com/\
+    # netboot/ims/Development/6.3.0-80013/installers/, it doesn't have the
+    # last part for file name, since we passed in '' as file_name.
+    if site.startswith("http"):
+        return urljoin(site, os.path.join(os.path.join(branch, version, subdir)))
+    return _construct_devit_url(site, os.path.join(branch, version, subdir), '')
+
 
 def search_engfs_with_regex(site, branch, version, subdir='installers',
                             pattern='.*'):
@@ -17,50 +282,78 @@ def search_engfs_with_regex(site, branch, version, subdir='installers',
     find all files in a list that resides on the site engfs server, under
     branch/version/subdir, and matching pattern.
 
+    The directory listing is cached in LISTING_CACHE, so searching several
+    patterns in the same directory downloads it once.
+
     :param site: such as 'ful' or a custom server, such as http://10.106.134.200/
     :param branch: such as 'Feature/SSL_OFFLOAD'
     :param version: such as '6.2.3-430.SSL_OFFLOAD'
     :param subdir: such as 'installers'
-    :param pattern: this is the pattern to use in regex.
+    :param pattern: this is the pattern to use in regex, as a string or
+                    compiled; a list of patterns can be given, the files are
+                    then returned in the order of the patterns
     :return: list of files matching the search
     """
 
-    # url below will look like: https://firepower-engfs-sjc.cisco.com/\
-    # netboot/ims/Development/6.3.0-80013/installers/, it doesn't have the
-    # last part for file name, since we passed in '' as file_name.
-    if site.startswith("http"):
-        url = urljoin(site, os.path.join(os.path.join(branch, version, subdir)))
-    else:
-        url = _construct_devit_url(site, os.path.join(branch, version, subdir), '')
+    url = _listing_url(site, branch, version, subdir)
     logger.debug("searching in {}".format(url))
 
-    # get content from url
-    r = requests.get(url)
-    data = r.text
-    soup = BeautifulSoup(data, 'lxml')
-
-    # find all valid images: we rely on the assumption that for a valid image,
-    # its text content is the same string as its href, as well as its title
-    images = []
-
-    for link in soup.find_all('a'):
-        if link.getText() == link.get('title') == link.get('href'):
-            images.append(link.getText())
+    images = LISTING_CACHE.get(url, _fetch)
 
     logger.debug("list of all images for branch {} version {} subdir {}: {}"
                  "".format(branch, version, subdir, images))
 
+    patterns = pattern if isinstance(pattern, (list, tuple)) else [pattern]
     result = []
-    p = re.compile(pattern)
-    for image in images:
-        if p.search(image):
-            result.append(image)
+    for p in patterns:
+        p = re.compile(p)
+        for image in images:
+            if p.search(image) and image not in result:
+                result.append(image)
 
     logger.debug("found matching images: {}".format(result))
 
     return result
 
 
+def search_engfs_first_match(site, branch, version, subdir='installers', pattern='.*'):
+    """
+    find the first file matching pattern on the site engfs server, under
+    branch/version/subdir.
+
+    A fresh listing of LISTING_CACHE is used if there is one; otherwise the
+    directory page is parsed while it is downloaded and the download stops
+    at the first match, which avoids reading the whole of large trees.
+
+    :param site: such as 'ful' or a custom server, such as http://10.106.134.200/
+    :param branch: such as 'Feature/SSL_OFFLOAD'
+    :param version: such as '6.2.3-430.SSL_OFFLOAD'
+    :param subdir: such as 'installers'
+    :param pattern: this is the pattern to use in regex
+    :return: name of the file, None if none matches
+    """
+
+    url = _listing_url(site, branch, version, subdir)
+    regex = re.compile(pattern)
+    images = LISTING_CACHE.peek(url)
+    if images is None:
+        logger.debug("streaming {}".format(url))
+        r = _fetch(url, {})
+        if r.status_code != 200:
+            logger.debug("{} returned {}".format(url, r.status_code))
+            r.close()
+            if r.status_code in MISSING_LISTING_STATUS:
+                LISTING_CACHE.set_missing(url)
+            return None
+        images = iter_listing(_iter_text(r))
+    try:
+        return next((image for image in images if regex.search(image)), None)
+    finally:
+        if hasattr(images, 'close'):
+            # stop the download
+            images.close()
+
+
 def flattenlist(alist):
     """Remove empty lists/values and flatten the list
 
@@ -72,16 +365,119 @@ def flattenlist(alist):
     return reduce(lambda x, y: x + y, alist, [])
 
 
-def get_devices_dict(version, image=None, arch=None, feature=None):
-    """Based on version and image, returns a dictionary containing
-       the folder location and the patterns of the installation files for
-       each device type
+class ArtifactEntry:
+    """Installation files of a platform for a given build.
+
+    platform: name of the platform, such as 'm4'
+    patterns: compiled patterns of the files, the preferred first
+    subdir: directories of the files under branch/version, the preferred first
+    boot_images: directory -> pattern of the boot images, if the platform has any
+
+    The entries can also be read as the dictionaries of get_devices_dict(),
+    e.g. entry['subdir'].
+
+    """
+
+    def __init__(self, platform, patterns, subdir, boot_images=None):
+        self.platform = platform
+        self.patterns = tuple(re.compile(p) for p in patterns)
+        self.subdir = tuple(subdir)
+        self.boot_images = dict(boot_images) if boot_images is not None else None
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def match(self, filename):
+        """Index of the first pattern matching filename, None if none does"""
+
+        for i, pattern in enumerate(self.patterns):
+            if pattern.search(filename):
+                return i
+        return None
+
+    def classify(self, images):
+        """Images of a listing matching the entry, in the order of the patterns
+
+        :param images: list of image names
+        :return: list of image names
+        """
+
+        matches = [(i, image) for i, image in ((self.match(image), image) for image in images)
+                   if i is not None]
+        return [image for i, image in sorted(matches, key=lambda m: m[0])]
+
+    def as_dict(self):
+        """The entry as a dictionary of get_devices_dict()"""
+
+        device = {'patterns': [p.pattern for p in self.patterns], 'subdir': list(self.subdir)}
+        if self.boot_images is not None:
+            device['boot_images'] = dict(self.boot_images)
+        return device
+
+    def __repr__(self):
+        return 'ArtifactEntry({!r})'.format(self.platform)
+
+
+class ArtifactCatalog:
+    """The ArtifactEntry of each platform for a given build, see get_artifact_catalog()"""
+
+    def __init__(self, entries):
+        self.entries = {entry.platform: entry for entry in entries}
+
+    def __getitem__(self, platform):
+        return self.entries[platform]
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __contains__(self, platform):
+        return platform in self.entries
+
+    def match(self, filename):
+        """Platforms of a file.
+
+        :param filename: name of the file
+        :return: list of (platform, pattern index) tuples
+        """
+
+        return [(platform, i) for platform, i in
+                ((platform, entry.match(filename)) for platform, entry in self.entries.items())
+                if i is not None]
+
+    def classify(self, images, platforms=None):
+        """Sort the images of a listing by platform, in one pass over the listing.
+
+        :param images: list of image names
+        :param platforms: platforms of interest, all of them if not given
+        :return: dictionary platform -> list of image names, in the order of the patterns
+        """
+
+        entries = [self.entries[p] for p in (platforms or self.entries)]
+        matches = {entry.platform: [] for entry in entries}
+        for image in images:
+            for entry in entries:
+                i = entry.match(image)
+                if i is not None:
+                    matches[entry.platform].append((i, image))
+        return {platform: [image for i, image in sorted(found, key=lambda m: m[0])]
+                for platform, found in matches.items()}
+
+
+@functools.lru_cache(maxsize=128)
+def get_artifact_catalog(version, image=None, arch=None, feature=None):
+    """Based on version and image, returns the catalog of the installation
+       files of each device type, with compiled patterns.
+
+    The catalogs are memoized, they must not be modified.
 
     :param version: build version, e.g. 6.2.3-623
     :param image: optional, 'Autotest' or 'Restore', required for M3, M4, S3 (FMC and Sensor)
     :param arch: optional, device architecture, required for S3 (FMC and Sensor) - e.g x86_64
     :param feature: optional, whether the build is on a feature branch (e.g. MARIADB)
-    :return: a dictionary
+    :return: an ArtifactCatalog object
     """
 
     if feature is None:
@@ -89,48 +485,46 @@ def get_devices_dict(version, image=None, arch=None, feature=None):
     else:
         feature = ".{}".format(feature)
 
-    devices = {
-        'kenton': {'patterns': ['ftd-[\d\.-]+{}.pkg'.format(feature), 'ftd-boot-[\d.]+lfbff'],
-                   'subdir': ['installers', 'installers/doNotRelease'],
-                   },
-        'saleen': {'patterns': ['ftd-[\d\.-]+{}.pkg'.format(feature), 'ftd-boot-[\d.]+cdisk'],
-                   'subdir': ['installers', 'installers/doNotRelease'],
-                   },
-        'elektra': {'patterns': ['asasfr-sys-[\d.-]+.pkg', 'asasfr-5500x-boot-[\d.-]+img'],
-                    'subdir': ['installers', 'installers/doNotRelease'],
-                    },
-        'm3': {'patterns': ['Sourcefire_Defense_Center_S3-{}{}-{}.iso'.format(version, feature, image),
-                            'Sourcefire_Defense_Center-{}{}-{}.iso'.format(version, feature, image),
-                            'Cisco_Firepower_Mgmt_Center-{}{}-{}.iso'.format(version, feature, image)],
-               'subdir': ['iso', 'iso/doNotRelease'],
-               },
-        'm4': {'patterns': ['Sourcefire_Defense_Center_M4-{}{}-{}.iso'.format(version, feature, image),
-                            'Cisco_Firepower_Mgmt_Center-{}{}-{}.iso'.format(version, feature, image),
-                            'Sourcefire_Defense_Center-{}{}-{}.iso'.format(version, feature, image)],
-               'subdir': ['iso', 'iso/doNotRelease'],
-               },
-        'm5': {'patterns': ['Sourcefire_Defense_Center-{}{}-{}.iso'.format(version, feature, image),
-                            'Cisco_Firepower_Mgmt_Center-{}{}-{}.iso'.format(version, feature, image)],
-               'subdir': ['iso', 'iso/doNotRelease'],
-               },
-        's3fmc': {'patterns': ['Sourcefire_Defense_Center_S3-{}{}-{}.iso'.format(version, feature, image),
-                               'Cisco_Firepower_Mgmt_Center-{}{}-{}.iso'.format(version, feature, image)],
-                  'subdir': ['iso', 'iso/doNotRelease'],
-                  'boot_images': {'os/{}/boot'.format(arch): 'bzImage.*',
-                                  'os/{}/ramdisks'.format(arch): 'usb-ramdisk*'}
-                  },
-        's3': {'patterns': ['Sourcefire_3D_Device_S3-{}{}-{}.iso'.format(version, feature, image),
-                            'Cisco_Firepower_NGIPS_Appliance-{}{}-{}.iso'.format(version, feature, image)],
-               'subdir': ['iso', 'iso/doNotRelease'],
-               'boot_images': {'os/{}/boot'.format(arch): 'bzImage.*',
-                               'os/{}/ramdisks'.format(arch): 'usb-ramdisk*'}
-               },
-        'kp': {'patterns': ['cisco-ftd-fp2k[\d.-]+[a-zA-Z]{3}', 'fxos-k8-fp2k-lfbff[\w.-]+[a-zA-Z]{3}',
-                            'fxos-k8-lfbff[\w.-]+[a-zA-Z]{3}'],
-               'subdir': ['installers', 'installers/doNotRelease'],
-               },
-        'ssp': {'patterns': ['cisco-ftd[\d.-]+[a-zA-Z]{3}.csp'],
-                'subdir': ['installers', 'installers/doNotRelease'],
-                }
-    }
-    return devices
+    installers = ['installers', 'installers/doNotRelease']
+    iso = ['iso', 'iso/doNotRelease']
+    boot_images = {'os/{}/boot'.format(arch): 'bzImage.*',
+                   'os/{}/ramdisks'.format(arch): 'usb-ramdisk*'}
+
+    return ArtifactCatalog([
+        ArtifactEntry('kenton', ['ftd-[\d\.-]+{}.pkg'.format(feature), 'ftd-boot-[\d.]+lfbff'], installers),
+        ArtifactEntry('saleen', ['ftd-[\d\.-]+{}.pkg'.format(feature), 'ftd-boot-[\d.]+cdisk'], installers),
+        ArtifactEntry('elektra', ['asasfr-sys-[\d.-]+.pkg', 'asasfr-5500x-boot-[\d.-]+img'], installers),
+        ArtifactEntry('m3', ['Sourcefire_Defense_Center_S3-{}{}-{}.iso'.format(version, feature, image),
+                             'Sourcefire_Defense_Center-{}{}-{}.iso'.format(version, feature, image),
+                             'Cisco_Firepower_Mgmt_Center-{}{}-{}.iso'.format(version, feature, image)], iso),
+        ArtifactEntry('m4', ['Sourcefire_Defense_Center_M4-{}{}-{}.iso'.format(version, feature, image),
+                             'Cisco_Firepower_Mgmt_Center-{}{}-{}.iso'.format(version, feature, image),
+                             'Sourcefire_Defense_Center-{}{}-{}.iso'.format(version, feature, image)], iso),
+        ArtifactEntry('m5', ['Sourcefire_Defense_Center-{}{}-{}.iso'.format(version, feature, image),
+                             'Cisco_Firepower_Mgmt_Center-{}{}-{}.iso'.format(version, feature, image)], iso),
+        ArtifactEntry('s3fmc', ['Sourcefire_Defense_Center_S3-{}{}-{}.iso'.format(version, feature, image),
+                                'Cisco_Firepower_Mgmt_Center-{}{}-{}.iso'.format(version, feature, image)], iso,
+                      boot_images),
+        ArtifactEntry('s3', ['Sourcefire_3D_Device_S3-{}{}-{}.iso'.format(version, feature, image),
+                             'Cisco_Firepower_NGIPS_Appliance-{}{}-{}.iso'.format(version, feature, image)], iso,
+                      boot_images),
+        ArtifactEntry('kp', ['cisco-ftd-fp2k[\d.-]+[a-zA-Z]{3}', 'fxos-k8-fp2k-lfbff[\w.-]+[a-zA-Z]{3}',
+                             'fxos-k8-lfbff[\w.-]+[a-zA-Z]{3}'], installers),
+        ArtifactEntry('ssp', ['cisco-ftd[\d.-]+[a-zA-Z]{3}.csp'], installers),
+    ])
+
+
+def get_devices_dict(version, image=None, arch=None, feature=None):
+    """Based on version and image, returns a dictionary containing
+       the folder location and the patterns of the installation files for
+       each device type
+
+    :param version: build version, e.g. 6.2.3-623
+    :param image: optional, 'Autotest' or 'Restore', required for M3, M4, S3 (FMC and Sensor)
+    :param arch: optional, device architecture, required for S3 (FMC and Sensor) - e.g x86_64
+    :param feature: optional, whether the build is on a feature branch (e.g. MARIADB)
+    :return: a dictionary
+    """
+
+    catalog = get_artifact_catalog(version, image, arch, feature)
+    return {platform: catalog[platform].as_dict() for platform in catalog}
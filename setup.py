@@ -13,7 +13,7 @@ setuptools.setup(
       long_description_content_type="text/markdown",
       url="https://github.com/CiscoDevNet/firepower-kickstart",
       packages=setuptools.find_packages(exclude=["*.tests", "*.unittests", "*.unittest", "*.sample_tests"]),
-      install_requires=['pyVmomi', 'paramiko', 'unicon', 'boto3', 'munch', 'beautifulsoup4', 'Fabric3'],
+      install_requires=['pyVmomi', 'paramiko', 'unicon', 'boto3', 'munch', 'Fabric3'],
       include_package_data=True,
       classifiers=[
             "Programming Language :: Python :: 3 :: Only",
@@ -0,0 +1,89 @@
+"""Fixtures driving the offline simulator, see kick/device2/general/actions/simulator.py"""
+
+import re
+import socket
+import time
+
+import pytest
+
+from kick.device2.general.actions.simulator import IAC, SimulatedDevice, SimulatorServer
+
+TIMEOUT = 10
+
+
+class TelnetClient:
+    """Minimal telnet client reading the console up to a prompt"""
+
+    def __init__(self, address):
+        self.sock = socket.create_connection(address, timeout=TIMEOUT)
+        self.buffer = b''
+
+    def _filter(self, data):
+        # the server only sends 3 byte option negotiations
+        return re.sub(bytes([IAC]) + b'[\xfb-\xfe].', b'', data, flags=re.DOTALL)
+
+    def read_until(self, pattern):
+        """Output up to and including pattern, the rest is kept for the next read"""
+
+        regex = re.compile(pattern)
+        deadline = time.time() + TIMEOUT
+        while True:
+            text = self.buffer.decode('utf-8', 'replace')
+            m = regex.search(text)
+            if m:
+                self.buffer = text[m.end():].encode('utf-8')
+                return text[:m.end()]
+            if time.time() > deadline:
+                raise AssertionError('{!r} not found in {!r}'.format(pattern, text))
+            data = self.sock.recv(4096)
+            if not data:
+                raise EOFError(text)
+            self.buffer += self._filter(data)
+
+    def read_all(self):
+        """Output until the server closes the connection"""
+
+        while True:
+            data = self.sock.recv(4096)
+            if not data:
+                return self.buffer.decode('utf-8', 'replace')
+            self.buffer += self._filter(data)
+
+    def send(self, text):
+        self.sock.sendall(text.encode('utf-8'))
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def telnet():
+    """Connect TelnetClient objects, closed at the end of the test: telnet(address) -> client"""
+
+    clients = []
+
+    def connect(address):
+        clients.append(TelnetClient(address))
+        return clients[-1]
+
+    yield connect
+    for client in clients:
+        client.close()
+
+
+@pytest.fixture
+def console(telnet):
+    """Start a simulator server and connect a TelnetClient to it:
+    console(personality, config=None, state=None, **server_kwargs) -> (device, server, client)"""
+
+    servers = []
+
+    def connect(personality, config=None, state=None, **kwargs):
+        device = SimulatedDevice(personality, state)
+        server = SimulatorServer(device, config, **kwargs).start()
+        servers.append(server)
+        return device, server, telnet(server.address)
+
+    yield connect
+    for server in servers:
+        server.stop()
@@ -0,0 +1,217 @@
+"""Console access helpers, see kick/device2/general/actions/access.py"""
+
+import pytest
+
+pytest.importorskip('unicon.statemachine')
+
+from unicon.eal.expect import TimeoutError
+
+from kick.device2.general.actions import access
+
+HOST = '10.0.0.1'
+KEY = (HOST, 'admin', 'telnet')
+
+
+class FakeSpawn:
+    """A terminal server session answering every expect(), unless told to fail"""
+
+    def __init__(self, fail_on=None, error=None):
+        self.fail_on = fail_on
+        self.error = error
+        self.sent = []
+        self.expected = []
+        self.closed = False
+        self.buffer = ''
+
+    def sendline(self, line=''):
+        self.sent.append(line)
+
+    def expect(self, pattern, timeout=None):
+        self.expected.append(pattern)
+        if self.fail_on is not None and self.fail_on in str(pattern):
+            raise self.error
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def sessions():
+    access.close_terminal_server_sessions()
+    access.LINE_MAP_CACHE.invalidate()
+    yield access._TS_SESSIONS
+    access.close_terminal_server_sessions()
+    access.LINE_MAP_CACHE.invalidate()
+
+
+@pytest.fixture
+def connect(monkeypatch):
+    """Spawns returned by the next logins to the terminal server"""
+
+    spawns = []
+    monkeypatch.setattr(access, '_connect_terminal_server', lambda *args: spawns.pop(0))
+    monkeypatch.setattr(access, 'tty_id_from_roty_id', lambda spawn, port, host, prompt: 'tty{}'.format(port))
+    return spawns
+
+
+def _clear_line(port=5, **kwargs):
+    access.clear_line(HOST, port, user='admin', pwd='pwd', en_password='enable', **kwargs)
+
+
+def test_session_released_after_clearing(connect, sessions):
+    spawn = FakeSpawn()
+    connect.append(spawn)
+    _clear_line()
+    assert spawn.sent == ['clear line tty5', '']
+    assert sessions[KEY][0] is spawn
+    assert not spawn.closed
+
+    # the kept session is checked out again
+    _clear_line(port=6)
+    assert spawn.sent[-2:] == ['clear line tty6', '']
+    assert sessions[KEY][0] is spawn
+
+
+def test_session_closed_on_timeout(connect, sessions):
+    spawn = FakeSpawn(fail_on='[OK]', error=TimeoutError('timeout'))
+    connect.append(spawn)
+    with pytest.raises(Exception, match='Line 5 was NOT cleared'):
+        _clear_line()
+    assert spawn.closed
+    assert KEY not in sessions
+
+
+def test_session_closed_on_any_error(connect, monkeypatch, sessions):
+    spawn = FakeSpawn()
+    connect.append(spawn)
+
+    def tty_id_from_roty_id(spawn, port, host, prompt):
+        raise ValueError('unexpected show line output')
+
+    monkeypatch.setattr(access, 'tty_id_from_roty_id', tty_id_from_roty_id)
+    with pytest.raises(ValueError):
+        _clear_line()
+    assert spawn.closed
+    assert KEY not in sessions
+
+
+def test_session_closed_without_reuse(connect, sessions):
+    spawn = FakeSpawn()
+    connect.append(spawn)
+    _clear_line(reuse_session=False)
+    assert spawn.closed
+    assert KEY not in sessions
+
+
+def test_kept_session_checked_with_the_prompt(connect, sessions):
+    kept = FakeSpawn()
+    sessions[KEY] = (kept, access.time.time())
+    _clear_line(prompt='ts-2811>')
+    assert kept.expected[0] == r'ts-2811>\s*$'
+    assert sessions[KEY][0] is kept
+
+
+def test_dead_session_replaced(connect, sessions):
+    dead = FakeSpawn(fail_on=r'\s*$', error=TimeoutError('no prompt'))
+    sessions[KEY] = (dead, access.time.time())
+    spawn = FakeSpawn()
+    connect.append(spawn)
+    _clear_line()
+    assert dead.closed
+    assert sessions[KEY][0] is spawn
+
+
+def test_checked_out_session_not_shared(connect, sessions):
+    kept = FakeSpawn()
+    sessions[KEY] = (kept, access.time.time())
+    first = access._terminal_server_session(HOST, 'admin', 'pwd', '#', 'telnet', 'enable', 60)
+    assert first is kept
+    assert KEY not in sessions
+
+    # a concurrent caller logs in again instead of sharing the session
+    other = FakeSpawn()
+    connect.append(other)
+    second = access._terminal_server_session(HOST, 'admin', 'pwd', '#', 'telnet', 'enable', 60)
+    assert second is other
+
+    # only one session is kept, the displaced one is logged out
+    access._release_terminal_server_session(KEY, second)
+    access._release_terminal_server_session(KEY, first)
+    assert sessions[KEY][0] is first
+    assert other.closed and not first.closed
+
+
+def test_idle_session_not_reused(connect, sessions):
+    idle = FakeSpawn()
+    sessions[KEY] = (idle, access.time.time() - access.TS_SESSION_IDLE_TIMEOUT - 1)
+    spawn = FakeSpawn()
+    connect.append(spawn)
+    assert access._terminal_server_session(HOST, 'admin', 'pwd', '#', 'telnet', 'enable', 60) is spawn
+    assert idle.closed
+    assert idle.expected == []
+
+
+@pytest.fixture
+def probes(monkeypatch):
+    """Ports of the consoles: tcp check result and is_available() result or exception"""
+
+    consoles = {}
+    calls = []
+
+    def is_available(host, port, user, pwd, prompt, access_type, timeout):
+        calls.append((host, port, user, prompt, timeout))
+        access.time.sleep(0.05 * (5 - port % 5))
+        result = consoles[port][1]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(access, 'is_port_open', lambda host, port: consoles[port][0])
+    monkeypatch.setattr(access, 'is_available', lambda *args, **kwargs: is_available(*args, **kwargs))
+    consoles['calls'] = calls
+    return consoles
+
+
+def test_probe_consoles(probes):
+    probes.update({2001: (None, True), 2002: ('timeout', True), 2003: ('refused', True),
+                   2004: (None, False), 2005: (None, OSError('Connection closed'))})
+    results = access.probe_consoles([(HOST, port) for port in range(2001, 2006)], max_workers=5)
+
+    # in the order of the consoles, whatever the order the probes end in
+    assert [r.port for r in results] == [2001, 2002, 2003, 2004, 2005]
+    assert [r.available for r in results] == [True, False, True, False, False]
+    assert [r.reason for r in results] == [None, 'tcp timeout', None, 'no valid prompt',
+                                           'OSError: Connection closed']
+    # an unreachable terminal server is not spawned, a refused port is
+    assert sorted(call[1] for call in probes['calls']) == [2001, 2003, 2004, 2005]
+
+
+def test_probe_consoles_overrides(probes):
+    probes.update({2001: (None, True), 2002: (None, True)})
+    access.probe_consoles([(HOST, 2001), {'host': HOST, 'port': 2002, 'prompt': 'rommon', 'timeout': 5}],
+                          user='admin', timeout=30)
+    assert sorted(probes['calls']) == [(HOST, 2001, 'admin', 'firepower login:', 30),
+                                       (HOST, 2002, 'admin', 'rommon', 5)]
+
+
+def test_wait_until_all_available_probes_only_the_pending_consoles(probes, monkeypatch):
+    probes.update({2001: (None, True), 2002: (None, False)})
+    monkeypatch.setattr(access.time, 'sleep', lambda seconds: None)
+    rounds = []
+
+    def probe_consoles(consoles, **kwargs):
+        rounds.append([port for _, port in consoles])
+        if len(rounds) == 3:
+            probes[2002] = (None, True)
+        return [access.ProbeResult(host, port, probes[port][1]) for host, port in consoles]
+
+    monkeypatch.setattr(access, 'probe_consoles', probe_consoles)
+    results = access.wait_until_all_available([(HOST, 2001), (HOST, 2002)], timeout=600, interval=1)
+    assert rounds == [[2001, 2002], [2002], [2002]]
+    assert all(r.available for r in results)
+
+
+def test_summarize_probe_results():
+    summary = access.summarize_probe_results([access.ProbeResult(HOST, 2001, True),
+                                              access.ProbeResult(HOST, 2002, False, 'tcp timeout', 3.04)])
+    assert summary == '1 of 2 consoles available\n  10.0.0.1:2002 not available (tcp timeout) after 3.0 seconds'
@@ -0,0 +1,46 @@
+"""Bulk configuration of the lines, see BasicLine.config_bulk()"""
+
+import re
+
+import pytest
+
+from kick.device2.general.actions.regex_registry import CONFIG_ERRORS, compile_errors
+from kick.device2.general.actions.simulator import SimulatorConfig, connect_simulator
+from kick.device2.general.actions.stream import split_pipelined_output
+
+# config_prompt of kick/device2/kp/actions/patterns.py, not anchored; with the
+# echo of the line discipline, the prompt after an empty output is not on a
+# line of its own
+CONFIG_PROMPT = re.compile(r'firepower[\w]*\([\w\-]+\)# ')
+LINES = ['interface Management0/0', 'nameif managment', 'bogus one', 'security-level 0',
+         'ip address 10.0.0.1 255.255.255.0', 'bogus two']
+
+
+def test_errors_attributed_with_typeahead_echo(console):
+    _, _, client = console('asa', SimulatorConfig(typeahead_echo=True, latency=0.02), state='config')
+    client.read_until(r'firepower\(config\)# $')
+    client.send(''.join('{}\n'.format(line) for line in LINES))
+    chunks = [client.read_until(CONFIG_PROMPT.pattern) for _ in LINES]
+
+    # the echoes of all the lines come before the first prompt
+    assert 'bogus two' in chunks[0]
+    errors = compile_errors(CONFIG_ERRORS)
+    bad = [i + 1 for i, output in enumerate(split_pipelined_output(chunks, CONFIG_PROMPT, LINES))
+           if errors.search(output)]
+    assert bad == [3, 6]
+
+
+def test_config_bulk_on_a_kp_line():
+    pytest.importorskip('unicon.statemachine')
+    pytest.importorskip('munch')
+    from kick.device2.kp.actions.kp import Kp
+
+    line = connect_simulator(Kp('firepower'), 'kp', SimulatorConfig(latency=0.02), timeout=30)
+    try:
+        line.go_to('config_state')
+        prompt = line.sm.get_state('config_state').pattern
+        assert line.config_bulk(LINES, prompt, 30, batch_size=4) == [(3, 'bogus one'), (6, 'bogus two')]
+        with pytest.raises(RuntimeError, match=r'bogus one \(line 3\)'):
+            line.config('\n'.join(LINES), bulk=True, exception_on_bad_config=True)
+    finally:
+        line.disconnect()
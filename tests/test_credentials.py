@@ -0,0 +1,169 @@
+"""Credential providers, see kick/miscellaneous/credentials.py"""
+
+import json
+import os
+
+import pytest
+
+from kick.miscellaneous import credentials
+from kick.miscellaneous.credentials import PASSWORD, USERNAME, CredentialProvider, CredentialResolver, \
+    EnvCredentialProvider, IniCredentialProvider, VaultFileCredentialProvider
+
+HOST = '10.1.1.1'
+
+
+def _write(path, text, mode=0o600):
+    """Write a file and move its mtime forward, as an edit a second later would"""
+
+    mtime = os.stat(str(path)).st_mtime_ns if path.exists() else 0
+    path.write_text(text)
+    os.chmod(str(path), mode)
+    mtime = max(mtime + 1000000000, os.stat(str(path)).st_mtime_ns)
+    os.utime(str(path), ns=(mtime, mtime))
+
+
+@pytest.fixture
+def ini(tmp_path):
+    path = tmp_path / 'config.ini'
+    _write(path, '[DEFAULT]\nusername = ini-user\npassword = ini-pwd\nen_password = ini-enable\n\n'
+                 '[10.1.1.1]\npassword = ini-host-pwd\n')
+    return path
+
+
+@pytest.fixture
+def vault(tmp_path):
+    path = tmp_path / 'vault.json'
+    _write(path, json.dumps({'default': {'password': 'vault-pwd'},
+                             'hosts': {'10.2.2.2': {'username': 'vault-host-user'}}}))
+    return path
+
+
+@pytest.fixture
+def env(monkeypatch):
+    for name in list(os.environ):
+        if name.startswith('KICK_TEST_'):
+            monkeypatch.delenv(name)
+    return monkeypatch
+
+
+def test_ini_provider(ini):
+    provider = IniCredentialProvider(str(ini))
+    assert provider.lookup(USERNAME) == 'ini-user'
+    assert provider.lookup(PASSWORD, HOST) == 'ini-host-pwd'
+    # the values inherited from DEFAULT are not the host's own
+    assert provider.lookup(USERNAME, HOST) is None
+    assert provider.lookup(PASSWORD, '10.9.9.9') is None
+
+
+def test_vault_provider(vault):
+    provider = VaultFileCredentialProvider(str(vault))
+    assert provider.lookup(PASSWORD) == 'vault-pwd'
+    assert provider.lookup(USERNAME, '10.2.2.2') == 'vault-host-user'
+    assert provider.lookup(USERNAME) is None
+
+
+def test_vault_readable_by_others_ignored(vault):
+    os.chmod(str(vault), 0o644)
+    assert VaultFileCredentialProvider(str(vault)).lookup(PASSWORD) is None
+
+
+def test_env_provider(env):
+    env.setenv('KICK_TEST_PASSWORD', 'env-pwd')
+    env.setenv('KICK_TEST_TS1_EXAMPLE_COM_PASSWORD', 'env-host-pwd')
+    provider = EnvCredentialProvider('KICK_TEST_')
+    assert provider.lookup(PASSWORD) == 'env-pwd'
+    assert provider.lookup(PASSWORD, 'ts1.example.com') == 'env-host-pwd'
+    assert provider.lookup(USERNAME) is None
+
+
+def test_precedence(ini, vault, env):
+    env.setenv('KICK_TEST_USERNAME', 'env-user')
+    resolver = CredentialResolver([EnvCredentialProvider('KICK_TEST_'), VaultFileCredentialProvider(str(vault)),
+                                   IniCredentialProvider(str(ini))])
+    # the first providers win for the defaults
+    assert resolver.resolve(USERNAME) == 'env-user'
+    assert resolver.resolve(PASSWORD) == 'vault-pwd'
+    assert resolver.resolve('en_password') == 'ini-enable'
+    # a value of the host in any provider wins over the defaults
+    assert resolver.resolve(PASSWORD, HOST) == 'ini-host-pwd'
+    assert resolver.resolve(USERNAME, '10.2.2.2') == 'vault-host-user'
+    assert resolver.resolve(USERNAME, HOST) == 'env-user'
+    env.setenv('KICK_TEST_10_1_1_1_PASSWORD', 'env-host-pwd')
+    assert resolver.resolve(PASSWORD, HOST) == 'env-host-pwd'
+    assert resolver.resolve('token') is None
+
+
+def test_file_reloaded_when_its_mtime_changes(ini, vault):
+    resolver = CredentialResolver([VaultFileCredentialProvider(str(vault)), IniCredentialProvider(str(ini))])
+    assert resolver.resolve(PASSWORD) == 'vault-pwd'
+    assert resolver.resolve(PASSWORD, HOST) == 'ini-host-pwd'
+
+    _write(ini, '[DEFAULT]\nusername = ini-user\n\n[10.1.1.1]\npassword = new-host-pwd\n')
+    assert resolver.resolve(PASSWORD, HOST) == 'new-host-pwd'
+    _write(vault, json.dumps({'default': {}}))
+    assert resolver.resolve(PASSWORD) is None
+
+    ini.unlink()
+    assert resolver.resolve(USERNAME) is None
+
+
+def test_file_parsed_once(ini, monkeypatch):
+    provider = IniCredentialProvider(str(ini))
+    loads = []
+    load = provider._load
+    monkeypatch.setattr(provider, '_load', lambda exists: loads.append(exists) or load(exists))
+    for _ in range(3):
+        assert provider.lookup(USERNAME) == 'ini-user'
+    assert loads == [True]
+    _write(ini, '[DEFAULT]\nusername = other\n')
+    assert provider.lookup(USERNAME) == 'other'
+    assert loads == [True, True]
+
+
+class CountingProvider(CredentialProvider):
+    def __init__(self, values):
+        self.values = values
+        self.lookups = 0
+        self.generation = 0
+
+    def lookup(self, key, host=None):
+        self.lookups += 1
+        return self.values.get((key, host))
+
+    def version(self):
+        return self.generation
+
+
+def test_resolved_values_cached_until_a_provider_changes():
+    provider = CountingProvider({(PASSWORD, None): 'pwd'})
+    resolver = CredentialResolver([provider])
+    assert resolver.resolve(PASSWORD, HOST) == 'pwd'
+    lookups = provider.lookups
+    assert resolver.resolve(PASSWORD, HOST) == 'pwd'
+    assert provider.lookups == lookups
+
+    provider.values[(PASSWORD, HOST)] = 'host-pwd'
+    assert resolver.resolve(PASSWORD, HOST) == 'pwd'
+    provider.generation += 1
+    assert resolver.resolve(PASSWORD, HOST) == 'host-pwd'
+    provider.values[(PASSWORD, HOST)] = 'changed'
+    resolver.clear()
+    assert resolver.resolve(PASSWORD, HOST) == 'changed'
+
+
+def test_getters(monkeypatch):
+    monkeypatch.setattr(credentials, '_RESOLVER', credentials.get_credential_resolver())
+    resolver = credentials.set_credential_providers([CountingProvider({(USERNAME, None): 'admin',
+                                                                       ('en_password', HOST): 'enable'})])
+    assert credentials.get_credential_resolver() is resolver
+    assert credentials.get_username('myusername') == 'admin'
+    assert credentials.get_password('mypassword', HOST) == 'mypassword'
+    assert credentials.get_en_password('myenpassword', HOST) == 'enable'
+    assert credentials.get_en_password('myenpassword') == 'myenpassword'
+
+
+def test_star_import_exports_only_the_getters():
+    namespace = {}
+    exec('from kick.miscellaneous.credentials import *', namespace)
+    assert sorted(k for k in namespace if not k.startswith('__')) == \
+        ['KickConsts', 'get_en_password', 'get_password', 'get_username']
@@ -0,0 +1,38 @@
+"""Import time budget of the device factory, see kick/device2/general/actions/factory.py"""
+
+import os
+import subprocess
+import sys
+
+from kick.device2.general.actions.factory import DEVICE_CLASSES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# upper bound of the cumulative import time of the factory, in microseconds
+IMPORT_TIME_BUDGET = 500000
+
+
+def _import_times(module):
+    """Modules imported by a fresh interpreter importing module: name -> cumulative microseconds"""
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                            cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_factory_does_not_import_the_platforms():
+    times = _import_times('kick.device2.general.actions.factory')
+
+    platforms = ['kick.device2.{}'.format(package) for package in DEVICE_CLASSES.values()]
+    loaded = [name for name in times
+              if name == 'unicon' or name.startswith('unicon.') or
+              any(name == p or name.startswith(p + '.') for p in platforms)]
+    assert loaded == []
+    assert times['kick.device2.general.actions.factory'] < IMPORT_TIME_BUDGET
@@ -0,0 +1,196 @@
+"""Latency hooks of the lines, see kick/device2/general/actions/instrumentation.py"""
+
+import logging
+
+import pytest
+
+from kick.device2.general.actions import instrumentation
+from kick.device2.general.actions.instrumentation import CallRecord, LatencyRecorder, instrumented
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class FakeSpawn:
+    def __init__(self):
+        self.bytes_read = 0
+        self.match_time = 0.0
+
+
+class FakePatterns:
+    hostname = 'FPR2130-1'
+
+
+class FakeStateMachine:
+    patterns = FakePatterns()
+    current_state = 'fxos_state'
+
+    def find_path(self, from_state, to_state):
+        return ['path'] * 3
+
+
+class FakeLine:
+    """The part of a BasicLine used by the decorator, with commands taking a known time"""
+
+    line_type = 'KpLine'
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.sm = FakeStateMachine()
+        self.spawn_id = FakeSpawn()
+        self.latency_recorder = LatencyRecorder()
+
+    def _run(self, seconds, size):
+        self.clock.now += seconds
+        self.spawn_id.bytes_read += size
+        self.spawn_id.match_time += seconds / 2
+
+    @instrumented('execute')
+    def execute(self, cmd, seconds=1.0):
+        self._run(seconds, 100)
+        return cmd
+
+    @instrumented('execute_lines')
+    def execute_lines(self, cmd_lines):
+        self._run(0.5, 0)
+        return [self.execute(cmd, seconds=i + 1.0) for i, cmd in enumerate(cmd_lines.split('\n'))]
+
+    @instrumented('go_to')
+    def go_to(self, state):
+        self._run(2.0, 10)
+        self.sm.current_state = state
+
+    @instrumented('config')
+    def config(self, cmd_lines):
+        self.go_to('config_state')
+        self.execute_lines(cmd_lines)
+
+    @instrumented('execute')
+    def reconnecting_execute(self, cmd):
+        self.spawn_id = FakeSpawn()
+        self._run(1.0, 7)
+
+
+@pytest.fixture
+def line(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(instrumentation, 'time', clock)
+    return FakeLine(clock)
+
+
+def _by_target(records):
+    return {r.target: r for r in records}
+
+
+def test_single_call(line):
+    assert line.execute('show version') == 'show version'
+    record, = line.latency_recorder.records
+    assert (record.operation, record.target, record.device, record.line_type) == \
+        ('execute', 'show version', 'FPR2130-1', 'KpLine')
+    assert record.wall_time == record.self_time == 1.0
+    assert record.bytes_read == 100
+    assert record.match_time == 0.5
+    assert record.depth == 0
+    assert record.hops is None
+
+
+def test_nested_calls_are_recorded_with_their_self_time(line):
+    line.execute_lines('show version\nshow clock')
+    records = _by_target(line.latency_recorder.records)
+    assert [r.operation for r in line.latency_recorder.records] == ['execute', 'execute', 'execute_lines']
+
+    outer = records['show version\nshow clock']
+    assert outer.wall_time == 3.5
+    assert outer.self_time == 0.5
+    assert outer.depth == 0
+    assert outer.bytes_read == 200
+    assert records['show version'].wall_time == 1.0
+    assert records['show clock'].wall_time == 2.0
+    assert records['show version'].depth == records['show clock'].depth == 1
+    # the self times add up to the time spent in the line
+    assert sum(r.self_time for r in line.latency_recorder.records) == outer.wall_time
+
+
+def test_two_levels_of_nesting(line):
+    line.config('nameif outside\nsecurity-level 0')
+    records = line.latency_recorder.records
+    assert [(r.operation, r.depth) for r in records] == \
+        [('go_to', 1), ('execute', 2), ('execute', 2), ('execute_lines', 1), ('config', 0)]
+    config = records[-1]
+    assert config.wall_time == 2.0 + 0.5 + 1.0 + 2.0
+    assert config.self_time == 0.0
+    assert sum(r.self_time for r in records) == config.wall_time
+    go_to = records[0]
+    assert (go_to.hops, go_to.from_state) == (3, 'fxos_state')
+
+
+def test_reconnect_counts_only_the_new_spawn(line):
+    line.spawn_id.bytes_read = 5000
+    line.reconnecting_execute('show version')
+    assert line.latency_recorder.records[0].bytes_read == 7
+
+
+def test_no_recorder(line):
+    line.latency_recorder = None
+    line.execute_lines('show version')
+    assert line.spawn_id.bytes_read == 100
+
+
+def test_slowest_uses_the_self_time(line):
+    line.execute_lines('a\nb\nc')
+    slowest = line.latency_recorder.slowest(top=2)
+    assert [r.target for r in slowest] == ['c', 'b']
+    assert [r.target for r in line.latency_recorder.slowest('execute_lines')] == ['a\nb\nc']
+
+
+def test_summary(line):
+    line.config('nameif outside\nsecurity-level 0')
+    summary = line.latency_recorder.summary()
+    assert summary.splitlines()[0] == 'Latency summary (5 calls, 5.5s):'
+    assert '  execute: 2 calls, 3.0s in total, 3.0s self, 1.5s waiting for patterns, 200 bytes read' in summary
+    assert '  config: 1 calls, 5.5s in total, 0.0s self' in summary
+    assert '2.000s total      security-level 0 [FPR2130-1 KpLine]' in summary
+    assert ', 3 hops from fxos_state' in summary
+
+
+def test_hooks(line):
+    seen = []
+
+    def failing_hook(record):
+        raise RuntimeError('graphite is down')
+
+    line.latency_recorder.add_hook(failing_hook)
+    line.latency_recorder.add_hook(seen.append)
+    line.execute('show version')
+    assert [r.target for r in seen] == ['show version']
+
+    line.latency_recorder.clear()
+    assert line.latency_recorder.records == []
+
+
+def test_shared_recorder(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(instrumentation, 'time', clock)
+    first, second = FakeLine(clock), FakeLine(clock)
+    second.latency_recorder = first.latency_recorder
+    first.execute('a')
+    second.execute_lines('b')
+    assert [r.depth for r in first.latency_recorder.records] == [0, 1, 0]
+
+
+def test_summary_logged_at_disconnect(caplog):
+    pytest.importorskip('unicon.statemachine')
+    from kick.device2.general.actions.basic import BasicLine
+
+    line = BasicLine.__new__(BasicLine)
+    line.spawn_id = None
+    line.latency_recorder = LatencyRecorder()
+    line.latency_recorder.record(CallRecord('execute', 'show version', 'FPR2130-1', 'KpLine', 1.5, 10, 0.5))
+    with caplog.at_level(logging.INFO):
+        line.disconnect()
+    assert 'Latency summary (1 calls, 1.5s):' in caplog.text
@@ -0,0 +1,196 @@
+"""Batched metrics pipeline, see kick/metrics/metrics.py"""
+
+import threading
+import time
+
+import pytest
+
+from kick.metrics import metrics
+from kick.metrics.metrics import MetricsPipeline
+
+# no background flush during the tests, unless asked for
+NEVER = 3600
+
+
+class FakeSink:
+    def __init__(self, failures=0):
+        self.batches = []
+        self.failures = failures
+        self.sent = threading.Event()
+
+    def send(self, points):
+        if self.failures:
+            self.failures -= 1
+            raise OSError('connection refused')
+        self.batches.append(list(points))
+        self.sent.set()
+
+    @property
+    def points(self):
+        return {name: value for batch in self.batches for name, value, moment in batch}
+
+
+@pytest.fixture
+def pipelines():
+    created = []
+
+    def pipeline(sink, **kwargs):
+        kwargs.setdefault('flush_interval', NEVER)
+        created.append(MetricsPipeline(sink, **kwargs))
+        return created[-1]
+
+    yield pipeline
+    for p in created:
+        p.close()
+
+
+def test_aggregation(pipelines):
+    sink = FakeSink()
+    pipeline = pipelines(sink)
+    pipeline.publish('kick.raw', 42, moment=1234)
+    for value in (1, 2, 3):
+        pipeline.increment('kick.reconnect')
+        pipeline.gauge('kick.queue', value)
+    for seconds in range(1, 101):
+        pipeline.timing('kick.execute', seconds)
+    pipeline.histogram('kick.bytes', 10)
+    pipeline.flush()
+
+    points = sink.points
+    assert ('kick.raw', 42, 1234) in sink.batches[0]
+    assert points['kick.reconnect'] == 3
+    assert points['kick.queue'] == 3
+    assert [points['kick.execute.{}'.format(s)] for s in ('count', 'min', 'max', 'mean')] == [100, 1, 100, 50.5]
+    assert [points['kick.execute.p{}'.format(p)] for p in (50, 90, 99)] == [50, 90, 99]
+    assert [points['kick.bytes.{}'.format(s)] for s in ('count', 'min', 'p99')] == [1, 10, 10]
+
+    # the aggregates start again after a flush
+    pipeline.increment('kick.reconnect')
+    pipeline.flush()
+    assert sink.batches[-1][0][:2] == ('kick.reconnect', 1)
+
+
+def test_batches(pipelines):
+    sink = FakeSink()
+    pipeline = pipelines(sink, batch_size=3)
+    for i in range(7):
+        pipeline.publish('kick.point{}'.format(i), i)
+    pipeline.flush()
+    assert [len(batch) for batch in sink.batches] == [3, 3, 1]
+    pipeline.flush()
+    assert len(sink.batches) == 3
+
+
+def test_points_dropped_when_the_queue_is_full(pipelines):
+    sink = FakeSink()
+    pipeline = pipelines(sink, queue_size=2)
+    for i in range(5):
+        pipeline.increment('kick.counter')
+    assert pipeline.dropped == 3
+    pipeline.flush()
+    assert sink.points == {'kick.counter': 2, 'kick.metrics.dropped': 3}
+    assert pipeline.dropped == 0
+
+    pipeline.increment('kick.counter')
+    pipeline.flush()
+    assert 'kick.metrics.dropped' not in dict((name, value) for name, value, _ in sink.batches[-1])
+
+
+def test_sink_failure_loses_the_points(pipelines):
+    sink = FakeSink(failures=1)
+    pipeline = pipelines(sink, batch_size=2, prefix='test')
+    for i in range(5):
+        pipeline.publish('kick.point{}'.format(i), i)
+    pipeline.flush()
+    assert pipeline.failed == 5
+    assert sink.batches == []
+    pipeline.publish('kick.point', 1)
+    pipeline.flush()
+    assert len(sink.batches) == 1
+
+
+def test_background_flush(pipelines):
+    sink = FakeSink()
+    pipeline = pipelines(sink, flush_interval=0.05)
+    start_time = time.time()
+    pipeline.publish('kick.point', 1)
+    assert sink.sent.wait(5)
+    assert sink.points == {'kick.point': 1}
+    # publishing does not wait for the sink
+    assert time.time() - start_time < 5
+
+
+def test_close_flushes(pipelines):
+    sink = FakeSink()
+    pipeline = pipelines(sink)
+    pipeline.gauge('kick.gauge', 7)
+    pipeline.close()
+    assert sink.points == {'kick.gauge': 7}
+    assert not pipeline._thread.is_alive()
+
+
+@pytest.fixture
+def configured(monkeypatch):
+    monkeypatch.setattr(metrics, '_PIPELINE', None)
+    monkeypatch.setattr(metrics, '_CONFIGURED', False)
+    yield
+    if metrics._PIPELINE is not None:
+        metrics._PIPELINE.close()
+
+
+def test_publish_kick_metric(configured):
+    sink = FakeSink()
+    pipeline = metrics.configure_metrics(sink, flush_interval=NEVER)
+    assert metrics.get_pipeline() is pipeline
+    metrics.publish_kick_metric('device.basic.reconnect.duration', 2.5, moment=1234, user='u', host_name='h')
+    metrics.increment_kick_metric('device.basic.reconnect.success')
+    metrics.time_kick_metric('device.basic.execute', 0.5)
+    metrics.histogram_kick_metric('device.basic.bytes', 100)
+    pipeline.flush()
+    points = sink.points
+    assert points['kick.u.h.device.basic.reconnect.duration'] == 2.5
+    assert points[metrics._metric_path('device.basic.reconnect.success')] == 1
+    assert points[metrics._metric_path('device.basic.execute.count')] == 1
+    assert points[metrics._metric_path('device.basic.bytes.max')] == 100
+
+    # the previous pipeline is closed when another sink is set
+    assert metrics.configure_metrics(None) is None
+    assert not pipeline._thread.is_alive()
+    metrics.publish_kick_metric('device.basic.reconnect.duration', 2.5)
+
+
+def test_sink_from_environment(configured, monkeypatch, tmp_path):
+    monkeypatch.setenv('KICK_METRICS_SINK', 'textfile://{}'.format(tmp_path / 'kick.prom'))
+    assert isinstance(metrics.get_pipeline().sink, metrics.PrometheusTextfileSink)
+
+
+def test_unsupported_sink_from_environment(configured, monkeypatch):
+    monkeypatch.setenv('KICK_METRICS_SINK', 'influx://localhost:8086')
+    assert metrics.get_pipeline() is None
+
+
+def test_sink_from_url():
+    assert metrics.sink_from_url('') is None
+    sink = metrics.sink_from_url('graphite://graphite.example.com')
+    assert (sink.host, sink.port) == ('graphite.example.com', 2003)
+    assert metrics.sink_from_url('statsd://127.0.0.1:9125').address == ('127.0.0.1', 9125)
+    with pytest.raises(ValueError):
+        metrics.sink_from_url('influx://localhost:8086')
+
+
+def test_prometheus_textfile(tmp_path):
+    sink = metrics.PrometheusTextfileSink(str(tmp_path / 'kick.prom'))
+    sink.send([('kick.u.h.execute.p99', 1.5, 0), ('kick.u.h.reconnect-count', 2, 0)])
+    sink.send([('kick.u.h.execute.p99', 0.5, 0)])
+    assert (tmp_path / 'kick.prom').read_text() == 'kick_u_h_execute_p99 0.5\nkick_u_h_reconnect_count 2\n'
+
+
+def test_statsd_datagrams():
+    sink = metrics.StatsdSink('127.0.0.1')
+    datagrams = []
+    sink.sock.close()
+    sink.sock = type('FakeSocket', (), {'sendto': lambda self, data, address: datagrams.append(data)})()
+    sink.send([('kick.metric{:04d}'.format(i), i, 0) for i in range(200)])
+    assert all(len(d) <= metrics.StatsdSink.MAX_DATAGRAM for d in datagrams)
+    lines = b''.join(datagrams).decode().splitlines()
+    assert len(lines) == 200 and lines[0] == 'kick.metric0000:0|g'
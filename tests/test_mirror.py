@@ -0,0 +1,219 @@
+"""Local mirror of the installation files, see kick/servers/mirror.py"""
+
+import hashlib
+import itertools
+import os
+import threading
+import time
+import types
+
+import pytest
+
+requests = pytest.importorskip('requests')
+
+from kick.servers import mirror
+from kick.servers.mirror import ArtifactMirror, MirrorEndpoint
+
+BUILD_SERVER = 'http://10.106.134.200/netboot/ims/Release/6.4.0-102/installers/'
+FILES = {'cisco-ftd-fp2k.6.4.0-102.SPA': b'ftd' * 1000,
+         'fxos-k8-fp2k-lfbff.2.4.1.101.SPA': b'fxos' * 1000,
+         'cisco-ftd.6.4.0.102.SPA.csp': b'csp' * 1000}
+
+
+class FakeResponse:
+    def __init__(self, url, content):
+        self.url = url
+        self.content = content
+
+    def raise_for_status(self):
+        if self.content is None:
+            raise requests.HTTPError('404 Client Error: Not Found for url: {}'.format(self.url))
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.content), 1000):
+            yield self.content[i:i + 1000]
+
+
+class FakeSession:
+    """The build server, serving FILES"""
+
+    def __init__(self, delay=0):
+        self.files = dict(FILES)
+        self.delay = delay
+        self.downloads = []
+        self.lock = threading.Lock()
+
+    def get(self, url, stream, timeout):
+        with self.lock:
+            self.downloads.append(os.path.basename(url))
+        time.sleep(self.delay)
+        return FakeResponse(url, self.files.get(os.path.basename(url)))
+
+
+@pytest.fixture
+def server(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(mirror, 'get_session', lambda: session)
+    # one second per call, for ordering the uses of the files
+    clock = itertools.count(1000)
+    monkeypatch.setattr(mirror, 'time', types.SimpleNamespace(time=lambda: next(clock)))
+    return session
+
+
+def _sha256(name):
+    return hashlib.sha256(FILES[name]).hexdigest()
+
+
+def test_fetch_once(server, tmp_path):
+    store = ArtifactMirror(str(tmp_path))
+    name = 'cisco-ftd-fp2k.6.4.0-102.SPA'
+    path = store.fetch(BUILD_SERVER + name)
+    assert path == str(tmp_path / 'files' / name)
+    with open(path, 'rb') as f:
+        assert f.read() == FILES[name]
+    # files/<name> is a hard link to the object
+    assert os.path.samefile(path, store._object_path(_sha256(name)))
+    entry = store.lookup(name)
+    assert (entry['sha256'], entry['size'], entry['source']) == (_sha256(name), 3000, BUILD_SERVER + name)
+
+    assert store.fetch(BUILD_SERVER + name) == path
+    assert store.fetch(BUILD_SERVER + name, sha256=_sha256(name)) == path
+    # another store on the same directory, as another process would use it
+    assert ArtifactMirror(str(tmp_path)).fetch(BUILD_SERVER + name) == path
+    assert server.downloads == [name]
+
+
+def test_concurrent_fetches_download_once(server, tmp_path):
+    server.delay = 0.2
+    store = ArtifactMirror(str(tmp_path))
+    name = 'cisco-ftd-fp2k.6.4.0-102.SPA'
+    paths = []
+    threads = [threading.Thread(target=lambda: paths.append(store.fetch(BUILD_SERVER + name)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(paths)) == 1 and len(paths) == 4
+    assert server.downloads == [name]
+
+
+def test_checksum_mismatch(server, tmp_path):
+    store = ArtifactMirror(str(tmp_path))
+    name = 'cisco-ftd-fp2k.6.4.0-102.SPA'
+    with pytest.raises(RuntimeError, match='checksum mismatch'):
+        store.fetch(BUILD_SERVER + name, sha256='0' * 64)
+    assert store.lookup(name) is None
+    assert os.listdir(str(tmp_path / 'tmp')) == []
+
+    # a file of the mirror with another checksum is downloaded again
+    store.fetch(BUILD_SERVER + name)
+    server.files[name] = b'rebuilt'
+    store.fetch(BUILD_SERVER + name, sha256=hashlib.sha256(b'rebuilt').hexdigest())
+    with open(store.file_path(name), 'rb') as f:
+        assert f.read() == b'rebuilt'
+    assert server.downloads == [name] * 3
+
+
+def test_missing_file(server, tmp_path):
+    store = ArtifactMirror(str(tmp_path))
+    with pytest.raises(requests.HTTPError):
+        store.fetch(BUILD_SERVER + 'missing.SPA')
+    assert os.listdir(str(tmp_path / 'tmp')) == []
+    assert store.lookup('missing.SPA') is None
+
+
+def test_least_recently_used_evicted(server, tmp_path):
+    store = ArtifactMirror(str(tmp_path), capacity=8000)
+    ftd, fxos, csp = list(FILES)
+    store.fetch(BUILD_SERVER + ftd)
+    store.fetch(BUILD_SERVER + fxos)
+    # ftd is used again, fxos becomes the least recently used
+    assert store.lookup(ftd) is not None
+    store.fetch(BUILD_SERVER + csp)
+    assert store.lookup(fxos) is None
+    assert not os.path.exists(store.file_path(fxos))
+    assert not os.path.exists(store._object_path(hashlib.sha256(FILES[fxos]).hexdigest()))
+    assert store.lookup(ftd) is not None and store.lookup(csp) is not None
+
+
+def test_object_shared_by_two_names_kept(server, tmp_path):
+    store = ArtifactMirror(str(tmp_path), capacity=6000)
+    ftd = 'cisco-ftd-fp2k.6.4.0-102.SPA'
+    server.files['copy.SPA'] = FILES[ftd]
+    store.fetch(BUILD_SERVER + ftd)
+    store.fetch(BUILD_SERVER + 'copy.SPA')
+    store.fetch(BUILD_SERVER + 'cisco-ftd.6.4.0.102.SPA.csp')
+    assert store.lookup(ftd) is None
+    # the object is still published as copy.SPA
+    assert os.path.exists(store._object_path(_sha256(ftd)))
+    assert store.lookup('copy.SPA') is not None
+
+
+def test_prefetch(server, tmp_path):
+    store = ArtifactMirror(str(tmp_path))
+    artifact = types.SimpleNamespace(url=BUILD_SERVER + 'cisco-ftd.6.4.0.102.SPA.csp')
+    results = store.prefetch([BUILD_SERVER + 'cisco-ftd-fp2k.6.4.0-102.SPA', artifact,
+                              BUILD_SERVER + 'missing.SPA', None])
+    assert results['cisco-ftd-fp2k.6.4.0-102.SPA'] == store.file_path('cisco-ftd-fp2k.6.4.0-102.SPA')
+    assert results['cisco-ftd.6.4.0.102.SPA.csp'] == store.file_path('cisco-ftd.6.4.0.102.SPA.csp')
+    assert isinstance(results['missing.SPA'], requests.HTTPError)
+
+
+def test_endpoint_url():
+    assert MirrorEndpoint('tftp', '10.0.0.2', '/mirror/').url('a.SPA') == 'tftp://10.0.0.2/mirror/a.SPA'
+    assert MirrorEndpoint('http', '10.0.0.2').url('a.SPA') == 'http://10.0.0.2/a.SPA'
+    assert MirrorEndpoint('scp', '10.0.0.2', '/srv/mirror', 'kick', 'pwd').url('a.SPA') == \
+        'scp://kick@10.0.0.2:/srv/mirror/a.SPA'
+    assert MirrorEndpoint('scp', '10.0.0.2').port == 22
+
+
+@pytest.fixture
+def store(server, tmp_path, monkeypatch):
+    latencies = {'10.0.0.2': 0.01, '10.0.0.3': 0.002, '10.0.0.4': None}
+    monkeypatch.setattr(MirrorEndpoint, 'latency', lambda self: latencies[self.host])
+    store = ArtifactMirror(str(tmp_path), [MirrorEndpoint('http', '10.0.0.2', 'mirror'),
+                                           MirrorEndpoint('http', '10.0.0.3', 'mirror'),
+                                           MirrorEndpoint('scp', '10.0.0.2', '/srv/mirror', 'kick', 'k1ck'),
+                                           MirrorEndpoint('tftp', '10.0.0.4')])
+    store.fetch(BUILD_SERVER + 'cisco-ftd-fp2k.6.4.0-102.SPA')
+    return store
+
+
+def test_rewrite_to_the_nearest_endpoint(store):
+    assert store.nearest_endpoint().host == '10.0.0.3'
+    assert store.rewrite(BUILD_SERVER + 'cisco-ftd-fp2k.6.4.0-102.SPA', 'pwd') == \
+        ('http://10.0.0.3/mirror/cisco-ftd-fp2k.6.4.0-102.SPA', 'pwd')
+
+
+def test_rewrite_keeps_the_scheme(store):
+    assert store.rewrite('scp://root@10.1.1.1:/images/cisco-ftd-fp2k.6.4.0-102.SPA', 'pwd') == \
+        ('scp://kick@10.0.0.2:/srv/mirror/cisco-ftd-fp2k.6.4.0-102.SPA', 'k1ck')
+    # the only tftp endpoint is not reachable
+    url = 'tftp://10.1.1.1/images/cisco-ftd-fp2k.6.4.0-102.SPA'
+    assert store.rewrite(url, '') == (url, '')
+    url = 'https://10.1.1.1/images/cisco-ftd-fp2k.6.4.0-102.SPA'
+    assert store.rewrite(url, '') == (url, '')
+
+
+def test_rewrite_file_not_in_the_mirror(store):
+    url = BUILD_SERVER + 'fxos-k8-fp2k-lfbff.2.4.1.101.SPA'
+    assert store.rewrite(url, 'pwd') == (url, 'pwd')
+
+
+def test_rewrite_artifact_url(store, monkeypatch):
+    url = BUILD_SERVER + 'cisco-ftd-fp2k.6.4.0-102.SPA'
+    assert mirror.rewrite_artifact_url(url) == (url, '')
+    mirror.set_artifact_mirror(store)
+    try:
+        assert mirror.get_artifact_mirror() is store
+        assert mirror.rewrite_artifact_url(url)[0] == 'http://10.0.0.3/mirror/cisco-ftd-fp2k.6.4.0-102.SPA'
+        assert mirror.rewrite_artifact_url('') == ('', '')
+
+        def lookup(name):
+            raise PermissionError('index.json')
+
+        monkeypatch.setattr(store, 'lookup', lookup)
+        assert mirror.rewrite_artifact_url(url, 'pwd') == (url, 'pwd')
+    finally:
+        mirror.set_artifact_mirror(None)
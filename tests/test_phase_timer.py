@@ -0,0 +1,181 @@
+"""Phases of the baselines, see kick/device2/general/actions/phase_timer.py"""
+
+import json
+import types
+
+import pytest
+
+from kick.device2.general.actions import phase_timer
+from kick.device2.general.actions.phase_timer import PhaseTimer, timed_phases
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def strftime(self, format, moment):
+        return '20181001-120000'
+
+    def localtime(self, moment):
+        return moment
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(phase_timer, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def published(monkeypatch):
+    """Metrics recorded by the phase timers"""
+
+    published = []
+    monkeypatch.setattr(phase_timer, 'graphite', types.SimpleNamespace(
+        time_kick_metric=lambda name, seconds: published.append(('timer', name, seconds)),
+        increment_kick_metric=lambda name: published.append(('counter', name, 1)),
+        publish_kick_metric=lambda name, value: published.append(('point', name, value))))
+    return published
+
+
+class FakeLine:
+    """The part of a BasicLine used by the baselines to mark their phases"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.phase_timer = None
+        self.sm = types.SimpleNamespace(patterns=types.SimpleNamespace(hostname='FPR2130-1'))
+
+    def begin_phase(self, name, **metadata):
+        if self.phase_timer is not None:
+            self.phase_timer.begin(name, **metadata)
+
+    @timed_phases('kp')
+    def baseline_fp2k_ftd(self, fail_in=None):
+        for name, seconds in (('power_cycle', 60), ('download', 120), ('install', 600)):
+            self.begin_phase(name, image='cisco-ftd-fp2k.6.4.0-102.SPA')
+            self.clock.now += seconds
+            if name == fail_in:
+                raise RuntimeError('{} failed'.format(name))
+        self.configure()
+
+    @timed_phases('kp')
+    def configure(self):
+        self.begin_phase('configure')
+        self.clock.now += 30
+
+
+def test_phases_chained_with_begin(clock, published):
+    timer = PhaseTimer('kp', 'baseline_fp2k_ftd')
+    timer.begin('download')
+    clock.now += 10
+    timer.begin('install', image='a.SPA')
+    clock.now += 20
+    timer.finish()
+    assert [(p.name, p.duration, p.status) for p in timer.phases] == [('download', 10, 'ok'), ('install', 20, 'ok')]
+    assert timer.phases[1].metadata == {'image': 'a.SPA'}
+    assert published == [('timer', 'device.kp.baseline_fp2k_ftd.phase.download.duration', 10),
+                         ('timer', 'device.kp.baseline_fp2k_ftd.phase.install.duration', 20),
+                         ('timer', 'device.kp.baseline_fp2k_ftd.duration', 30),
+                         ('counter', 'device.kp.baseline_fp2k_ftd.ok', 1)]
+
+
+def test_phase_context_manager(clock, published):
+    timer = PhaseTimer('chassis', 'baseline')
+    with timer.phase('reboot'):
+        clock.now += 5
+    with pytest.raises(OSError):
+        with timer.phase('bootstrap'):
+            clock.now += 3
+            raise OSError('Input/output error')
+    assert [(p.name, p.status, p.error) for p in timer.phases] == \
+        [('reboot', 'ok', None), ('bootstrap', 'failed', 'Input/output error')]
+    # the phase ended inside the block is not ended twice
+    with timer.phase('verify'):
+        timer.begin('verify.ping')
+    assert [p.status for p in timer.phases[2:]] == ['ok', 'running']
+
+
+def test_running_phase(clock):
+    timer = PhaseTimer('kp', 'baseline')
+    record = timer.begin('install')
+    clock.now += 7
+    assert record.duration == 7
+    assert record.as_dict()['end'] is None and record.as_dict()['status'] == 'running'
+
+
+def test_timed_phases(clock, published):
+    line = FakeLine(clock)
+    line.baseline_fp2k_ftd()
+    assert line.phase_timer is None
+    timeline = line.last_timeline
+    assert (timeline['run'], timeline['device'], timeline['status'], timeline['duration']) == \
+        ('baseline_fp2k_ftd', 'FPR2130-1', 'ok', 810)
+    # the nested baseline adds its phase to the outer timeline
+    assert [(p['name'], p['duration']) for p in timeline['phases']] == \
+        [('power_cycle', 60), ('download', 120), ('install', 600), ('configure', 30)]
+    assert timeline['phases'][1]['metadata'] == {'image': 'cisco-ftd-fp2k.6.4.0-102.SPA'}
+    assert ('timer', 'device.kp.baseline_fp2k_ftd.duration', 810) in published
+    # and no run of its own
+    assert not [name for kind, name, value in published if name.startswith('device.kp.configure.')]
+
+
+def test_timed_phases_failure(clock, published):
+    line = FakeLine(clock)
+    with pytest.raises(RuntimeError):
+        line.baseline_fp2k_ftd(fail_in='download')
+    timeline = line.last_timeline
+    assert timeline['status'] == 'failed'
+    assert [(p['name'], p['status'], p['error']) for p in timeline['phases']] == \
+        [('power_cycle', 'ok', None), ('download', 'failed', 'download failed')]
+    assert ('counter', 'device.kp.baseline_fp2k_ftd.failed', 1) in published
+    assert line.phase_timer is None
+
+
+def test_begin_phase_outside_a_baseline(clock, published):
+    line = FakeLine(clock)
+    line.begin_phase('download')
+    assert published == []
+
+
+def test_timeline_written(clock, published, monkeypatch, tmp_path):
+    monkeypatch.setattr(phase_timer, 'TIMELINE_DIR', str(tmp_path))
+    FakeLine(clock).configure()
+    path = tmp_path / 'kp-configure-FPR2130-1-20181001-120000.json'
+    timeline = json.loads(path.read_text())
+    assert [p['name'] for p in timeline['phases']] == ['configure']
+
+
+def test_timeline_not_written(clock, published, monkeypatch, tmp_path):
+    # a file where the directory should be
+    blocker = tmp_path / 'timelines'
+    blocker.write_text('')
+    monkeypatch.setattr(phase_timer, 'TIMELINE_DIR', str(blocker))
+    line = FakeLine(clock)
+    line.configure()
+    assert line.last_timeline['status'] == 'ok'
+
+
+def test_metrics_without_timers(clock, monkeypatch):
+    published = []
+    monkeypatch.setattr(phase_timer, 'graphite', types.SimpleNamespace(
+        publish_kick_metric=lambda name, value: published.append((name, value))))
+    timer = PhaseTimer('kp', 'baseline')
+    timer.begin('install')
+    clock.now += 2
+    timer.finish(error=RuntimeError('no prompt'))
+    assert published == [('device.kp.baseline.phase.install.duration', 2),
+                         ('device.kp.baseline.duration', 2), ('device.kp.baseline.failed', 1)]
+    assert timer.phases[0].error == 'no prompt'
+
+
+def test_summary(clock, published):
+    timer = PhaseTimer('kp', 'baseline')
+    timer.begin('download')
+    clock.now += 12.34
+    timer.finish()
+    assert timer.summary() == 'kp baseline ok in 12.3s:\n  download                     12.3s  ok'
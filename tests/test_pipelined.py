@@ -0,0 +1,73 @@
+"""Pipelined commands of the lines, see BasicLine.execute_pipelined() and split_pipelined_output()"""
+
+import re
+
+import pytest
+
+from kick.device2.general.actions.simulator import SimulatorConfig, connect_simulator
+from kick.device2.general.actions.stream import split_pipelined_output
+
+# fxos_prompt of kick/device2/kp/actions/patterns.py
+FXOS_PROMPT = re.compile(r'(firepower|firepower(-\d+)?)([ /\w\-\*\(\)]+)?# ')
+CMDS = ['top', 'scope firmware', 'show version']
+
+
+def test_split_echo_after_prompt():
+    chunks = ['top\r\nfirepower# ',
+              'scope firmware\r\nfirepower /firmware # ',
+              'show version\r\nVersion: 2.6(1.133)\r\nfirepower /firmware # ']
+    assert split_pipelined_output(chunks, FXOS_PROMPT, CMDS) == ['', '', 'Version: 2.6(1.133)']
+
+
+def test_split_typeahead_echo():
+    # all the echoes come before the first prompt
+    chunks = ['top\r\nscope firmware\r\nshow version\r\nfirepower# ',
+              'firepower /firmware # ',
+              'Version: 2.6(1.133)\r\nfirepower /firmware # ']
+    assert split_pipelined_output(chunks, FXOS_PROMPT, CMDS) == ['', '', 'Version: 2.6(1.133)']
+
+
+def test_split_wrapped_echo():
+    cmd = 'show ' + 'x' * 90
+    chunks = ['top\r\nfirepower# ',
+              'show ' + 'x' * 75 + ' \r' + 'x' * 15 + '\r\nout\r\nfirepower# ',
+              'show y\r\n\r\nfirepower# ']
+    assert split_pipelined_output(chunks, FXOS_PROMPT, ['top', cmd, 'show y']) == ['', 'out', '']
+    chunks[1] = 'show ' + 'x' * 75 + '\r\n' + 'x' * 15 + '\r\nout\r\nfirepower# '
+    assert split_pipelined_output(chunks, FXOS_PROMPT, ['top', cmd, 'show y']) == ['', 'out', '']
+
+
+def test_split_unanswered_commands():
+    # the echoes of the commands without output yet are removed too
+    chunks = ['top\r\nscope firmware\r\nshow version\r\nfirepower# ']
+    assert split_pipelined_output(chunks, FXOS_PROMPT, CMDS) == ['']
+
+
+def test_typeahead_echo_through_the_simulator(console):
+    _, _, client = console('kp', SimulatorConfig(typeahead_echo=True, latency=0.05))
+    client.read_until(r'firepower# $')
+    client.send(''.join('{}\n'.format(cmd) for cmd in CMDS))
+    chunks = [client.read_until(FXOS_PROMPT.pattern) for _ in CMDS]
+
+    # the device echoed the commands typed ahead before the first prompt
+    assert 'show version' in chunks[0]
+    outputs = split_pipelined_output(chunks, FXOS_PROMPT, CMDS)
+    assert outputs[:2] == ['', '']
+    assert outputs[2].startswith('Version: 2.6(1.133)')
+    assert 'show version' not in outputs[2]
+
+
+def test_execute_pipelined_on_a_kp_line():
+    pytest.importorskip('unicon.statemachine')
+    pytest.importorskip('munch')
+    from kick.device2.kp.actions.kp import Kp
+
+    line = connect_simulator(Kp('firepower'), 'kp', SimulatorConfig(typeahead_echo=True, latency=0.05),
+                             timeout=30)
+    try:
+        line.go_to('fxos_state')
+        outputs = line.execute_pipelined(CMDS)
+        assert outputs[2].startswith('Version: 2.6(1.133)')
+        assert line.execute_lines('top\nshow version', pipelined=True) == line.execute_lines('top\nshow version')
+    finally:
+        line.disconnect()
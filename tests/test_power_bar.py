@@ -0,0 +1,90 @@
+"""Power-bar sessions, see kick/device2/general/actions/power_bar.py"""
+
+import pytest
+
+from kick.device2.general.actions import power_bar
+from kick.device2.general.actions.power_bar import PowerBarSession
+
+
+class FakeTelnet:
+    """A power-bar answering 'Command successful' and the status of its outlets;
+    the status output of the outlets given as None is not recognized"""
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.unknown = [port for port, status in statuses.items() if status is None]
+        self.last = b''
+
+    def write(self, data):
+        self.last = data
+
+    def expect(self, prompt, timeout):
+        action, port = self.last.decode().split()
+        port = port.lstrip('.')
+        if action == 'status':
+            status = self.statuses[port]
+            if port in self.unknown:
+                return 0, None, b'Unknown command\r\nSwitched PDU: '
+            output = ' .A{}   Outlet_A   {}   \r\n'.format(port, status.pop(0) if len(status) > 1 else status[0])
+            return 0, None, output.encode() + b'Switched PDU: '
+        self.statuses[port] = [action.capitalize()]
+        return 0, None, b'  Command successful\r\n\r\nSwitched PDU: '
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(power_bar.time, 'sleep', lambda seconds: None)
+
+    def _session(**statuses):
+        session = PowerBarSession('pdu-1')
+        session.session = FakeTelnet(statuses)
+        return session
+    return _session
+
+
+def test_default_timeout():
+    assert PowerBarSession('pdu-1').timeout == power_bar.DEFAULT_SESSION_TIMEOUT
+
+
+def test_status(session):
+    pdu = session(**{'21': ['On']})
+    assert pdu.status('21') == 'On'
+    assert pdu.run('off', '21') == 'Command successful'
+    assert pdu.status('21') == 'Off'
+
+
+def test_wait_for_status(session):
+    pdu = session(**{'21': ['On', 'On', 'Off'], '22': ['Off']})
+    assert pdu.wait_for_status(['21', '22'], 'off', timeout=60, interval=0)
+    assert pdu.session.statuses['21'] == ['Off']
+
+
+def test_wait_for_status_timeout(session):
+    pdu = session(**{'21': ['On']})
+    assert not pdu.wait_for_status(['21'], 'off', timeout=0, interval=0)
+
+
+def test_unknown_status_is_not_a_failure(session):
+    pdu = session(**{'21': None, '22': ['Off', 'On']})
+    assert pdu.wait_for_status(['21', '22'], 'on', timeout=60, interval=0)
+
+
+def test_set_power_bar_ports(session, monkeypatch):
+    pdus = {}
+
+    def power_bar_session(server, user, pwd):
+        pdu = session(**{'21': ['On'], '22': None})
+        pdus[server] = pdu.session
+        pdu.open = lambda: pdu
+        return pdu
+
+    monkeypatch.setattr(power_bar, 'PowerBarSession', power_bar_session)
+    ports = power_bar.split_power_bar_ports('pdu-1, pdu-1, pdu-2', '21, 22, 21', 'admn,admn,admn', 'x,x,x')
+    assert list(ports.values()) == [['21', '22'], ['21']]
+    # the status of port 22 of pdu-1 is not recognized
+    assert power_bar.set_power_bar_ports(ports, 'off', status_interval=0)
+    assert pdus['pdu-1'].statuses == {'21': ['Off'], '22': ['Off']}
+    assert pdus['pdu-2'].statuses == {'21': ['Off'], '22': None}
@@ -0,0 +1,130 @@
+"""Fleet power cycles, see kick/device2/general/actions/power_orchestrator.py"""
+
+import pytest
+
+from kick.device2.general.actions import power_orchestrator
+from kick.device2.general.actions.power_orchestrator import PowerTarget, power_cycle_fleet, \
+    summarize_power_cycle
+
+
+class FakePowerBars:
+    """Outlets switched by set_power_bar_ports(); the outlets in stuck do not
+    switch the first times they are asked to"""
+
+    def __init__(self, stuck=None):
+        self.status = {}
+        self.stuck = dict(stuck or {})
+        self.calls = []
+
+    def set_power_bar_ports(self, power_bar_ports, action, status_timeout, status_interval):
+        self.calls.append((action, [(server, port) for (server, _, _), ports in power_bar_ports.items()
+                                    for port in ports]))
+        result = True
+        for (server, _, _), ports in power_bar_ports.items():
+            for port in ports:
+                if self.stuck.get((server, port)):
+                    self.stuck[(server, port)] -= 1
+                    result = False
+                else:
+                    self.status[(server, port)] = action.capitalize()
+        return result
+
+    def get_power_bar_ports_status(self, power_bar_ports):
+        return {(server, port): self.status.get((server, port))
+                for (server, _, _), ports in power_bar_ports.items() for port in ports}
+
+
+class FakeLine:
+    def __init__(self, error=None):
+        self.error = error
+        self.timeouts = []
+
+    def wait_until_device_on(self, timeout):
+        self.timeouts.append(timeout)
+        if self.error:
+            raise self.error
+
+
+@pytest.fixture
+def power_bars(monkeypatch):
+    bars = FakePowerBars()
+    monkeypatch.setattr(power_orchestrator, 'set_power_bar_ports', bars.set_power_bar_ports)
+    monkeypatch.setattr(power_orchestrator, 'get_power_bar_ports_status', bars.get_power_bar_ports_status)
+    bars.sleeps = []
+    monkeypatch.setattr(power_orchestrator.time, 'sleep', bars.sleeps.append)
+    return bars
+
+
+def _targets(count, **kwargs):
+    return [PowerTarget('fp{}'.format(i), 'pdu-{}'.format(i % 2), str(20 + i), **kwargs) for i in range(count)]
+
+
+def test_power_on_waves(power_bars):
+    results = power_cycle_fleet(_targets(5), wave_size=2, wave_interval=10, off_time=60)
+    assert power_bars.calls[0] == ('off', [('pdu-0', '20'), ('pdu-0', '22'), ('pdu-0', '24'),
+                                           ('pdu-1', '21'), ('pdu-1', '23')])
+    assert [ports for action, ports in power_bars.calls[1:]] == [
+        [('pdu-0', '20'), ('pdu-1', '21')], [('pdu-0', '22'), ('pdu-1', '23')], [('pdu-0', '24')]]
+    assert power_bars.sleeps == [60, 10, 10]
+    assert [r.target.name for r in results] == ['fp0', 'fp1', 'fp2', 'fp3', 'fp4']
+    assert all(r.success and r.ready is None for r in results)
+
+
+def test_retry_only_the_targets_not_switched(power_bars):
+    power_bars.stuck = {('pdu-1', '21'): 1}
+    targets = _targets(3)
+    results = power_cycle_fleet(targets, wave_size=3, off_time=0)
+    # the outlets of fp0 and fp2 are not toggled twice
+    assert power_bars.calls[:2] == [('off', [('pdu-0', '20'), ('pdu-0', '22'), ('pdu-1', '21')]),
+                                    ('off', [('pdu-1', '21')])]
+    assert all(r.powered_off and r.powered_on for r in results)
+
+
+def test_failed_retry(power_bars):
+    power_bars.stuck = {('pdu-1', '21'): 2}
+    results = power_cycle_fleet(_targets(2), off_time=0)
+    assert [(r.powered_off, r.powered_on) for r in results] == [(True, True), (False, True)]
+    assert [r.success for r in results] == [True, False]
+
+
+def test_multiple_outlets_per_target(power_bars):
+    target = PowerTarget('fp9300', 'pdu-0, pdu-1', '11, 12', 'admn, admn', 'x, x')
+    assert list(target.power_bar_ports().values()) == [['11'], ['12']]
+    power_bars.stuck = {('pdu-1', '12'): 1}
+    result, = power_cycle_fleet([target], off_time=0)
+    assert result.success
+    assert power_bars.calls[1] == ('off', [('pdu-0', '11'), ('pdu-1', '12')])
+
+
+def test_boot_tracking(power_bars):
+    lines = [FakeLine(), FakeLine(RuntimeError('no prompt')), None]
+    targets = [PowerTarget('fp{}'.format(i), 'pdu-0', str(i), line=line) for i, line in enumerate(lines)]
+    results = power_cycle_fleet(targets, wave_size=1, off_time=0, boot_timeout=300)
+    assert [r.ready for r in results] == [True, False, None]
+    assert lines[0].timeouts == lines[1].timeouts == [300]
+    assert str(results[1].error) == 'no prompt'
+    assert [r.success for r in results] == [True, False, True]
+
+    summary = summarize_power_cycle(results)
+    assert summary.splitlines()[0] == '2 of 3 devices power cycled successfully'
+    assert '  fp1: off=True on=True ready=False' in summary
+    assert '  fp0: off=True on=True ready=True, booted in 0.0 seconds' in summary
+
+
+def test_no_boot_tracking(power_bars):
+    line = FakeLine()
+    power_cycle_fleet([PowerTarget('fp0', 'pdu-0', '1', line=line)], off_time=0,
+                      wait_until_device_is_on=False)
+    assert line.timeouts == []
+
+
+def test_unique_names(power_bars):
+    with pytest.raises(ValueError):
+        power_cycle_fleet([PowerTarget('fp0', 'pdu-0', '1'), PowerTarget('fp0', 'pdu-0', '2')])
+    assert power_bars.calls == []
+
+
+def test_targets_from_settings():
+    target = PowerTarget.from_chassis_power_data('fp0', {'power_bar_server': 'pdu-0', 'power_bar_port': '7',
+                                                         'power_bar_user': 'admn', 'power_bar_password': 'x'})
+    assert list(target.power_bar_ports().items()) == [(('pdu-0', 'admn', 'x'), ['7'])]
@@ -0,0 +1,97 @@
+"""Reconnect backoff of the lines, see BasicLine.do_reconnect()"""
+
+import pytest
+
+pytest.importorskip('unicon.statemachine')
+
+from kick.device2.general.actions import basic
+from kick.device2.general.actions.basic import BasicLine
+
+IO_ERROR = OSError('Input/output error')
+
+
+class FakeStateMachine:
+    current_state = 'fxos_state'
+
+
+def _line(feature, failures, monkeypatch):
+    """A BasicLine whose reconnect attempts fail failures times, without a device"""
+
+    line = BasicLine.__new__(BasicLine)
+    line._reconnect_feature = {'enabled': False, 'max_retries': 0}
+    line.reconnect_history = []
+    line.sm = FakeStateMachine()
+    line.reconnect_feature = feature
+    line.attempts = 0
+
+    def do_reconnect_(timeout):
+        line.attempts += 1
+        if line.attempts <= failures:
+            raise OSError('connection refused')
+
+    line.do_reconnect_ = do_reconnect_
+    line.sleeps = []
+    line.metrics = []
+    monkeypatch.setattr(basic.time, 'sleep', line.sleeps.append)
+    monkeypatch.setattr(basic.graphite, 'publish_kick_metric', lambda name, value: line.metrics.append(name))
+    return line
+
+
+def test_backoff_doubles_up_to_the_maximum(monkeypatch):
+    line = _line({'enabled': True, 'max_retries': 6, 'backoff': 2, 'max_backoff': 10, 'jitter': 0},
+                 failures=5, monkeypatch=monkeypatch)
+    line.do_reconnect(IO_ERROR)
+    assert line.attempts == 6
+    assert line.sleeps == [2, 4, 8, 10, 10]
+    assert [r['success'] for r in line.reconnect_history] == [False] * 5 + [True]
+    assert [r['attempt'] for r in line.reconnect_history] == [1, 2, 3, 4, 5, 6]
+    assert line.metrics.count('device.basic.reconnect.duration') == 6
+    assert line.metrics.count('device.basic.reconnect.failure') == 5
+    assert line.metrics.count('device.basic.reconnect.success') == 1
+
+
+def test_jitter_bounds(monkeypatch):
+    line = _line({'enabled': True, 'max_retries': 20, 'backoff': 4, 'max_backoff': 4, 'jitter': 0.25},
+                 failures=19, monkeypatch=monkeypatch)
+    line.do_reconnect(IO_ERROR)
+    assert len(line.sleeps) == 19
+    assert all(3 <= s <= 5 for s in line.sleeps)
+    assert len(set(line.sleeps)) > 1
+
+
+def test_gives_up_after_max_retries(monkeypatch):
+    line = _line({'enabled': True, 'max_retries': 3, 'backoff': 1, 'jitter': 0},
+                 failures=10, monkeypatch=monkeypatch)
+    with pytest.raises(OSError, match='connection refused'):
+        line.do_reconnect(IO_ERROR)
+    assert line.attempts == 3
+    # no sleep after the last attempt
+    assert line.sleeps == [1, 2]
+    assert not any(r['success'] for r in line.reconnect_history)
+
+
+def test_only_io_errors_are_handled(monkeypatch):
+    line = _line({'enabled': True, 'max_retries': 3}, failures=0, monkeypatch=monkeypatch)
+    error = RuntimeError('bad command')
+    with pytest.raises(RuntimeError):
+        line.do_reconnect(error)
+    assert line.attempts == 0
+
+
+def test_disabled_feature_raises(monkeypatch):
+    line = _line({'enabled': False}, failures=0, monkeypatch=monkeypatch)
+    with pytest.raises(OSError):
+        line.do_reconnect(IO_ERROR)
+    assert line.attempts == 0
+    assert line.reconnect_history == []
+
+
+@pytest.mark.parametrize('feature', [
+    {'enabled': True},
+    {'enabled': 'yes', 'max_retries': 3},
+    {'enabled': True, 'max_retries': 3, 'backoff': -1},
+    {'enabled': True, 'max_retries': 3, 'jitter': 'high'},
+])
+def test_invalid_settings(feature, monkeypatch):
+    with pytest.raises(RuntimeError):
+        _line(feature, failures=0, monkeypatch=monkeypatch)
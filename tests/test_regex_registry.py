@@ -0,0 +1,56 @@
+"""Shared compiled patterns of the lines, see kick/device2/general/actions/regex_registry.py"""
+
+import re
+
+from kick.device2.general.actions.regex_registry import COMMAND_ERRORS, RegexRegistry, compile_errors, \
+    compile_pattern, get_regex_registry
+
+
+class FakeState:
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+
+class FakeStateMachine:
+    """The part of a unicon StateMachine used by the registry"""
+
+    def __init__(self, **patterns):
+        self.states = {name: FakeState(pattern) for name, pattern in patterns.items()}
+
+    def get_state(self, name):
+        return self.states[name]
+
+
+def test_compile_pattern_is_cached():
+    regex = compile_pattern(r'firepower(\(local-mgmt\))?# $')
+    assert regex is compile_pattern(r'firepower(\(local-mgmt\))?# $')
+    assert compile_pattern(regex) is regex
+
+
+def test_compile_errors():
+    regex = compile_errors(COMMAND_ERRORS)
+    assert regex.search('% Invalid Command at \'^\' marker')
+    assert regex.search('ERROR: % Invalid input detected')
+    assert not regex.search('firepower# ')
+    assert RegexRegistry.command_errors.pattern == regex.pattern
+
+
+def test_prompt_recompiled_on_pattern_change():
+    sm = FakeStateMachine(fxos_state=r'firepower# $', fireos_state=r'\r\n> $')
+    registry = RegexRegistry(sm)
+    prompt = registry.prompt('fxos_state')
+    assert prompt.pattern == r'firepower# $'
+    assert registry.prompt('fxos_state') is prompt
+
+    # the hostname of the state machine changed
+    sm.states['fxos_state'].pattern = r'FPR4120-1-A# $'
+    assert registry.prompt('fxos_state').search('FPR4120-1-A# ')
+    assert registry.prompt('fireos_state').pattern == r'\r\n> $'
+
+
+def test_get_regex_registry():
+    sm = FakeStateMachine(fxos_state=r'firepower# $')
+    registry = get_regex_registry(sm)
+    assert get_regex_registry(sm) is registry
+    assert get_regex_registry(FakeStateMachine()) is not registry
+    assert registry.compile(re.compile(r'> $')).pattern == r'> $'
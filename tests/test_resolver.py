@@ -0,0 +1,119 @@
+"""Concurrent lookups of the build files, see kick/servers/resolver.py"""
+
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('requests')
+
+from kick.servers.resolver import ArtifactResolver, ResolvedArtifact
+
+SITE_A = 'http://10.106.134.200/'
+SITE_B = 'http://10.106.134.201/'
+ISO = 'Cisco_Firepower_Mgmt_Center-6.2.3-430-Restore.iso'
+PATTERNS = ['Sourcefire_Defense_Center_M4-6.2.3-430-Restore.iso',
+            'Cisco_Firepower_Mgmt_Center-6.2.3-430-Restore.iso']
+
+
+def devices(version, image=None, arch=None, feature=None):
+    return {'m4': {'patterns': PATTERNS, 'subdir': ['iso', 'iso/doNotRelease']}}
+
+
+class FakeSearch:
+    """Directories of the build servers: (site, subdir) -> files, with an optional delay"""
+
+    def __init__(self, listings, delays=None):
+        self.listings = listings
+        self.delays = delays or {}
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, site, branch, version, subdir, pattern):
+        with self.lock:
+            self.calls.append((site, subdir, pattern))
+        time.sleep(self.delays.get((site, subdir), 0))
+        listing = self.listings.get((site, subdir))
+        if isinstance(listing, Exception):
+            raise listing
+        return [f for f in listing or [] if pattern in f]
+
+
+def _resolver(search):
+    return ArtifactResolver(max_workers=4, search=search, devices=devices)
+
+
+def test_preferred_subdir_wins():
+    search = FakeSearch({(SITE_A, 'iso'): [ISO], (SITE_A, 'iso/doNotRelease'): [ISO]},
+                        delays={(SITE_A, 'iso'): 0.2})
+    artifact = _resolver(search).resolve([SITE_A], 'm4', 'Release', '6.2.3-430', image='Restore')
+    assert (artifact.site, artifact.subdir, artifact.name) == (SITE_A, 'iso', ISO)
+    assert artifact.path == 'Release/6.2.3-430/iso/' + ISO
+    assert artifact.url == SITE_A + 'Release/6.2.3-430/iso/' + ISO
+
+
+def test_order_of_the_patterns_kept():
+    m4_iso = 'Sourcefire_Defense_Center_M4-6.2.3-430-Restore.iso'
+    search = FakeSearch({(SITE_A, 'iso'): [ISO, m4_iso]})
+    assert _resolver(search).resolve([SITE_A], 'm4', 'Release', '6.2.3-430').name == m4_iso
+
+
+def test_site_without_the_file():
+    search = FakeSearch({(SITE_A, 'iso'): RuntimeError('listing failed'),
+                         (SITE_B, 'iso/doNotRelease'): [ISO]})
+    artifact = _resolver(search).resolve([SITE_A, SITE_B], 'm4', 'Release', '6.2.3-430')
+    assert (artifact.site, artifact.subdir) == (SITE_B, 'iso/doNotRelease')
+
+
+def test_first_site_found_wins():
+    search = FakeSearch({(SITE_A, 'iso'): [ISO], (SITE_B, 'iso'): [ISO]},
+                        delays={(SITE_B, 'iso'): 0.5, (SITE_B, 'iso/doNotRelease'): 0.5})
+    start_time = time.time()
+    artifact = _resolver(search).resolve([SITE_B, SITE_A], 'm4', 'Release', '6.2.3-430')
+    assert artifact.site == SITE_A
+    # the lookups in progress are not waited for
+    assert time.time() - start_time < 0.4
+
+
+def test_queued_lookups_cancelled():
+    search = FakeSearch({(SITE_A, 'iso'): [ISO]},
+                        delays={(SITE_A, 'iso'): 0.1, (SITE_A, 'iso/doNotRelease'): 0.1})
+    resolver = ArtifactResolver(max_workers=1, search=search, devices=devices)
+    assert resolver.resolve([SITE_A, SITE_B], 'm4', 'Release', '6.2.3-430').site == SITE_A
+    time.sleep(0.5)
+    assert not [call for call in search.calls if call[0] == SITE_B]
+
+
+def test_memoized():
+    search = FakeSearch({(SITE_A, 'iso'): [ISO]})
+    resolver = _resolver(search)
+    artifact = resolver.resolve([SITE_A], 'm4', 'Release', '6.2.3-430', image='Restore')
+    calls = len(search.calls)
+    assert resolver.resolve([SITE_A], 'm4', 'Release', '6.2.3-430', image='Restore') is artifact
+    assert len(search.calls) == calls
+    # another image is another lookup
+    resolver.resolve([SITE_A], 'm4', 'Release', '6.2.3-430', image='Autotest')
+    assert len(search.calls) > calls
+    resolver.clear()
+    assert resolver.resolve([SITE_A], 'm4', 'Release', '6.2.3-430', image='Restore') is not artifact
+
+
+def test_not_found_not_memoized():
+    search = FakeSearch({})
+    resolver = _resolver(search)
+    assert resolver.resolve([SITE_A, SITE_B], 'm4', 'Release', '6.2.3-430') is None
+    search.listings[(SITE_B, 'iso')] = [ISO]
+    assert resolver.resolve([SITE_A, SITE_B], 'm4', 'Release', '6.2.3-430').site == SITE_B
+
+
+def test_accept_and_build_dir():
+    search = FakeSearch({(SITE_A, 'iso'): [ISO + '.md5', ISO]})
+    artifact = _resolver(search).resolve([SITE_A], 'm4', 'Feature/SSL_OFFLOAD', '6.2.3-430',
+                                         build_dir='6.2.3-430.SSL_OFFLOAD',
+                                         accept=lambda f: f.endswith('.iso'))
+    assert artifact.name == ISO
+    assert artifact.path == 'Feature/SSL_OFFLOAD/6.2.3-430.SSL_OFFLOAD/iso/' + ISO
+
+
+def test_url_of_a_site_name():
+    assert ResolvedArtifact('ful', 'Release', '6.2.3-430', 'iso', ISO).url is None
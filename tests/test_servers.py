@@ -0,0 +1,213 @@
+"""Build server lookups, see kick/servers/servers.py"""
+
+import pytest
+
+requests = pytest.importorskip('requests')
+
+from kick.servers import servers
+from kick.servers.servers import ListingCache
+
+URL = 'http://ful-engfs.example.com/netboot/ims/Development/6.2.3-430/installers/'
+PAGE = ('<html><body><a href="../" title="../">Parent</a>'
+        '<a href="ftd-boot-9300-2.6.1.img" title="ftd-boot-9300-2.6.1.img">ftd-boot-9300-2.6.1.img</a>'
+        '<a href="Cisco_FTD_Upgrade-6.2.3-430.sh" title="Cisco_FTD_Upgrade-6.2.3-430.sh">'
+        'Cisco_FTD_Upgrade-6.2.3-430.sh</a></body></html>')
+IMAGES = ['ftd-boot-9300-2.6.1.img', 'Cisco_FTD_Upgrade-6.2.3-430.sh']
+
+
+class FakeResponse:
+    def __init__(self, status_code, text='', headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+        self.encoding = None
+        self.closed = False
+
+    def iter_content(self, chunk_size, decode_unicode):
+        for i in range(0, len(self.text), 64):
+            yield self.text[i:i + 64]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeServer:
+    """Answers the listing requests with the next responses, recording the headers"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def __call__(self, url, headers):
+        self.requests.append(dict(headers))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(servers.time, 'time', lambda: now[0])
+    return now
+
+
+def test_fresh_listing_not_fetched_again(clock, tmp_path):
+    cache = ListingCache(ttl=300, cache_dir=str(tmp_path))
+    server = FakeServer(FakeResponse(200, PAGE, {'ETag': '"abc"'}))
+    assert cache.get(URL, server) == IMAGES
+    clock[0] += 299
+    assert cache.get(URL, server) == IMAGES
+    assert cache.peek(URL) == IMAGES
+    assert len(server.requests) == 1
+
+
+def test_stale_listing_revalidated(clock, tmp_path):
+    cache = ListingCache(ttl=300, cache_dir=str(tmp_path))
+    server = FakeServer(FakeResponse(200, PAGE, {'ETag': '"abc"', 'Last-Modified': 'Mon, 01 Oct 2018'}),
+                        FakeResponse(304), requests.ConnectionError('connection reset'))
+    cache.get(URL, server)
+    clock[0] += 301
+    assert cache.peek(URL) is None
+    assert cache.get(URL, server) == IMAGES
+    assert server.requests[1] == {'If-None-Match': '"abc"', 'If-Modified-Since': 'Mon, 01 Oct 2018'}
+    # revalidated, fresh again
+    assert cache.peek(URL) == IMAGES
+    clock[0] += 301
+    # the stale listing is used when the server can not be reached
+    assert cache.get(URL, server) == IMAGES
+
+
+def test_disk_entry_promoted_to_memory(clock, tmp_path, monkeypatch):
+    ListingCache(cache_dir=str(tmp_path)).get(URL, FakeServer(FakeResponse(200, PAGE)))
+    cache = ListingCache(cache_dir=str(tmp_path))
+    assert cache.peek(URL) == IMAGES
+    assert URL in cache.entries
+
+    # the json is not read again
+    def load(f):
+        raise AssertionError('listing read from disk again')
+
+    monkeypatch.setattr(servers.json, 'load', load)
+    assert cache.get(URL, FakeServer()) == IMAGES
+
+
+def test_missing_directory_cached(clock, tmp_path):
+    cache = ListingCache(ttl=300, cache_dir=str(tmp_path))
+    server = FakeServer(FakeResponse(404), FakeResponse(200, PAGE))
+    assert cache.get(URL, server) == []
+    assert server.responses[0].status_code == 200
+    clock[0] += 299
+    assert cache.get(URL, server) == []
+    assert cache.peek(URL) == []
+    assert ListingCache(cache_dir=str(tmp_path)).peek(URL) == []
+    # the directory showed up
+    clock[0] += 2
+    assert cache.get(URL, server) == IMAGES
+    assert server.requests == [{}, {}]
+
+
+def test_server_error_not_cached(clock):
+    cache = ListingCache(cache_dir=None)
+    server = FakeServer(FakeResponse(503), FakeResponse(200, PAGE))
+    assert cache.get(URL, server) == []
+    assert cache.get(URL, server) == IMAGES
+
+
+def test_unreachable_server_without_listing(clock):
+    cache = ListingCache(cache_dir='')
+    with pytest.raises(requests.ConnectionError):
+        cache.get(URL, FakeServer(requests.ConnectionError('no route to host')))
+    assert cache.entries == {}
+
+
+def test_first_match_remembers_missing_directory(clock, monkeypatch):
+    monkeypatch.setattr(servers, 'LISTING_CACHE', ListingCache(cache_dir=None))
+    server = FakeServer(FakeResponse(404))
+    monkeypatch.setattr(servers, '_fetch', server)
+    for _ in range(3):
+        assert servers.search_engfs_first_match('http://ful-engfs.example.com/', 'Development',
+                                                '6.2.3-430', pattern=r'\.sh$') is None
+    assert len(server.requests) == 1
+
+
+def test_link_extractor_chunks_split_anywhere():
+    for size in (1, 7, 50, len(PAGE)):
+        parser = servers.LinkExtractor()
+        images = []
+        for i in range(0, len(PAGE), size):
+            parser.feed(PAGE[i:i + size])
+            images.extend(parser.pop_images())
+        parser.close()
+        images.extend(parser.pop_images())
+        assert images == IMAGES
+        assert parser.pop_images() == []
+
+
+def test_link_extractor_only_images():
+    page = ('<a href="a.iso" title="a.iso">a.iso</a>'
+            '<a href="b.iso" title="b.iso">download</a>'
+            '<a href="c.iso">c.iso</a>'
+            '<a href="d&amp;e.iso" title="d&amp;e.iso">d&amp;e.iso</a>'
+            '<a href="f.iso" title="f.iso"><b>f</b>.iso</a>'
+            '<pre>g.iso</pre>')
+    assert servers.parse_listing(page) == ['a.iso', 'd&e.iso', 'f.iso']
+
+
+def test_iter_listing_stops_the_download():
+    chunks = FakeResponse(200, PAGE * 100)
+    listing = servers.iter_listing(servers._iter_text(chunks))
+    assert next(listing) == IMAGES[0]
+    listing.close()
+    assert chunks.closed
+    assert chunks.encoding == 'utf-8'
+
+
+def test_artifact_catalog_memoized():
+    catalog = servers.get_artifact_catalog('6.2.3-430', 'Restore')
+    assert servers.get_artifact_catalog('6.2.3-430', 'Restore') is catalog
+    assert servers.get_artifact_catalog('6.2.3-430', 'Autotest') is not catalog
+    assert all(hasattr(p, 'search') for p in catalog['m4'].patterns)
+
+
+def test_devices_dict_from_the_catalog():
+    devices = servers.get_devices_dict('6.2.3-430', 'Restore', 'x86_64', 'MARIADB')
+    assert devices['m4'] == {
+        'patterns': ['Sourcefire_Defense_Center_M4-6.2.3-430.MARIADB-Restore.iso',
+                     'Cisco_Firepower_Mgmt_Center-6.2.3-430.MARIADB-Restore.iso',
+                     'Sourcefire_Defense_Center-6.2.3-430.MARIADB-Restore.iso'],
+        'subdir': ['iso', 'iso/doNotRelease']}
+    assert devices['s3']['boot_images'] == {'os/x86_64/boot': 'bzImage.*', 'os/x86_64/ramdisks': 'usb-ramdisk*'}
+    assert 'boot_images' not in devices['kp']
+    assert devices['kenton']['patterns'][0] == r'ftd-[\d\.-]+.MARIADB.pkg'
+    # the dictionaries are copies, the memoized catalog is not changed
+    devices['m4']['subdir'].append('tmp')
+    assert servers.get_devices_dict('6.2.3-430', 'Restore', 'x86_64', 'MARIADB')['m4']['subdir'] == \
+        ['iso', 'iso/doNotRelease']
+
+
+def test_artifact_entry():
+    entry = servers.get_artifact_catalog('6.2.3-430', 'Restore')['m4']
+    assert entry['subdir'] == ('iso', 'iso/doNotRelease')
+    with pytest.raises(KeyError):
+        entry['boot']
+    listing = ['Sourcefire_Defense_Center-6.2.3-430-Restore.iso', 'index.html',
+               'Cisco_Firepower_Mgmt_Center-6.2.3-430-Restore.iso',
+               'Sourcefire_Defense_Center_M4-6.2.3-430-Restore.iso']
+    assert entry.match('index.html') is None
+    assert entry.match(listing[2]) == 1
+    assert entry.classify(listing) == [listing[3], listing[2], listing[0]]
+
+
+def test_artifact_catalog_classify():
+    catalog = servers.get_artifact_catalog('6.2.3-430', 'Restore')
+    listing = ['fxos-k8-fp2k-lfbff.2.3.1.73.SPA', 'cisco-ftd-fp2k.6.2.3-430.SPA',
+               'Cisco_Firepower_Mgmt_Center-6.2.3-430-Restore.iso', 'readme.txt']
+    assert catalog.match('Cisco_Firepower_Mgmt_Center-6.2.3-430-Restore.iso') == \
+        [('m3', 2), ('m4', 1), ('m5', 1), ('s3fmc', 1)]
+    assert catalog.match('readme.txt') == []
+    found = catalog.classify(listing, platforms=['kp', 'm4', 'ssp'])
+    assert found == {'kp': ['cisco-ftd-fp2k.6.2.3-430.SPA', 'fxos-k8-fp2k-lfbff.2.3.1.73.SPA'],
+                     'm4': ['Cisco_Firepower_Mgmt_Center-6.2.3-430-Restore.iso'], 'ssp': []}
+    assert set(catalog.classify(listing)) == set(catalog)
@@ -0,0 +1,165 @@
+"""Offline simulator, at the console and through the lines, see kick/device2/general/actions/simulator.py"""
+
+import os
+import re
+import shlex
+import subprocess
+
+import pytest
+
+from kick.device2.general.actions.simulator import MORE_PROMPT, SimulatorConfig, connect_simulator, \
+    simulator_command
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TIMEOUT = 10
+
+
+def test_kp_paging(console):
+    _, _, client = console('kp', SimulatorConfig(page_length=5, output_volume=12))
+    client.read_until(r'firepower# $')
+    client.send('show tech-support\r')
+    page = client.read_until(re.escape(MORE_PROMPT))
+    assert page.count('kp line') == 5
+    assert 'kp line 000004' in page
+
+    # space shows the next page, q stops the output
+    client.send(' ')
+    page = client.read_until(re.escape(MORE_PROMPT))
+    assert page.count('kp line') == 5
+    assert 'kp line 000009' in page
+    client.send('q')
+    rest = client.read_until(r'firepower# $')
+    assert 'kp line' not in rest
+
+
+def test_kp_terminal_length_disables_paging(console):
+    _, _, client = console('kp', SimulatorConfig(page_length=5, output_volume=12))
+    client.read_until(r'firepower# $')
+    client.send('terminal length 0\r')
+    client.read_until(r'firepower# $')
+    client.send('show tech-support\r')
+    output = client.read_until(r'firepower# $')
+    assert MORE_PROMPT not in output
+    assert output.count('kp line') == 12
+
+
+def test_kp_secret_echo(console):
+    _, _, client = console('kp')
+    client.read_until(r'firepower# $')
+    client.send('connect ftd\r')
+    client.read_until(r'\n> $')
+    client.send('expert\r')
+    client.read_until(r'admin@firepower:~\$ $')
+    client.send('sudo su -\r')
+    output = client.read_until(r'Password: $')
+    assert 'sudo su -' in output
+    client.send('Admin123\r')
+    output = client.read_until(r'root@firepower:/home/admin# $')
+    assert 'Admin123' not in output
+
+
+def test_kp_login_password_not_echoed(console):
+    device, _, client = console('kp', state='prelogin')
+    client.read_until(r'firepower login: $')
+    client.send('admin\r')
+    assert 'admin' in client.read_until(r'Password: $')
+    client.send('Admin123\r')
+    output = client.read_until(r'firepower# $')
+    assert 'Admin123' not in output
+    assert device.state == 'fxos'
+
+
+def test_kp_terminal_server_login(console):
+    _, _, client = console('kp', username='lab', password='lab123')
+    client.read_until(r'Username: $')
+    client.send('lab\r')
+    client.read_until(r'Password: $')
+    client.send('lab123\r')
+    output = client.read_until(r'firepower# $')
+    assert 'lab123' not in output
+    assert 'Password OK' in output
+
+
+def test_mio_scopes(console):
+    _, _, client = console('mio')
+    client.read_until(r'firepower# $')
+    client.send('scope security\r')
+    client.read_until(r'firepower /security # $')
+    client.send('scope local-user admin\r')
+    client.read_until(r'firepower /security/local-user # $')
+    client.send('up\r')
+    client.read_until(r'firepower /security # $')
+    client.send('top\r')
+    client.read_until(r'\nfirepower# $')
+    client.send('bogus\r')
+    assert '% Invalid Command' in client.read_until(r'firepower# $')
+
+
+def test_mio_disconnect_keeps_state(console, telnet):
+    device, server, client = console('mio', SimulatorConfig(seed=1))
+    client.read_until(r'firepower# $')
+    client.send('connect local-mgmt\r')
+    client.read_until(r'firepower\(local-mgmt\)# $')
+    server.config.disconnect_rate = 1.0
+    client.send('dir\r')
+    # the console is closed before the command runs
+    assert 'mio line' not in client.read_all()
+    assert device.stats['disconnects'] == 1
+    assert device.stats['commands'] == 2
+
+    # a new session lands where the device was left
+    server.config.disconnect_rate = 0.0
+    telnet(server.address).read_until(r'firepower\(local-mgmt\)# $')
+    assert device.stats['sessions'] == 2
+
+
+def test_serve_stdio_mio():
+    args = shlex.split(simulator_command('mio', SimulatorConfig(page_length=3, output_volume=5),
+                                         hostname='FPR9K-1-A'))
+    result = subprocess.run(args, input=b'scope chassis 1\rshow detail\r top\r', cwd=ROOT,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=TIMEOUT, check=True)
+    output = result.stdout.decode('utf-8')
+    assert output.startswith('FPR9K-1-A# ')
+    assert 'FPR9K-1-A /chassis # ' in output
+    assert output.count(MORE_PROMPT) == 1
+    assert output.count('mio line') == 5
+    assert output.endswith('FPR9K-1-A# ')
+
+
+@pytest.fixture
+def kp_line():
+    """A KpLine driving the kp personality of the simulator: kp_line(config=None, state=None) -> line"""
+
+    pytest.importorskip('unicon.statemachine')
+    pytest.importorskip('munch')
+    from kick.device2.kp.actions.kp import Kp
+
+    lines = []
+
+    def connect(config=None, state=None):
+        lines.append(connect_simulator(Kp('firepower'), 'kp', config, state=state, timeout=30))
+        return lines[-1]
+
+    yield connect
+    for line in lines:
+        line.disconnect()
+
+
+def test_kp_line_states(kp_line):
+    line = kp_line(SimulatorConfig(latency=0.01))
+    line.go_to('fxos_state')
+    assert 'Version: 2.6(1.133)' in line.execute('show version')
+    line.go_to('fireos_state')
+    assert 'Threat Defense' in line.execute('show version')
+    line.go_to('sudo_state')
+    assert line.sm.current_state == 'sudo_state'
+    line.go_to('fxos_state')
+    assert line.sm.current_state == 'fxos_state'
+
+
+def test_kp_line_execute_lines(kp_line):
+    line = kp_line(SimulatorConfig(latency=0.01))
+    line.go_to('fxos_state')
+    output = line.execute_lines('top\nscope firmware\nshow version')
+    assert 'Version: 2.6(1.133)' in output
+    assert line.sm.current_state == 'fxos_state'
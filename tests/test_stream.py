@@ -0,0 +1,138 @@
+"""Stream matchers of the lines, see kick/device2/general/actions/stream.py"""
+
+import re
+
+from kick.device2.general.actions.stream import COMPILED_CACHE_SIZE, AnsiStripper, ByteAnsiStripper, \
+    BytePromptMatcher, PromptMatcher, compile_bytes_pattern, compile_cached, strip_ansi
+
+
+def test_strip_ansi():
+    assert strip_ansi('\x1b[1;32mfirepower\x1b[0m# ') == 'firepower# '
+    assert strip_ansi('\x1b]0;root@firepower\x07> ') == 'root@firepower\x07> '
+
+
+def test_ansi_stripper_split_escape():
+    stripper = AnsiStripper()
+    assert stripper.feed('show version\r\n\x1b[') == 'show version\r\n'
+    assert stripper.feed('1;3') == ''
+    assert stripper.feed('2mfirepower\x1b[0m# ') == 'firepower# '
+    assert stripper.flush() == ''
+
+
+def test_ansi_stripper_flush():
+    stripper = AnsiStripper()
+    assert stripper.feed('firepower# \x1b') == 'firepower# '
+    assert stripper.flush() == '\x1b'
+    assert stripper.pending == ''
+
+
+def test_prompt_matcher_split_prompt():
+    matcher = PromptMatcher(r'firepower# $')
+    assert matcher.feed('show version\r\nVersion: 2.6\r\nfire') is None
+    assert matcher.feed('') is None
+    match = matcher.feed('power# ')
+    assert match.match_output == 'show version\r\nVersion: 2.6\r\nfirepower# '
+    assert match.remainder == ''
+    assert match.last_match_index == 0
+
+
+def test_prompt_matcher_remainder():
+    matcher = PromptMatcher(re.compile(r'Password: '))
+    match = matcher.feed('login: admin\r\nPassword: extra')
+    assert match.match_output == 'login: admin\r\nPassword: '
+    assert match.remainder == 'extra'
+    assert matcher.output == 'login: admin\r\nPassword: extra'
+
+
+def test_prompt_matcher_list_first_in_output_wins():
+    matcher = PromptMatcher([r'> $', r'--More--', re.compile(r'Password: ')])
+    match = matcher.feed('line 1\r\n--More--')
+    assert match.last_match_index == 1
+    matcher = PromptMatcher([r'# ', r'Password: '])
+    match = matcher.feed('Password: firepower# ')
+    assert match.last_match_index == 1
+    assert match.match_output == 'Password: '
+
+
+def test_prompt_matcher_window():
+    matcher = PromptMatcher(r'firepower# ', window=16)
+    for i in range(1000):
+        assert matcher.feed('line {:04d} xxxxxxxxxxxxxxxxxxxxxxxx\r\n'.format(i)) is None
+    assert len(matcher.tail) <= 16 + 40
+    match = matcher.feed('firepower# ')
+    assert match.match_output.startswith('line 0000')
+    assert match.match_output.endswith('\r\nfirepower# ')
+
+
+def test_compile_bytes_pattern():
+    regex = compile_bytes_pattern(r'firepower# $')
+    assert regex.pattern == b'firepower# $'
+    assert compile_bytes_pattern(re.compile(r'firepower# $')) is regex
+    compiled = re.compile(b'> $')
+    assert compile_bytes_pattern(compiled) is compiled
+    assert compile_bytes_pattern(b'> $').pattern == b'> $'
+
+
+def test_byte_ansi_stripper_split_escape():
+    stripper = ByteAnsiStripper()
+    assert stripper.feed(b'boot\r\n\x1b') == b'boot\r\n'
+    assert stripper.feed(b'[0m\x1b]0;') == b''
+    assert stripper.feed(b'rommon 1 > ') == b'rommon 1 > '
+
+
+def test_byte_prompt_matcher_split_prompt():
+    matcher = BytePromptMatcher(r'rommon \d+ > $')
+    assert matcher.feed(b'Boot interrupted.\r\nromm') is None
+    match = matcher.feed(b'on 1 > ')
+    assert match.match_bytes == b'Boot interrupted.\r\nrommon 1 > '
+    assert match.match_output == 'Boot interrupted.\r\nrommon 1 > '
+    assert match.remainder == ''
+
+
+def test_byte_prompt_matcher_constant_memory():
+    matcher = BytePromptMatcher(r'Rebooting\.\.\.', window=64, keep_output=False)
+    for i in range(1000):
+        assert matcher.feed('boot line {:04d}\r\n'.format(i).encode()) is None
+        assert len(matcher.output) <= 64
+    match = matcher.feed(b'Rebooting... now')
+    assert match.match_output.endswith('Rebooting...')
+    assert match.remainder == ' now'
+
+
+def test_byte_prompt_matcher_strip_escapes():
+    matcher = BytePromptMatcher(r'\r\n> $', strip_escapes=True)
+    assert matcher.feed(b'exit\r\n\x1b[') is None
+    match = matcher.feed(b'0m> ')
+    assert match.match_output == 'exit\r\n> '
+    # without stripping, the escape sequence hides the prompt
+    matcher = BytePromptMatcher(r'\r\n> $')
+    assert matcher.feed(b'exit\r\n\x1b[0m> ') is None
+
+
+def test_compile_bytes_pattern_keeps_flags():
+    regex = compile_bytes_pattern(re.compile(r'^firepower login: ', re.IGNORECASE | re.MULTILINE))
+    assert regex.flags & re.IGNORECASE and regex.flags & re.MULTILINE
+    assert regex.search(b'Boot\r\nFIREPOWER LOGIN: ')
+    assert compile_bytes_pattern(r'^firepower login: ') is not regex
+
+
+def test_compile_cached_is_bounded():
+    assert compile_cached.cache_info().maxsize == COMPILED_CACHE_SIZE
+    assert compile_cached(r'rommon \d+ > ') is compile_cached(r'rommon \d+ > ')
+
+
+def test_byte_prompt_matcher_raw_remainder():
+    matcher = BytePromptMatcher(r'\r\n> ', strip_escapes=True)
+    match = matcher.feed(b'exit\r\n\x1b[0m> \x1b[1mshow\x1b[')
+    assert match.match_output == 'exit\r\n> '
+    # the escape sequences after the prompt, even a cut one, are given back
+    assert match.remainder_bytes == b'\x1b[1mshow\x1b['
+    assert matcher.stripper.pending == b''
+
+
+def test_byte_prompt_matcher_raw_remainder_after_held_back_escape():
+    matcher = BytePromptMatcher(r'> ', strip_escapes=True)
+    assert matcher.feed(b'exit\r\n\x1b[0') is None
+    match = matcher.feed(b'm> \x1b[K')
+    assert match.match_output == 'exit\r\n> '
+    assert match.remainder_bytes == b'\x1b[K'